@@ -17,26 +17,21 @@ $ python analyze.py data -u use_case
 """
 
 import argparse
+import glob
 import os
 import sys
 
 # directory structure
 from os import walk
 
-# parts of analysis
-import normalize
-import enrich
-import summarize
+# parts of analysis, stage modules are imported by their use cases
 import common
 
-import dbpedia_helper
-import wikidata_helper
-import mediawiki_helper
-import freebase_helper
-import viaf_helper
-import neo4j_manager
-import musicbrainz_helper
-import statistics
+import http_cache
+import http_client
+import rate_limiter
+import batch_lookup
+import record_store
 
 import time
 
@@ -55,11 +50,13 @@ MUSICBRAINZ_RECORDINGS_FILE = 'musicbrainz_recordings.csv'
 MAPPED_COMPOSITIONS_FILE = 'mapped_compositions.csv'
 MUSICBRAINZ_COMPOSITIONS_COUNT_FILE = 'musicbrainz_compositions_count.csv'
 BAND_INPUT_FILE = 'bands.csv'
+CORPUS_STATISTICS_FILE = 'corpus_statistics'
 MAPPED_BAND_FILE = 'mapped_bands.csv'
 
 
 NORMALIZE = 'normalize'
 ENRICH = 'enrich'
+RETRY_ENRICH = 'retry_enrich'
 SAME_AS = 'same_as'
 SUMMARIZE_AUTHORS = 'summarize_authors'
 SUMMARIZE_TITLES = 'summarize titles'
@@ -86,9 +83,23 @@ RETRIEVE_MUSICBRAINZ_WORKS_AND_RECORDINGS = 'retrieve_musicbrainz_works_and_reco
 MAP_COMPOSITION_DATA_IN_CSV = 'map_composition_data_in_csv'
 CALCULATE_MUSICBRAINZ_WORKS_AND_RECORDINGS_COUNT = 'calculate_musicbrainz_works_and_recordings_count'
 MAP_BAND_DATA_IN_CSV = 'map_band_data_in_csv'
+MIGRATE_JSON_CACHE = 'migrate_json_cache'
+CORPUS_STATISTICS = 'corpus_statistics'
 
 
-def analyze(inputdir, dirnames, use_case):
+# stage options of the command line, applied when the stage module is loaded
+enrich_settings = {'pipelined': False, 'batch_queries': False, 'prefetch': True}
+
+
+def load_enrich():
+
+    import enrich
+    enrich.configure_pipeline(enabled=enrich_settings['pipelined'], prefetch=enrich_settings['prefetch'])
+    enrich.configure_batching(enrich_settings['batch_queries'])
+    return enrich
+
+
+def analyze(inputdir, dirnames, use_case, packed=False, stream=False, workers=1, changed_only=False):
 
     mode_raw = 'raw'
     mode_normalized = 'normalized'
@@ -111,47 +122,74 @@ def analyze(inputdir, dirnames, use_case):
     #summarize.correct_authors(inputdir + common.SLASH + SUMMARY_AUTHORS_FILE)
 
     if use_case == NORMALIZE:
+        import normalize
         # normalize entities
         if mode_raw in dirnames:
             raw_files = os.listdir(raw_path)
             raw_files = [(raw_path + common.SLASH + element) for element in raw_files]
-            normalize.normalize_records(raw_files, normalized_path)
+            if stream:
+                normalize.normalize_dumps(raw_files, normalized_path, packed)
+            else:
+                normalize.normalize_incremental(raw_files, normalized_path, packed, workers)
         else:
             print 'Error. ' +  mode_raw + ' folder is missing.'
 
     if use_case == ENRICH:
+        import normalize
+        import summarize
+        enrich = load_enrich()
         # enrich entities with Europeana data using GND number
         if mode_normalized in dirnames:
-            normalized_files = os.listdir(normalized_path)
-            normalized_files = [(normalized_path + common.SLASH + element) for element in normalized_files]
-            enrich.enrich_records(normalized_files, enriched_path)
+            normalized_files = record_store.list_records(normalized_path)
+            changed_ids_file = normalize.changed_ids_path(normalized_path)
+            if changed_only and os.path.exists(changed_ids_file):
+                # enrich again only the records of the last incremental normalization
+                changed_files = record_store.select_records(
+                    normalized_files, record_store.read_record_ids(changed_ids_file))
+                enrich.enrich_records(changed_files, enriched_path, force=True, packed=packed)
+            else:
+                enrich.enrich_records(normalized_files, enriched_path, packed=packed)
+            removed_ids_file = normalize.removed_ids_path(normalized_path)
+            if os.path.exists(removed_ids_file):
+                # records whose source disappeared leave the enriched corpus and its summary
+                enrich.remove_enriched_records(record_store.read_record_ids(removed_ids_file), enriched_path, packed)
 
             # summarize statistics
             if mode_enriched in dirnames:
-                summarize.summarize_records(normalized_files, inputdir + '/summary_' + mode_normalized + '.csv')
-                enriched_files = os.listdir(enriched_path)
-                enriched_files = [(enriched_path + common.SLASH + element) for element in enriched_files]
-                summarize.summarize_records(enriched_files, inputdir + '/summary_' + mode_enriched + '.csv')
-                summarize.summarize_titles(normalized_files, inputdir + common.SLASH + SUMMARY_TITLES_FILE)
-                summarize.summarize_authors(normalized_files, inputdir + common.SLASH + SUMMARY_AUTHORS_FILE)
+                # record summaries are maintained incrementally
+                summarize.summarize_records_incremental(normalized_files, inputdir + '/summary_' + mode_normalized + '.csv')
+                enriched_files = record_store.list_records(enriched_path)
+                summarize.summarize_records_incremental(enriched_files, inputdir + '/summary_' + mode_enriched + '.csv')
+                summarize.summarize_corpus(normalized_files, [
+                    summarize.TitlesSummary(inputdir + common.SLASH + SUMMARY_TITLES_FILE),
+                    summarize.AuthorsSummary(inputdir + common.SLASH + SUMMARY_AUTHORS_FILE)])
             else:
                 print 'Error. ' + mode_enriched + ' folder is missing.'
         else:
             print 'Error. ' + mode_normalized + ' folder is missing.'
 
+    if use_case == RETRY_ENRICH:
+        enrich = load_enrich()
+        # enrich again records the enrichment journal lists as interrupted or failed
+        if mode_normalized in dirnames:
+            normalized_files = record_store.list_records(normalized_path)
+            enrich.enrich_records(normalized_files, enriched_path, packed=packed, retry_only=True)
+        else:
+            print 'Error. ' + mode_normalized + ' folder is missing.'
+
     if use_case == SAME_AS:
+        import summarize
         # summarize sameAs entries in enriched JSON
-        enriched_files = os.listdir(enriched_path)
-        enriched_files = [(enriched_path + common.SLASH + element) for element in enriched_files]
         if mode_enriched in dirnames:
+            enriched_files = record_store.list_records(enriched_path)
             summarize.summarize_sameas(enriched_files, inputdir + common.SLASH + SUMMARY_SAMEAS_FILE)
         else:
             print 'Error. ' + mode_enriched + ' folder is missing.'
 
     if use_case == SUMMARIZE_TITLES:
+        import summarize
         if mode_normalized in dirnames:
-            normalized_files = os.listdir(normalized_path)
-            normalized_files = [(normalized_path + common.SLASH + element) for element in normalized_files]
+            normalized_files = record_store.list_records(normalized_path)
 
             # summarize statistics
             if mode_enriched in dirnames:
@@ -162,9 +200,9 @@ def analyze(inputdir, dirnames, use_case):
             print 'Error. ' + mode_normalized + ' folder is missing.'
 
     if use_case == SUMMARIZE_AUTHORS:
+        import summarize
         if mode_normalized in dirnames:
-            normalized_files = os.listdir(normalized_path)
-            normalized_files = [(normalized_path + common.SLASH + element) for element in normalized_files]
+            normalized_files = record_store.list_records(normalized_path)
 
             # summarize statistics
             if mode_enriched in dirnames:
@@ -175,11 +213,14 @@ def analyze(inputdir, dirnames, use_case):
             print 'Error. ' + mode_normalized + ' folder is missing.'
 
     if use_case == DBPEDIA_ANALYSIS:
+        import dbpedia_helper
+        import summarize
         query_list = summarize.read_summary(inputdir + '/summary_titles.csv')
         dbpedia_helper.analyze_titles_by_dbpedia(query_list)
 
 
     if use_case == WIKIDATA_MAP:
+        import wikidata_helper
         # map entities employing Wikidata using GND number
         wikidata_helper.map_records(
             inputdir + common.SLASH + SUMMARY_AUTHORS_NEW_FILE
@@ -187,6 +228,7 @@ def analyze(inputdir, dirnames, use_case):
         )
 
     if use_case == MEIDAWIKI_MAP:
+        import mediawiki_helper
         # map entities employing MediaWiki API using GND number
         mediawiki_helper.map_records(
             inputdir + common.SLASH + SUMMARY_AUTHORS_NEW_FILE
@@ -194,49 +236,64 @@ def analyze(inputdir, dirnames, use_case):
         )
 
     if use_case == SUMMARIZE_COMPOSITIONS:
+        import freebase_helper
         freebase_helper.summarize_compositions()
 
     if use_case == ANALYZE_COMPOSITIONS:
+        import freebase_helper
         freebase_helper.analyze_compositions()
 
     if use_case == AGGREGATE_COMPOSITIONS_DATA:
+        import freebase_helper
         freebase_helper.aggregate_compositions_data()
 
     if use_case == RETRIEVE_WIKIDATA_COMPOSITIONS:
+        import freebase_helper
+        import wikidata_helper
         wikidata_helper.retrieve_wikidata_compositions_by_freebase_id(freebase_helper.COMPOSITIONS_DATA_FILE)
 
     if use_case == RETRIEVE_VIAF_DATA:
+        import viaf_helper
         viaf_helper.retrieve_authors_data_by_viaf_id(inputdir + common.SLASH + MAPPED_AUTHORS_FILE
                                                  , inputdir + common.SLASH + VIAF_COMPOSITIONS_FILE)
     if use_case == LOAD_MEDIAWIKI_PROPERTIES:
+        import mediawiki_helper
         mediawiki_helper.load_properties()
 
     if use_case == STORE_DATA_IN_NEO4J:
+        import neo4j_manager
         neo4j_manager.save_mapped_authors_from_csv(inputdir + common.SLASH + MAPPED_AUTHORS_FILE
                                                     , inputdir + common.SLASH + VIAF_COMPOSITIONS_FILE)
 
     if use_case == STORE_JSON_WIKIDATA_AUTHOR_DATA_IN_NEO4J:
+        import neo4j_manager
         neo4j_manager.save_json_wikidata_author_data_dir(common.WIKIDATA_AUTHOR_DATA_DIR)
 
     if use_case == SEARCH_IN_JSON_NEO4J:
+        import neo4j_manager
         neo4j_manager.search_in_json_neo4j('1268')
 
     if use_case == GET_EUROPEANA_FACETS_COLLECTION:
+        import wikidata_helper
         wikidata_helper.search_europeana_facets()
 
     if use_case == SAVE_MAPPING_VIAF_AUTHOR_COMPOSITIONS_IN_CSV:
+        import neo4j_manager
         neo4j_manager.save_mapping_viaf_authors_to_composition_count_in_csv(inputdir + common.SLASH + MAPPED_AUTHORS_FILE
                                                     , inputdir + common.SLASH + VIAF_COMPOSITIONS_FILE
                                                     , inputdir + common.SLASH + VIAF_COMPOSITIONS_COUNT_FILE)
 
     if use_case == SAVE_MAPPING_FREEBASE_AUTHOR_COMPOSITIONS_IN_CSV:
+        import freebase_helper
         freebase_helper.save_mapping_authors_to_composition_count_in_csv(freebase_helper.SUMMARY_COMPOSITIONS_FILE
                                                     , inputdir + common.SLASH + FREEBASE_COMPOSITIONS_COUNT_FILE)
 
     if use_case == RETRIEVE_MUSICBRAINZ_COMPOSITION_DATA:
+        import musicbrainz_helper
         musicbrainz_helper.retrieve_musicbrainz_composition_data(inputdir + common.SLASH + VIAF_COMPOSITIONS_FILE)
 
     if use_case == RETRIEVE_MUSICBRAINZ_WORKS_AND_RECORDINGS:
+        import musicbrainz_helper
         musicbrainz_helper.retrieve_musicbrainz_works_and_recordings(
             inputdir + common.SLASH + MAPPED_AUTHORS_FILE
             , inputdir + common.SLASH + MUSICBRAINZ_WORKS_FILE
@@ -244,9 +301,11 @@ def analyze(inputdir, dirnames, use_case):
         )
 
     if use_case == RETRIEVE_VIAF_COMPOSITION_DATA:
+        import viaf_helper
         viaf_helper.retrieve_viaf_composition_data(inputdir + common.SLASH + VIAF_COMPOSITIONS_FILE)
 
     if use_case == COMPREHENSIVE_COMPOSITION_STATISTIC:
+        import statistics
         statistics.retrieve_comprehensive_composition_count(
             inputdir + common.SLASH + MAPPED_AUTHORS_FILE
             , inputdir + common.SLASH + VIAF_COMPOSITIONS_FILE
@@ -255,37 +314,55 @@ def analyze(inputdir, dirnames, use_case):
         )
 
     if use_case == MAP_COMPOSITION_DATA_IN_CSV:
+        import statistics
         statistics.map_composition_data_in_csv(
             inputdir + common.SLASH + MUSICBRAINZ_WORKS_FILE
             , inputdir + common.SLASH + MAPPED_COMPOSITIONS_FILE)
 
     if use_case == CALCULATE_MUSICBRAINZ_WORKS_AND_RECORDINGS_COUNT:
+        import musicbrainz_helper
         musicbrainz_helper.calculate_musicbrainz_works_and_recordings_count(
             inputdir + common.SLASH + MAPPED_AUTHORS_FILE
             , inputdir + common.SLASH + MUSICBRAINZ_COMPOSITIONS_COUNT_FILE
         )
 
     if use_case == MAP_BAND_DATA_IN_CSV:
+        import statistics
         statistics.map_band_data_in_csv(
             inputdir + common.SLASH + BAND_INPUT_FILE
             , inputdir + common.SLASH + MAPPED_BAND_FILE)
 
+    if use_case == CORPUS_STATISTICS:
+        import corpus_statistics
+        # coverage, percentiles, histograms and cross tabs of the enriched records summary
+        summary_file = inputdir + '/summary_' + mode_enriched + '.csv'
+        if os.path.exists(summary_file):
+            corpus_statistics.corpus_statistics(summary_file, inputdir + common.SLASH + CORPUS_STATISTICS_FILE)
+        else:
+            print 'Error. ' + summary_file + ' is missing.'
+
+    if use_case == MIGRATE_JSON_CACHE:
+        # rewrite cached responses in data/*_dir with the selected JSON storage profile
+        for cachedir in glob.glob(inputdir + common.SLASH + '*_dir'):
+            common.migrate_json_dir(cachedir, common.json_storage['profile'], common.json_storage['compression'])
+
     print '+++ Analyzing completed +++'
 
 
 # Main analyzing routine
 
-def analyze_records(inputdir, use_case):
+def analyze_records(inputdir, use_case, packed=False, stream=False, workers=1, changed_only=False):
 
     start = time.time()
     print("Analyzing '" + inputdir + "' records for use case: " + use_case)
 
     for (dirpath, dirnames, filenames) in walk(inputdir):
-        analyze(inputdir, dirnames, use_case)
+        analyze(inputdir, dirnames, use_case, packed, stream, workers, changed_only)
         break
 
     end = time.time()
     print 'Calculation time:', end - start
+    rate_limiter.print_metrics()
 
 
 # Command line parsing
@@ -297,7 +374,7 @@ if __name__ == '__main__':
     parser.add_argument('inputdir', type=str, help="Input files to be processed")
     parser.add_argument('-u', '--use_case', type=str, nargs='?',
                     default="data/mapping.csv",
-                    help="Analysis use cases in given order, such as 'normalize', 'enrich', 'same_as', 'dbpedia_analysis', 'wikidata_map'"
+                    help="Analysis use cases in given order, such as 'normalize', 'enrich', 'retry_enrich', 'same_as', 'dbpedia_analysis', 'wikidata_map'"
                          ", 'mediawiki_map', 'summarize_compositions', 'analyze_compositions'"
                          ", 'aggregate_compositions_data', 'retrieve_wikidata_compositions'"
                          ", 'retrieve_viaf_data', 'load_mediawiki_properties', 'store_data_in_neo4j'"
@@ -305,11 +382,57 @@ if __name__ == '__main__':
                          ", 'get_europeana_facets_collection', 'save_mapping_viaf_author_compositions_in_csv'"
                          ", 'save_mapping_freebase_author_compositions_in_csv', 'retrieve_musicbrainz_composition_data'"
                          ", 'retrieve_viaf_composition_data', 'comprehensive_composition_statistic', 'summarize_authors'"
-                         ", 'summarize_titles', 'retrieve_musicbrainz_works_and_recordings', 'map_composition_data_in_csv', 'map_band_data_in_csv', 'cleanup'")
+                         ", 'summarize_titles', 'retrieve_musicbrainz_works_and_recordings', 'map_composition_data_in_csv', 'map_band_data_in_csv'"
+                         ", 'corpus_statistics', 'migrate_json_cache', 'cleanup'")
+    parser.add_argument('-p', '--packed', action='store_true',
+                    help="Store normalized and enriched records in packed record stores")
+    parser.add_argument('-s', '--stream', action='store_true',
+                    help="Raw files are multi-record Aleph dumps, normalize them as a stream")
+    parser.add_argument('-w', '--workers', type=int, nargs='?',
+                    default=1,
+                    help="Number of worker processes for normalization")
+    parser.add_argument('-c', '--changed_only', action='store_true',
+                    help="Enrich only records changed by the last normalization run")
+    parser.add_argument('--pipelined', action='store_true',
+                    help="Enrich records in concurrent GND, Europeana and writing stages")
+    parser.add_argument('--no_prefetch', action='store_true',
+                    help="Enrich record by record without planning the distinct remote lookups first")
+    parser.add_argument('--batch_queries', action='store_true',
+                    help="Combine the Europeana searches of several persons of a record into one query")
+    parser.add_argument('--json_profile', type=str, nargs='?',
+                    default=common.JSON_PROFILE_PRETTY, choices=[common.JSON_PROFILE_PRETTY, common.JSON_PROFILE_COMPACT],
+                    help="Layout of written JSON files")
+    parser.add_argument('--json_compression', type=str, nargs='?',
+                    default=None, choices=[common.JSON_COMPRESSION_GZIP, common.JSON_COMPRESSION_LZMA],
+                    help="Compression of written JSON files, detected automatically on read")
+    parser.add_argument('--cache_dir', type=str, nargs='?',
+                    default=http_cache.HTTP_CACHE_DIR,
+                    help="Directory of the HTTP response cache")
+    parser.add_argument('--cache_ttl', type=int, nargs='?',
+                    default=http_cache.HTTP_CACHE_TTL,
+                    help="Expiry of cached HTTP responses in seconds")
+    parser.add_argument('--cache_size', type=int, nargs='?',
+                    default=http_cache.HTTP_CACHE_MAX_SIZE / (1024 * 1024),
+                    help="Size cap of the HTTP response cache in MB")
+    parser.add_argument('--no_cache', action='store_true',
+                    help="Disable the HTTP response cache")
+    parser.add_argument('--lookup_workers', type=int, nargs='?',
+                    default=batch_lookup.LOOKUP_WORKERS,
+                    help="Number of concurrent remote lookups, e.g. for 'wikidata_map'")
+    parser.add_argument('--pool_size', type=int, nargs='?',
+                    default=http_client.HTTP_POOL_MAXSIZE,
+                    help="Number of keep-alive HTTP connections per host")
 
     if len(sys.argv) < 2:
         parser.print_help()
         sys.exit(1)
 
     args = parser.parse_args()
-    analyze_records(args.inputdir, args.use_case)
+    http_cache.configure(args.cache_dir, args.cache_ttl, args.cache_size * 1024 * 1024, not args.no_cache)
+    http_client.configure(pool_maxsize=args.pool_size)
+    common.configure_json_storage(args.json_profile, args.json_compression)
+    batch_lookup.configure(args.lookup_workers)
+    enrich_settings['pipelined'] = args.pipelined
+    enrich_settings['batch_queries'] = args.batch_queries
+    enrich_settings['prefetch'] = not args.no_prefetch
+    analyze_records(args.inputdir, args.use_case, args.packed, args.stream, args.workers, args.changed_only)
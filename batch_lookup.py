@@ -0,0 +1,64 @@
+"""
+Bounded concurrency engine for batches of independent remote lookups.
+
+Lookups run on a thread pool while results are yielded strictly in input
+order, so callers can keep writing their CSV rows sequentially. Requests
+issued by the lookups go through http_client and therefore stay within the
+per-host limits of rate_limiter.
+"""
+
+from multiprocessing.pool import ThreadPool
+
+
+LOOKUP_WORKERS = 8
+
+lookup_settings = {'workers': LOOKUP_WORKERS}
+
+
+def configure(workers=None):
+
+    if workers is not None:
+        lookup_settings['workers'] = workers
+
+
+def safe_lookup(lookup):
+
+    """Wrap lookup so that a failing item yields None instead of aborting the batch"""
+    def run(item):
+        try:
+            return lookup(item)
+        except Exception as e:
+            print 'Lookup error for item:', item, e
+            return None
+    return run
+
+
+def lookup_all(lookup, items, workers=None):
+
+    """Apply lookup to all items concurrently and yield results in input order"""
+    if workers is None:
+        workers = lookup_settings['workers']
+    run = safe_lookup(lookup)
+    if workers <= 1:
+        for item in items:
+            yield run(item)
+        return
+    pool = ThreadPool(workers)
+    try:
+        for result in pool.imap(run, items):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
+def unique(items):
+
+    """Distinct items in order of first appearance"""
+    seen = set()
+    res = []
+    for item in items:
+        if item not in seen:
+            seen.add(item)
+            res.append(item)
+    return res
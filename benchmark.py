@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+"""
+Script for benchmarking processing stages on recorded data.
+
+The 'normalize' benchmark normalizes raw Aleph records, reports parse and
+extraction time and compares the serialized output byte by byte with the
+files of a reference directory, e.g. the output of an earlier release.
+
+The 'sameas' benchmark extracts owl:sameAs links from recorded GND RDF/XML
+responses, named by GND number (e.g. 118576291.rdf), with the streaming
+extractor of gnd_helper and with the former BeautifulSoup implementation.
+
+Invocation:
+$ python benchmark.py normalize data/raw/*.xml -r data/normalized
+$ python benchmark.py sameas data/gnd_rdf/*.rdf
+"""
+
+import argparse
+import json
+import os
+import StringIO
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+import common
+import gnd_helper
+import normalize
+
+
+NORMALIZE = 'normalize'
+SAMEAS = 'sameas'
+BENCHMARK_REPEAT = 10
+
+
+def serialize_json(data):
+
+    """Same bytes as common.write_json_file with the pretty profile"""
+    content = json.dumps(data, sort_keys=True, indent=4, ensure_ascii=False, encoding='utf-8')
+    if isinstance(content, unicode):
+        content = content.encode('utf-8')
+    return content
+
+
+def benchmark_normalize(inputfiles, referencedir=None):
+
+    parse_time = 0.0
+    extract_time = 0.0
+    compared = 0
+    mismatches = []
+    for filename, record in common.read_records(inputfiles):
+        start = time.time()
+        soup = BeautifulSoup(record, "html.parser")
+        parse_time += time.time() - start
+        start = time.time()
+        normalized_record = normalize.normalize(record)
+        extract_time += time.time() - start
+        if referencedir:
+            reference_file = os.path.join(referencedir, os.path.basename(filename).replace("xml", "json"))
+            if os.path.exists(reference_file):
+                compared += 1
+                if serialize_json(normalized_record) != common.read_file_data(reference_file):
+                    mismatches.append(reference_file)
+
+    # normalize() parses as well, the difference is the extraction cost
+    print 'Records:', len(inputfiles)
+    print 'Parse time:', round(parse_time, 3), 's'
+    print 'Extraction time:', round(max(0.0, extract_time - parse_time), 3), 's'
+    print 'Total normalization time:', round(extract_time, 3), 's'
+    if referencedir:
+        print 'Compared with reference:', compared, 'mismatches:', len(mismatches)
+        for mismatch in mismatches:
+            print 'Mismatch:', mismatch
+    return len(mismatches) == 0
+
+
+def soup_sameas_uris(text):
+
+    """owl:sameAs extraction as done by enrich.collect_sameas_uris before the streaming extractor"""
+    soup = BeautifulSoup(text)
+    return [tag['rdf:resource'] for tag in soup.find_all('owl:sameas')]
+
+
+def benchmark_sameas(inputfiles, repeat=BENCHMARK_REPEAT):
+
+    soup_time = 0.0
+    stream_time = 0.0
+    early_stop_time = 0.0
+    mismatches = []
+    early_stop_differences = []
+    for filename in inputfiles:
+        content = common.read_file_data(filename)
+        gnd_uri = gnd_helper.GND_PREFIX + '/' + os.path.splitext(os.path.basename(filename))[0]
+        for i in range(repeat):
+            start = time.time()
+            expected = soup_sameas_uris(content)
+            soup_time += time.time() - start
+            start = time.time()
+            streamed = gnd_helper.extract_sameas_uris(StringIO.StringIO(content))
+            stream_time += time.time() - start
+            start = time.time()
+            stopped = gnd_helper.extract_sameas_uris(StringIO.StringIO(content), gnd_uri)
+            early_stop_time += time.time() - start
+        if streamed != expected:
+            mismatches.append(filename)
+        # links of other descriptions than the authority are left out with early stop
+        if stopped != expected:
+            early_stop_differences.append(filename)
+
+    print 'Documents:', len(inputfiles), 'repeat:', repeat
+    print 'BeautifulSoup time:', round(soup_time, 3), 's'
+    print 'Streaming time:', round(stream_time, 3), 's'
+    print 'Streaming time with early stop:', round(early_stop_time, 3), 's'
+    print 'Mismatches:', len(mismatches), 'differences with early stop:', len(early_stop_differences)
+    for mismatch in mismatches:
+        print 'Mismatch:', mismatch
+    for difference in early_stop_differences:
+        print 'Early stop difference:', difference
+    return len(mismatches) == 0
+
+
+# Command line parsing
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+                    description="Benchmark processing stages on recorded data.")
+    parser.add_argument('benchmark', type=str, choices=[NORMALIZE, SAMEAS],
+                    help="Benchmark to run")
+    parser.add_argument('inputfiles', type=str, nargs='+',
+                    help="Input files to be processed")
+    parser.add_argument('-r', '--referencedir', type=str, nargs='?',
+                    help="Directory with reference output to compare with")
+    parser.add_argument('-n', '--repeat', type=int, nargs='?',
+                    default=BENCHMARK_REPEAT,
+                    help="Number of runs per document")
+
+    if len(sys.argv) < 3:
+        parser.print_help()
+        sys.exit(1)
+
+    args = parser.parse_args()
+    if args.benchmark == NORMALIZE:
+        if not benchmark_normalize(args.inputfiles, args.referencedir):
+            sys.exit(1)
+    if args.benchmark == SAMEAS:
+        if not benchmark_sameas(args.inputfiles, args.repeat):
+            sys.exit(1)
@@ -8,8 +8,21 @@ import os
 import codecs
 from simplejson import JSONDecodeError
 import sys
-import requests
 import glob
+import threading
+import gzip
+import StringIO
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+import http_cache
+import http_client
 
 from os import walk
 
@@ -48,6 +61,17 @@ RELATIONS_JSON = 'relations'
 # Freebase
 FREEBASE_PREFIX = '/m/'
 
+# JSON storage profiles of write_json_file
+JSON_PROFILE_PRETTY = 'pretty'
+JSON_PROFILE_COMPACT = 'compact'
+JSON_COMPRESSION_GZIP = 'gzip'
+JSON_COMPRESSION_LZMA = 'lzma'
+MIGRATE_TMP_EXT = '.migrating'
+GZIP_MAGIC = '\x1f\x8b'
+LZMA_MAGIC = '\xfd7zXZ\x00'
+
+json_storage = {'profile': JSON_PROFILE_PRETTY, 'compression': None}
+
 # Neo4j
 RELATION_AUTHOR_TO_COMPOSITION = 'has_composition'
 COMPOSITION_AUTHOR_ID_HEADER = 'author id'
@@ -155,10 +179,14 @@ def progress(progress=0):
 
 def read_records(inputfiles):
 
-    for filename in inputfiles:
-        with codecs.open(filename, 'r', 'utf-8') as in_file:
-            data = in_file.read()
+    # packed record stores provide their own iterator
+    if hasattr(inputfiles, 'read_records'):
+        for filename, data in inputfiles.read_records():
             yield (filename, data)
+        return
+    for filename in inputfiles:
+        data = read_file_data(filename).decode('utf-8')
+        yield (filename, data)
 
 
 def ensure_directory(outputdir):
@@ -169,12 +197,90 @@ def ensure_directory(outputdir):
         os.makedirs(outputdir)
 
 
-def write_json_file(outputdir, filename, data):
+def configure_json_storage(profile=None, compression=None):
+
+    """Select layout (pretty or compact) and compression (None, gzip or lzma) of write_json_file"""
+    if profile is not None:
+        json_storage['profile'] = profile
+    if compression is not None:
+        json_storage['compression'] = compression or None
+    if json_storage['compression'] == JSON_COMPRESSION_LZMA and lzma is None:
+        raise ValueError('lzma compression requires the backports.lzma package')
+
+
+def compress_data(data, compression):
+
+    if compression == JSON_COMPRESSION_GZIP:
+        buf = StringIO.StringIO()
+        gz = gzip.GzipFile(fileobj=buf, mode='wb', mtime=0)
+        gz.write(data)
+        gz.close()
+        return buf.getvalue()
+    if compression == JSON_COMPRESSION_LZMA:
+        return lzma.compress(data)
+    return data
+
+
+# compressed files are detected by their magic bytes, so file names stay unchanged
+def decompress_data(data):
+
+    if data.startswith(GZIP_MAGIC):
+        return gzip.GzipFile(fileobj=StringIO.StringIO(data)).read()
+    if data.startswith(LZMA_MAGIC):
+        if lzma is None:
+            raise IOError('lzma compressed file requires the backports.lzma package')
+        return lzma.decompress(data)
+    return data
+
+
+def read_file_data(inputfile):
+
+    with open(inputfile, 'rb') as data_file:
+        return decompress_data(data_file.read())
+
+
+def write_json_file(outputdir, filename, data, profile=None, compression=None):
 
     ensure_directory(outputdir)
-    with codecs.open(outputdir + SLASH + filename, "w", 'utf-8') as out_file:
-            json.dump(data, out_file, sort_keys=True, indent=4,
-                      ensure_ascii=False, encoding='utf-8')
+    # None takes the configured storage, an empty compression forces plain files
+    if profile is None:
+        profile = json_storage['profile']
+    if compression is None:
+        compression = json_storage['compression']
+    if profile == JSON_PROFILE_PRETTY and not compression:
+        with codecs.open(outputdir + SLASH + filename, "w", 'utf-8') as out_file:
+                json.dump(data, out_file, sort_keys=True, indent=4,
+                          ensure_ascii=False, encoding='utf-8')
+        return
+    if profile == JSON_PROFILE_COMPACT:
+        content = json.dumps(data, separators=(',', ':'), ensure_ascii=False, encoding='utf-8')
+    else:
+        content = json.dumps(data, sort_keys=True, indent=4, ensure_ascii=False, encoding='utf-8')
+    if isinstance(content, unicode):
+        content = content.encode('utf-8')
+    with open(outputdir + SLASH + filename, "wb") as out_file:
+        out_file.write(compress_data(content, compression))
+
+
+# rewrite all JSON files of a directory tree with the given storage profile
+def migrate_json_dir(inputdir, profile=JSON_PROFILE_COMPACT, compression=None):
+
+    count = 0
+    for (dirpath, dirnames, filenames) in walk(inputdir):
+        for filename in filenames:
+            if not filename.endswith(JSON_EXT):
+                continue
+            try:
+                data = read_json_file(dirpath + SLASH + filename)
+            except ValueError as ve:
+                print 'Skipping invalid JSON file:', dirpath + SLASH + filename, ve
+                continue
+            # the original is replaced only once the rewritten file is complete
+            write_json_file(dirpath, filename + MIGRATE_TMP_EXT, data, profile, compression)
+            os.rename(dirpath + SLASH + filename + MIGRATE_TMP_EXT, dirpath + SLASH + filename)
+            count += 1
+    print 'Migrated', count, 'JSON files in', inputdir, 'to profile', profile, 'compression', compression
+    return count
 
 def write_txt_file_from_list(outputdir, filename, itemlist):
 
@@ -218,9 +324,7 @@ def extract_file_names_from_dir(dirpath):
 
 def read_json_file(inputfile):
 
-    with open(inputfile) as data_file:
-        data = json.load(data_file)
-    return data
+    return json.loads(read_file_data(inputfile))
 
 
 # this method cleans up a temporary directory
@@ -283,18 +387,33 @@ def validate_json_str(data):
     return json_data_str
 
 
-def process_http_query(query):
+def process_http_query(query, params=None, use_cache=True):
 
-    r = requests.get(query)
+    cache = None
+    if use_cache:
+        cache = http_cache.get_default_cache()
+    if cache:
+        r = cache.get(query, params)
+        if r is not None:
+            return r
+    r = http_client.get(query, params=params)
     if(r.status_code != 200):
         print('Request error:', r.url)
+    elif cache:
+        cache.put(query, params, r.content)
     return r
 
 
 def is_stored_as_json_file(path):
 
     response_json = None
-    inputfile = glob.glob(path)
+    # only wildcard patterns need a directory scan
+    if glob.has_magic(path):
+        inputfile = glob.glob(path)
+    elif os.path.isfile(path):
+        inputfile = [path]
+    else:
+        inputfile = []
     if(inputfile):
         print 'exists:', inputfile
         #response_content = read_json_file(inputfile[0])
@@ -303,6 +422,37 @@ def is_stored_as_json_file(path):
     return response_json
 
 
+# responses stored by earlier releases in the per-helper *_dir directories,
+# every directory is listed once instead of a glob scan per lookup
+stored_response_index = {}
+stored_response_lock = threading.Lock()
+
+
+def find_stored_response(directory, name, suffixed=False):
+
+    """JSON response stored as <name>.json, or as <name>_<suffix>.json if suffixed, None if there is none"""
+    with stored_response_lock:
+        index = stored_response_index.get((directory, suffixed))
+        if index is None:
+            index = {}
+            if os.path.isdir(directory):
+                for filename in os.listdir(directory):
+                    if filename.endswith(JSON_EXT):
+                        key = filename[:-len(JSON_EXT)]
+                        if suffixed:
+                            key = key.rsplit(UNDERSCORE, 1)[0]
+                        index[key] = filename
+            stored_response_index[(directory, suffixed)] = index
+    filename = index.get(name)
+    if filename is None:
+        return None
+    try:
+        return read_json_file(directory + SLASH + filename)
+    except ValueError as ve:
+        print 'Skipping invalid JSON file:', directory + SLASH + filename, ve
+        return None
+
+
 def find_longest_substring(string1, string2):
     """ returns the longest common substring from the beginning of string1 and string2 """
     def _iter():
@@ -0,0 +1,308 @@
+##
+##    In this module we test commonly used procedures for scoregraph project e.g. the HTTP cache.
+##
+
+import unittest
+import os
+import shutil
+import StringIO
+import tempfile
+import threading
+import time
+
+import common
+import enrich_journal
+import gnd_helper
+import http_cache
+import neo4j_manager
+import persistent_store
+import rate_limiter
+import record_store
+
+TEST_QUERY = 'https://wdq.wmflabs.org/api?q=string[227:118576291]'
+
+TEST_GND_RDF = """<?xml version="1.0" encoding="UTF-8"?>
+<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#" xmlns:owl="http://www.w3.org/2002/07/owl#"
+         xmlns:gndo="http://d-nb.info/standards/elementset/gnd#">
+  <rdf:Description rdf:about="http://d-nb.info/gnd/118576291">
+    <rdf:type rdf:resource="http://d-nb.info/standards/elementset/gnd#DifferentiatedPerson"/>
+    <owl:sameAs rdf:resource="http://viaf.org/viaf/61732497"/>
+    <owl:sameAs rdf:resource="http://dbpedia.org/resource/Gustav_Mahler"/>
+    <gndo:preferredNameForThePerson>Mahler, Gustav</gndo:preferredNameForThePerson>
+  </rdf:Description>
+  <rdf:Description rdf:about="http://d-nb.info/gnd/4020136-1">
+    <owl:sameAs rdf:resource="http://www.wikidata.org/entity/Q27939"/>
+  </rdf:Description>
+</rdf:RDF>
+"""
+
+
+class TestHttpCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir)
+
+    def test_normalize_url_ignores_param_order_and_api_keys(self):
+        url1 = http_cache.normalize_url('http://europeana.eu/api/v2/search.json?', {'query': 'Mahler', 'rows': 20, 'wskey': 'a'})
+        url2 = http_cache.normalize_url('HTTP://Europeana.eu/api/v2/search.json?rows=20&query=Mahler&wskey=b')
+        self.assertEqual(url1, url2)
+
+    def test_get_returns_stored_content(self):
+        cache = http_cache.HttpCache(self.cachedir)
+        self.assertEqual(cache.get(TEST_QUERY), None)
+        cache.put(TEST_QUERY, None, '{"items": [7304]}')
+        response = http_cache.HttpCache(self.cachedir).get(TEST_QUERY)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['items'], [7304])
+
+    def test_expired_entries_are_dropped(self):
+        cache = http_cache.HttpCache(self.cachedir, ttl=0)
+        cache.put(TEST_QUERY, None, '{}')
+        time.sleep(0.01)
+        self.assertEqual(cache.get(TEST_QUERY), None)
+        self.assertEqual(cache.stats()['entries'], 0)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = http_cache.HttpCache(self.cachedir, max_size=10)
+        cache.put(TEST_QUERY + '1', None, '12345')
+        time.sleep(0.01)
+        cache.put(TEST_QUERY + '2', None, '12345')
+        time.sleep(0.01)
+        cache.get(TEST_QUERY + '1')
+        cache.put(TEST_QUERY + '3', None, '12345')
+        self.assertTrue(cache.get(TEST_QUERY + '1') is not None)
+        self.assertEqual(cache.get(TEST_QUERY + '2'), None)
+        self.assertEqual(cache.size, 10)
+
+    def test_responses_of_earlier_releases_are_found_without_glob(self):
+        common.write_json_file(self.cachedir, 'AL00119186_118576291_7304.json', {'items': [7304]})
+        common.write_json_file(self.cachedir, '7304.json', {'entities': {}})
+        self.assertEqual(common.find_stored_response(self.cachedir, 'AL00119186_118576291', True), {'items': [7304]})
+        self.assertEqual(common.find_stored_response(self.cachedir, '7304'), {'entities': {}})
+        self.assertEqual(common.find_stored_response(self.cachedir, 'AL00119186_1'), None)
+
+
+class FakeResponse:
+
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def close(self):
+        pass
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_throttled_requests_are_retried_after_retry_after_delay(self):
+        responses = [FakeResponse(503, {'Retry-After': '0'}), FakeResponse(200)]
+        scheduler = rate_limiter.RateLimitScheduler({'musicbrainz.org': (100.0, 1)})
+        response = scheduler.call('http://musicbrainz.org/ws/2/work', lambda: responses.pop(0))
+        self.assertEqual(response.status_code, 200)
+        metrics = scheduler.get_metrics()['musicbrainz.org']
+        self.assertEqual(metrics['requests'], 2)
+        self.assertEqual(metrics['throttled'], 1)
+        self.assertEqual(metrics['retries'], 1)
+
+    def test_hosts_are_matched_by_domain_suffix(self):
+        scheduler = rate_limiter.RateLimitScheduler({'viaf.org': (4.0, 4)})
+        self.assertEqual(scheduler.host_key('http://www.viaf.org/viaf/61732497/viaf.xml'), 'viaf.org')
+        self.assertEqual(scheduler.host_key('http://d-nb.info/gnd/118576291'), 'd-nb.info')
+
+    def test_bucket_limits_request_rate(self):
+        bucket = rate_limiter.TokenBucket(50.0, 1)
+        start = time.time()
+        for i in range(3):
+            bucket.acquire()
+        self.assertTrue(time.time() - start >= 0.035)
+
+
+class TestJsonStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.outputdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.outputdir)
+
+    def test_compressed_files_are_detected_on_read(self):
+        data = {'entities': {'Q7304': {'label': u'Gustav Mahler', 'aliases': [u'M\xe4hler']}}}
+        for compression in [None, common.JSON_COMPRESSION_GZIP]:
+            common.write_json_file(self.outputdir, '7304.json', data, common.JSON_PROFILE_COMPACT, compression)
+            self.assertEqual(common.read_json_file(self.outputdir + '/7304.json'), data)
+            self.assertEqual(common.is_stored_as_json_file(self.outputdir + '/7304*'), data)
+
+    def test_empty_compression_overrides_the_configured_one(self):
+        common.configure_json_storage(compression=common.JSON_COMPRESSION_GZIP)
+        try:
+            common.write_json_file(self.outputdir, 'plain.json', {'id': 1}, compression='')
+        finally:
+            common.configure_json_storage(compression='')
+        with open(self.outputdir + '/plain.json', 'rb') as plain:
+            self.assertEqual(plain.read(1), '{')
+
+    def test_migration_keeps_content(self):
+        data = {'result': [{'name': u'Gustav Mahler', 'compositions': []}]}
+        common.write_json_file(self.outputdir, 'm0bvzp.json', data)
+        common.migrate_json_dir(self.outputdir, common.JSON_PROFILE_COMPACT, common.JSON_COMPRESSION_GZIP)
+        with open(self.outputdir + '/m0bvzp.json', 'rb') as migrated:
+            self.assertTrue(migrated.read().startswith(common.GZIP_MAGIC))
+        self.assertEqual(common.read_json_file(self.outputdir + '/m0bvzp.json'), data)
+        self.assertEqual(os.listdir(self.outputdir), ['m0bvzp.json'])
+
+
+class TestRecordStore(unittest.TestCase):
+
+    def setUp(self):
+        self.storedir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.storedir)
+
+    def test_latest_record_version_is_served_after_reopening(self):
+        store = record_store.RecordStore(self.storedir)
+        store.put(u'AL00119186', {'aleph_id': u'AL00119186', 'title': u'Lieder'})
+        store.put(u'AL00119187', {'aleph_id': u'AL00119187', 'title': u'Sinfonie'})
+        store.put(u'AL00119186', {'aleph_id': u'AL00119186', 'title': u'Lieder eines fahrenden Gesellen'})
+        store.close()
+
+        store = record_store.RecordStore(self.storedir)
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store.get(u'AL00119186')['title'], u'Lieder eines fahrenden Gesellen')
+        self.assertEqual([record_id for record_id, record in store.iter_records()], [u'AL00119187', u'AL00119186'])
+
+    def test_store_is_accepted_by_read_records(self):
+        store = record_store.RecordStore(self.storedir)
+        store.put(u'AL00119186', {'aleph_id': u'AL00119186', 'title': u'Ges\xe4nge'})
+        records = list(common.read_records(record_store.open_inputs([self.storedir])))
+        self.assertEqual(records[0][0], u'AL00119186.json')
+        self.assertTrue(u'Ges\xe4nge' in records[0][1])
+
+    def test_deleted_records_stay_deleted_and_selection_filters_ids(self):
+        store = record_store.RecordStore(self.storedir)
+        for record_id in [u'AL00119186', u'AL00119187', u'AL00119188']:
+            store.put(record_id, {'aleph_id': record_id})
+        store.delete(u'AL00119187')
+        store.close()
+
+        store = record_store.RecordStore(self.storedir)
+        self.assertEqual(sorted(store.ids()), [u'AL00119186', u'AL00119188'])
+        selection = record_store.select_records(store, [u'AL00119187', u'AL00119188'])
+        self.assertEqual([name for name, data in common.read_records(selection)], [u'AL00119188.json'])
+        self.assertEqual(record_store.select_records(['data/enriched/AL00119188_enriched.json', 'data/enriched/AL00119186_enriched.json'], [u'AL00119188']),
+                         ['data/enriched/AL00119188_enriched.json'])
+
+
+class TestPersistentMap(unittest.TestCase):
+
+    def setUp(self):
+        self.storedir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.storedir)
+
+    def test_update_stores_and_deletes_in_one_transaction(self):
+        store = persistent_store.PersistentMap(self.storedir + '/index.sqlite')
+        store.put_many([(u'AL1', 1), (u'AL2', 2)])
+        store.update([(u'AL3', 3)], [u'AL1'])
+        self.assertEqual(sorted(store.items()), [(u'AL2', 2), (u'AL3', 3)])
+        # a value that can not be stored leaves the map unchanged
+        self.assertRaises(TypeError, store.update, [(u'AL4', object())], [u'AL2'])
+        self.assertEqual(sorted(store.items()), [(u'AL2', 2), (u'AL3', 3)])
+        store.close()
+
+
+class TestGndSameAsResolver(unittest.TestCase):
+
+    def setUp(self):
+        self.storedir = tempfile.mkdtemp()
+        self.fetched = []
+
+    def tearDown(self):
+        shutil.rmtree(self.storedir)
+
+    def fetch(self, gnd_uri):
+        self.fetched.append(gnd_uri)
+        time.sleep(0.05)
+        return [u'http://viaf.org/viaf/61732497']
+
+    def test_concurrent_requests_for_one_uri_are_fetched_once(self):
+        store = persistent_store.PersistentMap(self.storedir + '/gnd_sameas.sqlite')
+        resolver = gnd_helper.SameAsResolver(store, self.fetch)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(resolver.resolve(u'http://d-nb.info/gnd/118576291')))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.fetched, [u'http://d-nb.info/gnd/118576291'])
+        self.assertEqual(results, [[u'http://viaf.org/viaf/61732497']] * 4)
+
+        reopened = gnd_helper.SameAsResolver(persistent_store.PersistentMap(self.storedir + '/gnd_sameas.sqlite'), self.fetch)
+        reopened.prefetch([u'http://d-nb.info/gnd/118576291', u'http://d-nb.info/gnd/118576291'])
+        self.assertEqual(len(self.fetched), 1)
+
+    def test_sameas_links_are_streamed_up_to_the_authority_description(self):
+        self.assertEqual(gnd_helper.extract_sameas_uris(StringIO.StringIO(TEST_GND_RDF)),
+                         ['http://viaf.org/viaf/61732497', 'http://dbpedia.org/resource/Gustav_Mahler',
+                          'http://www.wikidata.org/entity/Q27939'])
+        self.assertEqual(gnd_helper.extract_sameas_uris(StringIO.StringIO(TEST_GND_RDF), 'http://d-nb.info/gnd/118576291'),
+                         ['http://viaf.org/viaf/61732497', 'http://dbpedia.org/resource/Gustav_Mahler'])
+        # d-nb.info describes the authority with its https URI
+        https_rdf = TEST_GND_RDF.replace('rdf:about="http://d-nb.info', 'rdf:about="https://d-nb.info')
+        self.assertEqual(gnd_helper.extract_sameas_uris(StringIO.StringIO(https_rdf), 'http://d-nb.info/gnd/118576291'),
+                         ['http://viaf.org/viaf/61732497', 'http://dbpedia.org/resource/Gustav_Mahler'])
+
+    def test_prefetch_collects_distinct_gnd_uris_of_records(self):
+        record = {'sameas': [u'http://d-nb.info/gnd/300040431'],
+                  'persons': [{'name': u'Mahler, Gustav', 'sameas': [u'http://d-nb.info/gnd/118576291']}],
+                  'terms': [{'labels': [u'Gesang'], 'sameas': [u'http://d-nb.info/gnd/4020136-1']}]}
+        self.assertEqual(sorted(gnd_helper.find_gnd_uris(record, [])), [u'http://d-nb.info/gnd/118576291',
+                         u'http://d-nb.info/gnd/300040431', u'http://d-nb.info/gnd/4020136-1'])
+
+
+class TestEnrichmentJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.journaldir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.journaldir)
+
+    def test_interrupted_and_failed_records_are_enriched_again(self):
+        journal = enrich_journal.EnrichmentJournal(enrich_journal.journal_path(self.journaldir + '/enriched'))
+        journal.start(u'AL00119186')
+        journal.finish(u'AL00119186', [('gnd http://d-nb.info/gnd/118576291', True)])
+        journal.start(u'AL00119187')
+        journal.finish(u'AL00119187', [('gnd http://d-nb.info/gnd/118576291', True),
+                                       ('europeana Mahler, Gustav Sinfonie', False)])
+        journal.start(u'AL00119188')
+        self.assertFalse(journal.needs_enrichment(u'AL00119186'))
+        self.assertFalse(journal.needs_enrichment(u'AL00119189'))
+        self.assertEqual(sorted(journal.record_ids()), [u'AL00119187', u'AL00119188'])
+        self.assertEqual(journal.failed_calls(), [(u'AL00119187', u'europeana Mahler, Gustav Sinfonie')])
+
+        journal.start(u'AL00119187')
+        journal.finish(u'AL00119187', [('europeana Mahler, Gustav Sinfonie', True)])
+        self.assertEqual(journal.stats(), {'done': 2, 'pending': 1, 'failed calls': 0})
+
+
+class TestCompositionIndex(unittest.TestCase):
+
+    def test_author_compositions_of_all_viaf_ids(self):
+        compositions = [{common.COMPOSITION_AUTHOR_ID_HEADER: '61732497', common.COMPOSITION_TITLE_HEADER: 'Lied'},
+                        {common.COMPOSITION_AUTHOR_ID_HEADER: '100', common.COMPOSITION_TITLE_HEADER: 'Sonate'},
+                        {common.COMPOSITION_AUTHOR_ID_HEADER: '61732497', common.COMPOSITION_TITLE_HEADER: 'Symphonie'}]
+        composition_index = neo4j_manager.index_compositions_by_author(compositions)
+        titles = [composition[common.COMPOSITION_TITLE_HEADER] for composition in neo4j_manager.find_author_compositions(
+            composition_index, {common.AUTHOR_VIAF_ID_HEADER: '61732497 100'})]
+        self.assertEqual(titles, ['Lied', 'Symphonie', 'Sonate'])
+        self.assertEqual(neo4j_manager.find_author_compositions(composition_index, {common.AUTHOR_VIAF_ID_HEADER: None}), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+"""
+Script for computing corpus statistics from a records summary.
+
+The numeric columns of a records summary (e.g. data/summary_enriched.csv)
+are loaded into typed NumPy arrays, coverage ratios, percentiles, histograms
+and cross tabulations of linked records are then computed on whole columns.
+Parsed columns are cached next to the summary and used as long as the
+summary is unchanged. NumPy is only needed by this stage.
+
+Invocation:
+$ python corpus_statistics.py data/summary_enriched.csv -o data/corpus_statistics
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+import summarize
+
+
+SUMMARY_COLUMNS = summarize.RecordsSummary.fieldnames[1:]
+PERCENTILES = [50, 90, 99]
+HISTOGRAM_BINS = 10                               # larger counts are collected in the last bin
+CROSS_TABS = [('links_person_gnd', 'links_person_viaf'),
+              ('links_person_gnd', 'links_person_dbpedia'),
+              ('links_artwork', 'related_europeana_items')]
+COLUMN_CACHE_EXT = '.columns.npz'
+REPORT_FIELDNAMES = ['statistic', 'column', 'value']
+
+numpy = None
+
+
+def get_numpy():
+    # NumPy is only needed for corpus statistics, load it on first use
+    global numpy
+    if numpy is None:
+        import numpy
+    return numpy
+
+
+def column_cache_path(summaryfile):
+    return os.path.splitext(summaryfile)[0] + COLUMN_CACHE_EXT
+
+
+def parse_summary_columns(summaryfile):
+
+    """Numeric columns of a records summary as int32 arrays"""
+    np = get_numpy()
+    with open(summaryfile, 'rb') as csvfile:
+        header = csvfile.readline().strip().split(',')
+        # the id column is cut off, all counts are then parsed by a single call
+        lines = [line.split(',', 1)[1].strip() for line in csvfile if line.strip()]
+    matrix = np.fromstring(','.join(lines), dtype=np.int32, sep=',')
+    # fromstring stops at the first empty or non numeric cell, later columns would shift
+    if matrix.size != len(lines) * (len(header) - 1):
+        raise ValueError("%s: expected %d counts in each of %d rows, parsed %d counts in total, "
+                         "the summary has empty or non numeric cells"
+                         % (summaryfile, len(header) - 1, len(lines), matrix.size))
+    matrix = matrix.reshape(-1, len(header) - 1)
+    return dict((column, np.ascontiguousarray(matrix[:, index])) for index, column in enumerate(header[1:]))
+
+
+def load_summary_columns(summaryfile):
+
+    """Summary columns from the column cache, parsed again if the summary changed"""
+    np = get_numpy()
+    stat = os.stat(summaryfile)
+    stamp = np.array([stat.st_mtime, stat.st_size], dtype=np.float64)
+    cachefile = column_cache_path(summaryfile)
+    if os.path.exists(cachefile):
+        cached = np.load(cachefile)
+        try:
+            if np.array_equal(cached['stamp'], stamp):
+                return dict((column, cached[column]) for column in SUMMARY_COLUMNS)
+        finally:
+            cached.close()
+    columns = parse_summary_columns(summaryfile)
+    np.savez(cachefile, stamp=stamp, **columns)
+    return columns
+
+
+def column_statistics(values):
+
+    np = get_numpy()
+    histogram = np.bincount(np.minimum(values, HISTOGRAM_BINS), minlength=HISTOGRAM_BINS + 1)
+    return {
+        'total': int(values.sum(dtype=np.int64)),
+        'coverage': float(np.count_nonzero(values)) / len(values),
+        'mean': float(values.mean()),
+        'max': int(values.max()),
+        'percentiles': dict((str(percentile), float(value)) for percentile, value
+                            in zip(PERCENTILES, np.percentile(values, PERCENTILES))),
+        'histogram': histogram.tolist()
+    }
+
+
+def cross_tab(columns, first, second):
+
+    """Number of records linked in both, only one or none of two columns"""
+    np = get_numpy()
+    counts = np.bincount((columns[first] > 0).astype(np.int8) * 2 + (columns[second] > 0), minlength=4)
+    return {'neither': int(counts[0]), second + ' only': int(counts[1]),
+            first + ' only': int(counts[2]), 'both': int(counts[3])}
+
+
+def compute_statistics(columns):
+
+    records = len(columns[SUMMARY_COLUMNS[0]])
+    report = {'records': records, 'columns': {}, 'cross_tabs': {}}
+    if records == 0:
+        return report
+    for column in SUMMARY_COLUMNS:
+        report['columns'][column] = column_statistics(columns[column])
+    for first, second in CROSS_TABS:
+        report['cross_tabs'][first + ' x ' + second] = cross_tab(columns, first, second)
+    return report
+
+
+def report_rows(report):
+
+    """Flat (statistic, column, value) rows of a report"""
+    rows = [{'statistic': 'records', 'column': '', 'value': report['records']}]
+    for column in SUMMARY_COLUMNS:
+        if column not in report['columns']:
+            continue
+        statistics = report['columns'][column]
+        for statistic in ['total', 'coverage', 'mean', 'max']:
+            rows.append({'statistic': statistic, 'column': column, 'value': statistics[statistic]})
+        for percentile in PERCENTILES:
+            rows.append({'statistic': 'p' + str(percentile), 'column': column,
+                         'value': statistics['percentiles'][str(percentile)]})
+        for count, value in enumerate(statistics['histogram']):
+            label = str(count) if count < HISTOGRAM_BINS else str(count) + '+'
+            rows.append({'statistic': 'histogram ' + label, 'column': column, 'value': value})
+    for first, second in CROSS_TABS:
+        name = first + ' x ' + second
+        if name in report['cross_tabs']:
+            for cell, value in sorted(report['cross_tabs'][name].items()):
+                rows.append({'statistic': cell, 'column': name, 'value': value})
+    return rows
+
+
+def write_report(report, outputbase):
+
+    with open(outputbase + '.json', 'w') as json_file:
+        json.dump(report, json_file, sort_keys=True, indent=4)
+    with open(outputbase + '.csv', 'w') as csvfile:
+        writer = csv.DictWriter(csvfile, delimiter=';', fieldnames=REPORT_FIELDNAMES, lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(report_rows(report))
+
+
+# Main statistics routine
+
+def corpus_statistics(summaryfile, outputbase):
+
+    print 'Computing corpus statistics of', summaryfile, 'in', outputbase + '.json'
+    start = time.time()
+    columns = load_summary_columns(summaryfile)
+    loaded = time.time()
+    report = compute_statistics(columns)
+    print 'Records:', report['records'], 'load time:', round(loaded - start, 3), 's', \
+        'statistics time:', round(time.time() - loaded, 3), 's'
+    write_report(report, outputbase)
+    return report
+
+
+# Command line parsing
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+                    description="Compute corpus statistics from a records summary.")
+    parser.add_argument('summaryfile', type=str,
+                    help="Records summary, e.g. data/summary_enriched.csv")
+    parser.add_argument('-o', '--outputbase', type=str, nargs='?',
+                    default="data/corpus_statistics",
+                    help="Report files without extension, a JSON and a CSV report are written")
+
+    if len(sys.argv) < 2:
+        parser.print_help()
+        sys.exit(1)
+
+    args = parser.parse_args()
+    corpus_statistics(args.summaryfile, args.outputbase)
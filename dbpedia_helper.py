@@ -2,36 +2,69 @@
 """
 Script for DBPedia connection.
 
+Dexter spot results are kept per query text and entity descriptions per
+Dexter id in persistent stores, so every distinct name and id is requested
+once. Names can be prefetched concurrently before summaries are written.
+
 Invocation:
 $ python dbpedia_helper.py query
 """
 
 import argparse
 import sys
+import threading
 
+import batch_lookup
 # HTTP connection
-import requests
-
-# helper for SPARQL queries
-from SPARQLWrapper import SPARQLWrapper, JSON
+import http_client
+import persistent_store
 
 
 DEXTER_API_URI            = "http://dexterdemo.isti.cnr.it:8080/dexter-webapp/api/rest/spot-entities"
 DEXTER_API_DBPEDIA_ID_URI = "http://dexterdemo.isti.cnr.it:8080/dexter-webapp/api/rest/get-desc?"
 
 AUTHOR_POS = 1
+DBPEDIA_SPOT_STORE = 'data/dbpedia_spot.sqlite'
+DBPEDIA_DESC_STORE = 'data/dbpedia_desc.sqlite'
+DBPEDIA_STORE_TTL = 30 * 24 * 60 * 60             # seconds
+
+
+# spot results are kept per query text, descriptions per Dexter id
+default_stores = {}
+stores_lock = threading.Lock()
+store_settings = {'spot': DBPEDIA_SPOT_STORE, 'desc': DBPEDIA_DESC_STORE, 'ttl': DBPEDIA_STORE_TTL}
+
+
+def get_store(name):
+    if name not in default_stores:
+        with stores_lock:
+            if name not in default_stores:
+                default_stores[name] = persistent_store.PersistentMap(store_settings[name], store_settings['ttl'])
+    return default_stores[name]
+
+
+def store_key(query):
+    if isinstance(query, str):
+        return query.decode('utf-8')
+    return unicode(query)
 
 
 # sample link http://dexterdemo.isti.cnr.it:8080/dexter-webapp/api/rest/get-desc?id=49109&title-only=false
 def find_dbpedia_id(query):
+    """DBPedia URL of a Dexter entity, answered from the description store where possible"""
+    store = get_store('desc')
+    stored = store.get(store_key(query))
+    if stored is not None:
+        return stored['url']
     payload = {'id': query,
                'title-only': 'false'}
-    r = requests.get(DEXTER_API_DBPEDIA_ID_URI, params=payload)
+    r = http_client.get(DEXTER_API_DBPEDIA_ID_URI, params=payload)
     print 'find DBPedia ID status code', r.status_code, 'query', query
     if(r.status_code != 200):
         print("FAILURE: Request", r.url, "failed")
         return None
     result = r.json()
+    store.put(store_key(query), {'url': result.get('url')})
     return result.get('url')
 
 
@@ -51,6 +84,8 @@ def analyze_titles_by_dbpedia(query_list):
             print(len(dbpedia_items), "results.")
 
     # get description for each dexter ID - get DBPedia ID
+    # helper for SPARQL queries, loaded on first use
+    from SPARQLWrapper import SPARQLWrapper, JSON
     sparql = SPARQLWrapper("http://dbpedia.org/sparql")
     for key, value in dbpedia_items.iteritems():
         dbpedia_id = find_dbpedia_id(key)
@@ -99,21 +134,55 @@ def query_dexter(query_list, column):
 
 # Sample link http://dexterdemo.isti.cnr.it:8080/dexter-webapp/api/rest/spot-entities?text=Bob%20Dylan&wn=false&debug=false&format=text
 def find_dbpedia_items(query):
+    """Entities spotted in a text, answered from the spot store where possible"""
+    store = get_store('spot')
+    stored = store.get(store_key(query))
+    if stored is not None:
+        return stored['entities']
     payload = {'wn': 'false',
                'debug': 'false',
                'text': query,
                'format': 'text'}
-    r = requests.get(DEXTER_API_URI, params=payload)
+    r = http_client.get(DEXTER_API_URI, params=payload)
     print 'status code', r.status_code
     if(r.status_code != 200):
         print("FAILURE: Request", r.url, "failed")
         return None
     result = r.json()
-    if result.get('entities') is None:
-        return None
-    else:
-        return result['entities']
-
+    # texts without entities are stored as well, failed requests are not
+    store.put(store_key(query), {'entities': result.get('entities')})
+    return result.get('entities')
+
+
+def prefetch_dbpedia_ids(queries, workers=None):
+
+    """Spot the distinct texts and describe the spotted entities missing in the stores
+
+    Returns the entities per text and the DBPedia URL per entity id, both
+    keyed by store_key. Failed requests are kept as None, so that callers
+    do not request them again within a batch.
+    """
+    queries = batch_lookup.unique(queries)
+    spot_store = get_store('spot')
+    stored = spot_store.get_many([store_key(query) for query in queries])
+    entities_by_text = dict((key, value['entities']) for key, value in stored.items())
+    missing = [query for query in queries if store_key(query) not in entities_by_text]
+    print 'Spotting', len(missing), 'of', len(queries), 'distinct texts in Dexter'
+    for query, entities in zip(missing, batch_lookup.lookup_all(find_dbpedia_items, missing, workers)):
+        entities_by_text[store_key(query)] = entities
+    entity_ids = []
+    for entities in entities_by_text.values():
+        if entities:
+            entity_ids.extend(store_key(entity_id) for entity_id in entities.keys())
+    entity_ids = batch_lookup.unique(entity_ids)
+    desc_store = get_store('desc')
+    stored = desc_store.get_many(entity_ids)
+    urls_by_id = dict((key, value['url']) for key, value in stored.items())
+    missing = [entity_id for entity_id in entity_ids if entity_id not in urls_by_id]
+    print 'Describing', len(missing), 'Dexter entities'
+    for entity_id, url in zip(missing, batch_lookup.lookup_all(find_dbpedia_id, missing, workers)):
+        urls_by_id[entity_id] = url
+    return entities_by_text, urls_by_id
 
 
 # Command line parsing
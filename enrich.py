@@ -9,19 +9,38 @@ $ python enrich.py data/normalized/*.json -o data/enriched -a EUROPEANA_API_KEY
 import argparse
 import json
 import os
+import Queue
 import sys
-
-import requests
-from bs4 import BeautifulSoup
+import threading
 
 from common import write_json_file, progress, read_records
 
+import batch_lookup
+import enrich_journal
+import gnd_helper
+import http_client
+import persistent_store
+import record_store
+
 # Europeana enrichment
 
 EUROPEANA_API_URI  = "http://europeana.eu/api/v2/search.json?"
 EUROPEANA_MAX_ROWS = 20
-EUROPEANA_API_KEY  = open("europeana_api_key").read()
+EUROPEANA_API_KEY_FILE = "europeana_api_key"
+EUROPEANA_API_KEY  = None
+EUROPEANA_SEARCH_STORE = 'data/europeana_search.sqlite'
+EUROPEANA_SEARCH_TTL = 7 * 24 * 60 * 60           # seconds
+EUROPEANA_COUNT_STORE = 'data/europeana_count.sqlite'
+EUROPEANA_COUNT_TTL = 30 * 24 * 60 * 60           # seconds
+
+
 
+def get_europeana_api_key():
+    # read on first use, so that importing this module needs no key file
+    global EUROPEANA_API_KEY
+    if EUROPEANA_API_KEY is None:
+        EUROPEANA_API_KEY = open(EUROPEANA_API_KEY_FILE).read()
+    return EUROPEANA_API_KEY
 
 
 def extract_europeana_data(europeana_items):
@@ -35,12 +54,12 @@ def extract_europeana_data(europeana_items):
 
 
 def find_europeana_items(query):
-    payload = {'wskey': EUROPEANA_API_KEY,
+    payload = {'wskey': get_europeana_api_key(),
                'profile': 'standard',
                'query': query,
                'start': 1,
                'rows': EUROPEANA_MAX_ROWS}
-    r = requests.get(EUROPEANA_API_URI, params=payload)
+    r = http_client.get(EUROPEANA_API_URI, params=payload)
     if(r.status_code != 200):
         print("FAILURE: Request", r.url, "failed")
         return None
@@ -51,22 +70,78 @@ def find_europeana_items(query):
         return result['items']
 
 
-def find_europeana_items_ext(query):
-    payload = {'wskey': EUROPEANA_API_KEY,
+# search results are kept per query, so every distinct query is sent once
+default_search_store = None
+search_store_lock = threading.Lock()
+search_settings = {'storefile': EUROPEANA_SEARCH_STORE, 'ttl': EUROPEANA_SEARCH_TTL}
+
+
+def get_search_store():
+    global default_search_store
+    if default_search_store is None:
+        with search_store_lock:
+            if default_search_store is None:
+                default_search_store = persistent_store.PersistentMap(search_settings['storefile'],
+                                                                      search_settings['ttl'])
+    return default_search_store
+
+
+def search_europeana_items(query, rows=EUROPEANA_MAX_ROWS):
+    """Items found for a query, answered from the search store where possible, None if the request failed"""
+    store = get_search_store()
+    stored = store.get(query)
+    if stored is not None:
+        return stored['items']
+    payload = {'wskey': get_europeana_api_key(),
                'profile': 'standard',
                'query': query,
                'start': 1,
-               'rows': 200}
-    r = requests.get(EUROPEANA_API_URI, params=payload)
+               'rows': rows}
+    r = http_client.get(EUROPEANA_API_URI, params=payload)
+    if(r.status_code != 200):
+        print("FAILURE: Request", r.url, "failed")
+        return None
+    items = r.json().get('items') or []
+    store.put(query, {'items': items})
+    return items
+
+
+# result counts are kept per query as well
+default_count_store = None
+count_store_lock = threading.Lock()
+count_settings = {'storefile': EUROPEANA_COUNT_STORE, 'ttl': EUROPEANA_COUNT_TTL}
+
+
+def get_count_store():
+    global default_count_store
+    if default_count_store is None:
+        with count_store_lock:
+            if default_count_store is None:
+                default_count_store = persistent_store.PersistentMap(count_settings['storefile'],
+                                                                     count_settings['ttl'])
+    return default_count_store
+
+
+def count_europeana_results(query):
+    """totalResults of a query without fetching any item, None if the request failed"""
+    store = get_count_store()
+    stored = store.get(query)
+    if stored is not None:
+        return stored['totalResults']
+    payload = {'wskey': get_europeana_api_key(),
+               'profile': 'minimal',
+               'query': query,
+               'rows': 0}
+    r = http_client.get(EUROPEANA_API_URI, params=payload)
     print 'Europeana query URL:', r.url
     if(r.status_code != 200):
         print("FAILURE: Request", r.url, "failed")
         return None
-    result = r.json()
-    if result.get('totalResults') is None:
+    total_results = r.json().get('totalResults')
+    if total_results is None:
         return None
-    else:
-        return result['totalResults']
+    store.put(query, {'totalResults': total_results})
+    return total_results
 
 
 def extract_europeana_data(europeana_items):
@@ -79,59 +154,230 @@ def extract_europeana_data(europeana_items):
     return data
 
 
-def filter_europeana_items(data, europeana_items):
-    # collect all known person URIs
-    known_person_uris = []
-    if 'persons' in data:
-        for person in data['persons']:
-            if 'sameas' in person:
-                for uri in person['sameas']:
-                    known_person_uris.append(uri)
-    # keep only those items that have at least one matching person URI
+def canonical_uri(uri):
+    """Compare http and https URIs with and without trailing slash as equal, as UTF-8 byte string"""
+    uri = uri.strip()
+    scheme, sep, rest = uri.partition('://')
+    if sep and scheme.lower() in ['http', 'https']:
+        host, slash, path = rest.partition('/')
+        uri = 'http://' + host.lower() + slash + path.rstrip('/')
+    if isinstance(uri, unicode):
+        uri = uri.encode('utf-8')
+    return uri
+
+
+def person_uri_index(data):
+    """Set of the canonical sameas URIs of all persons of a record, dcCreator terms are only looked up in it"""
+    known_person_uris = set()
+    for person in data.get('persons', []):
+        for uri in person.get('sameas', []):
+            if uri:
+                # the same authorities recur in many records, interned strings are shared between their sets
+                # and are freed with the last set that refers to them
+                known_person_uris.add(intern(canonical_uri(uri)))
+    return known_person_uris
+
+
+def filter_europeana_items(data, europeana_items, known_person_uris=None):
+    if known_person_uris is None:
+        known_person_uris = person_uri_index(data)
+    # keep only those items that have at least one matching person URI, each item once
     filtered_items = []
     for item in europeana_items:
-        if item.get('dcCreator'):
-            for term in item['dcCreator']:
-                if term in known_person_uris:
-                    filtered_items.append(item)
+        for term in item.get('dcCreator') or []:
+            if canonical_uri(term) in known_person_uris:
+                filtered_items.append(item)
+                break
     return filtered_items
 
 
+def merge_related_items(related_items, enrichments):
+    """Append enrichments whose Europeana id is not related yet, items without id are always appended"""
+    known_ids = set(item.get('id') for item in related_items if item.get('id') is not None)
+    for enrichment in enrichments:
+        item_id = enrichment.get('id')
+        if item_id is None:
+            related_items.append(enrichment)
+        elif item_id not in known_ids:
+            known_ids.add(item_id)
+            related_items.append(enrichment)
+    return related_items
+
+
+def europeana_query(name, title):
+    query = name
+    if title:
+        query = query + " " + title
+    return query
+
+
+# Batched Europeana queries
+
+EUROPEANA_BATCH_MAX_PERSONS = 5
+EUROPEANA_BATCH_MAX_ROWS = 100
+# relative costs: the key quota counts requests, items cost transfer, items beyond the rows window are lost
+EUROPEANA_REQUEST_COST = 1.0
+EUROPEANA_ITEM_COST = 0.02
+EUROPEANA_MISSED_ITEM_COST = 0.1
+# items of a batch are kept per person in the search store, apart from the results of single queries
+PERSON_ITEMS_PREFIX = 'person items|'
+
+batch_settings = {'enabled': False, 'max_persons': EUROPEANA_BATCH_MAX_PERSONS}
+
+
+def configure_batching(enabled=None, max_persons=None):
+    if enabled is not None:
+        batch_settings['enabled'] = enabled
+    if max_persons is not None:
+        batch_settings['max_persons'] = max_persons
+
+
+def batched_query(names, title):
+    query = ' OR '.join('(' + name + ')' for name in names)
+    if title:
+        query = '(' + query + ') ' + title
+    return query
+
+
+def search_cost(rows, total_results):
+    """Cost of one search with a rows window for a query with total_results items"""
+    rows = min(rows, total_results)
+    return EUROPEANA_REQUEST_COST + rows * EUROPEANA_ITEM_COST \
+        + (total_results - rows) * EUROPEANA_MISSED_ITEM_COST
+
+
+def batch_cost(person_totals):
+    """Cost of one OR query for persons with the given result counts"""
+    return search_cost(EUROPEANA_BATCH_MAX_ROWS, sum(person_totals))
+
+
+def person_items_key(person, title):
+    """Search store key of the items a batch found for a person, the person URIs are part of the key"""
+    uris = sorted(uri.decode('utf-8') for uri in person_uri_index({'persons': [person]}))
+    return PERSON_ITEMS_PREFIX + europeana_query(person['name'], title) + '|' + ' '.join(uris)
+
+
+def stored_person_items(data):
+    """Items kept by earlier batches for persons of a record, by person_items_key"""
+    if not batch_settings['enabled']:
+        return {}
+    title = data.get('title')
+    return get_search_store().get_many([person_items_key(person, title) for person in data.get('persons', [])])
+
+
+def europeana_searches(data, answered=None):
+    """(query, rows, persons) of the searches for a record
+
+    Persons whose query is stored or whose result count is unknown or
+    larger than EUROPEANA_MAX_ROWS are searched separately, counts come from the count pass of execute_plan.
+    The other persons are added to a shared OR query as long as the cost
+    model favours the shared query over a separate search. Persons answered
+    by the items of an earlier batch need no search.
+    """
+    if answered is None:
+        answered = stored_person_items(data)
+    title = data.get('title')
+    searches = []
+    batch = []
+    batch_totals = []
+    search_store = get_search_store()
+    count_store = get_count_store() if batch_settings['enabled'] else None
+    for person in data.get('persons', []):
+        query = europeana_query(person['name'], title)
+        if not batch_settings['enabled'] or query in search_store:
+            searches.append((query, EUROPEANA_MAX_ROWS, [person]))
+            continue
+        if person_items_key(person, title) in answered:
+            continue
+        counted = count_store.get(query)
+        if counted is None:
+            searches.append((query, EUROPEANA_MAX_ROWS, [person]))
+            continue
+        total_results = counted['totalResults']
+        if total_results > EUROPEANA_MAX_ROWS:
+            searches.append((query, EUROPEANA_MAX_ROWS, [person]))
+            continue
+        if batch and (len(batch) == batch_settings['max_persons'] or
+                      batch_cost(batch_totals + [total_results]) >
+                      batch_cost(batch_totals) + search_cost(EUROPEANA_MAX_ROWS, total_results)):
+            searches.append(batch_search(batch, batch_totals, title))
+            batch = []
+            batch_totals = []
+        batch.append(person)
+        batch_totals.append(total_results)
+    if batch:
+        searches.append(batch_search(batch, batch_totals, title))
+    return searches
+
+
+def batch_search(persons, person_totals, title):
+    if len(persons) == 1:
+        return (europeana_query(persons[0]['name'], title), EUROPEANA_MAX_ROWS, persons)
+    rows = max(1, min(sum(person_totals), EUROPEANA_BATCH_MAX_ROWS))
+    return (batched_query([person['name'] for person in persons], title), rows, persons)
+
+
+def split_items_by_person(europeana_items, persons):
+    """Items of a batched search per person, assigned by the person URIs in dcCreator"""
+    person_items = []
+    for person in persons:
+        known_person_uris = person_uri_index({'persons': [person]})
+        person_items.append(filter_europeana_items(None, europeana_items, known_person_uris))
+    return person_items
+
+
+def store_person_items(persons, title, europeana_items):
+    """Keep the items of a batched search per person, under person_items_key"""
+    person_items = split_items_by_person(europeana_items, persons)
+    get_search_store().put_many([(person_items_key(person, title), {'items': items})
+                                 for person, items in zip(persons, person_items)])
+    return person_items
+
+
+def add_enrichments(data, europeana_items):
+    # extract enrichments
+    enrichments = extract_europeana_data(europeana_items)
+    if(len(enrichments) == 0):
+        print("\tNo enrichments found.")
+        return
+    print("\tEnriching record with", len(enrichments), "related objects.")
+    data['related_europeana_items'] = merge_related_items(data.get('related_europeana_items', []), enrichments)
+
+
 def enrich_europeana(data):
     """Enriches a normalized record with Europeana data"""
-    # TODO: improve and remove duplicates
-    title = data.get('title')
     if 'persons' not in data:
         return data
+    known_person_uris = person_uri_index(data)
+    answered = stored_person_items(data)
     for person in data['persons']:
-        name = person['name']
-        query = name
-        if title:
-            query = query + " " + title
+        stored = answered.get(person_items_key(person, data.get('title')))
+        if stored is not None:
+            print("\t", len(stored['items']), "related objects of an earlier batch for", person['name'])
+            add_enrichments(data, stored['items'])
+    for query, rows, persons in europeana_searches(data, answered):
 
         # all items returned by Europeana
         #print("\tSearching Europeana for '", query, end="' ...")
         print("\tSearching Europeana for '", query)
         print("' ...")
 
-        europeana_items = find_europeana_items(query)
-        if(europeana_items is None):
+        found_items = search_europeana_items(query, rows)
+        record_call('europeana ' + query, found_items is not None)
+        if(found_items is None):
             print("0 results.")
             continue
         else:
-            print(len(europeana_items), "results.")
+            print(len(found_items), "results.")
         # filter items
-        europeana_items = filter_europeana_items(data, europeana_items)
-        # extract enrichments
-        enrichments = extract_europeana_data(europeana_items)
-        if(len(enrichments) == 0):
-            print("\tNo enrichments found.")
-            continue
-        print("\tEnriching record with", len(enrichments), "related objects.")
-        if data.get('related_europeana_items') is not None:
-            data['related_europeana_items'].extend(enrichments)
+        if len(persons) > 1:
+            europeana_items = []
+            for person, person_items in zip(persons, store_person_items(persons, data.get('title'), found_items)):
+                print("\t", len(person_items), "related objects for", person['name'])
+                europeana_items = merge_related_items(europeana_items, person_items)
         else:
-            data['related_europeana_items'] = enrichments
+            europeana_items = filter_europeana_items(data, found_items, known_person_uris)
+        add_enrichments(data, europeana_items)
     return data
 
 
@@ -143,7 +389,7 @@ def count_europeana_items(name):
     print("\tSearching Europeana for '", query)
     print("' ...")
 
-    europeana_items = find_europeana_items_ext(query)
+    europeana_items = count_europeana_results(query)
 #    if(europeana_items is None):
 #        print("0 results.")
 #        return 0
@@ -156,22 +402,11 @@ def count_europeana_items(name):
 
 # GND enrichment
 
-GND_URI_PATTERN = "{GND_URI}/about/rdf"
-
 def collect_sameas_uris(gnd_uri):
-    same_as_uris = []
-    url = GND_URI_PATTERN.replace("{GND_URI}", gnd_uri)
-    headers = {'Accept': 'application/rdf+xml'}
-    r = requests.get(url, allow_redirects=True)
-    if(r.status_code != 200):
-        print("Request error:", r.url)
-        return same_as_uris
-    #print(r.text)
-    soup = BeautifulSoup(r.text)
-    owl_sameas_tags = soup.find_all('owl:sameas')
-    for tag in owl_sameas_tags:
-        same_as_uris.append(tag['rdf:resource'])
-    return same_as_uris
+    # resolved once per GND authority, see gnd_helper
+    same_as_uris = gnd_helper.resolve_sameas_uris(gnd_uri)
+    record_call('gnd ' + gnd_uri, same_as_uris is not None)
+    return same_as_uris or []
 
 
 def enrich_gnd(data):
@@ -200,6 +435,74 @@ def enrich_gnd(data):
     return data
 
 
+# Enrichment planning
+
+class EnrichmentPlan:
+
+    """Unique remote lookups of a set of records"""
+
+    def __init__(self):
+        self.records = 0
+        self.gnd_mentions = 0
+        self.gnd_uris = []
+        # titles and persons of the planned records, their searches depend on the result counts
+        self.searched = []
+        self.person_queries = []
+
+
+def plan_enrichment(inputfiles, skip=None):
+    """Collect the distinct GND URIs and Europeana person queries of all records to be enriched"""
+    plan = EnrichmentPlan()
+    gnd_uris = []
+    person_queries = []
+    for filename, record in read_records(inputfiles):
+        if skip and skip(filename, record):
+            continue
+        data = json.loads(record)
+        plan.records += 1
+        gnd_helper.find_gnd_uris(data, gnd_uris)
+        searched = {'title': data.get('title'), 'persons': data.get('persons', [])}
+        plan.searched.append(searched)
+        person_queries.extend(europeana_query(person['name'], searched['title']) for person in searched['persons'])
+    plan.gnd_mentions = len(gnd_uris)
+    plan.gnd_uris = batch_lookup.unique(gnd_uris)
+    plan.person_queries = batch_lookup.unique(person_queries)
+    return plan
+
+
+def count_person_queries(queries, workers=None):
+    """Result counts of the person queries missing in the search and count stores, with rows=0 requests"""
+    search_store = get_search_store()
+    count_store = get_count_store()
+    missing = [query for query in queries if query not in search_store and query not in count_store]
+    print 'Counting Europeana results of', len(missing), 'queries'
+    for total_results in batch_lookup.lookup_all(count_europeana_results, missing, workers):
+        pass
+
+
+def execute_plan(plan, workers=None):
+    """Run every remote lookup of the plan once, records are then enriched from the stores"""
+    print 'Planned', plan.records, 'records:', len(plan.gnd_uris), 'distinct of', plan.gnd_mentions, 'GND URIs,', \
+        len(plan.person_queries), 'distinct Europeana person queries'
+    gnd_helper.get_resolver().prefetch(plan.gnd_uris, workers)
+    if batch_settings['enabled']:
+        # batches are chosen by the result counts of the separate person queries
+        count_person_queries(plan.person_queries, workers)
+    queries = []
+    for searched in plan.searched:
+        queries.extend((query, rows) for query, rows, persons in europeana_searches(searched))
+    store = get_search_store()
+    missing = [(query, rows) for query, rows in batch_lookup.unique(queries) if query not in store]
+    print 'Searching Europeana for', len(missing), 'queries'
+    for result in batch_lookup.lookup_all(search_planned_query, missing, workers):
+        pass
+
+
+def search_planned_query(planned):
+    query, rows = planned
+    return search_europeana_items(query, rows)
+
+
 # Main enrichment routine
 
 def enrich(normalized_record):
@@ -214,20 +517,212 @@ def enrich(normalized_record):
     return enriched_record
 
 
-def enrich_records(inputfiles, outputdir, force=False):
-    print("Enriching", len(inputfiles), "records. Saving to", outputdir)
+def enriched_file_name(filename):
+    return os.path.basename(filename).replace(".json", "_enriched.json")
+
+
+def is_enriched(store, journal, outputdir, filename, record):
+    """Written records, unless the journal lists them as interrupted or failed"""
+    record_id = json.loads(record)['aleph_id']
+    if store is not None:
+        exists = record_id in store
+    else:
+        exists = os.path.exists(outputdir + "/" + enriched_file_name(filename))
+    return exists and not journal.needs_enrichment(record_id)
+
+
+# Call log
+
+# remote calls of the record that is currently enriched by a thread
+call_log = threading.local()
+
+
+def record_call(call, ok):
+    calls = getattr(call_log, 'calls', None)
+    if calls is not None:
+        calls.append((call, ok))
+
+
+def logging_calls(calls, function, *args):
+    call_log.calls = calls
+    try:
+        return function(*args)
+    finally:
+        call_log.calls = None
+
+
+# Pipelined enrichment
+
+ENRICH_GND_WORKERS = 4
+ENRICH_EUROPEANA_WORKERS = 4
+ENRICH_QUEUE_SIZE = 100
+STAGE_DONE = None
+
+pipeline_settings = {'enabled': False, 'gnd_workers': ENRICH_GND_WORKERS,
+                     'europeana_workers': ENRICH_EUROPEANA_WORKERS, 'queue_size': ENRICH_QUEUE_SIZE,
+                     'prefetch': True}
+
+
+def configure_pipeline(gnd_workers=None, europeana_workers=None, queue_size=None, enabled=None, prefetch=None):
+    if enabled is not None:
+        pipeline_settings['enabled'] = enabled
+    if prefetch is not None:
+        pipeline_settings['prefetch'] = prefetch
+    if gnd_workers is not None:
+        pipeline_settings['gnd_workers'] = gnd_workers
+    if europeana_workers is not None:
+        pipeline_settings['europeana_workers'] = europeana_workers
+    if queue_size is not None:
+        pipeline_settings['queue_size'] = queue_size
+
+
+def run_stage(name, process, in_queue, out_queue):
+    while True:
+        item = in_queue.get()
+        if item is STAGE_DONE:
+            break
+        try:
+            result = process(item)
+        except Exception as e:
+            # the record is not written and enriched again by the next run
+            print 'Error in', name, 'stage for', item[0], e
+            continue
+        if out_queue is not None:
+            out_queue.put(result)
+
+
+def start_stage(name, process, in_queue, out_queue, workers):
+    threads = []
+    for i in range(workers):
+        thread = threading.Thread(target=run_stage, args=(name, process, in_queue, out_queue))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    return threads
+
+
+def finish_stage(threads, in_queue):
+    for thread in threads:
+        in_queue.put(STAGE_DONE)
+    for thread in threads:
+        thread.join()
+
+
+def write_enriched_record(store, journal, outputdir, out_file, enriched_record, calls):
+    if store is not None:
+        store.put(enriched_record['aleph_id'], enriched_record)
+    else:
+        write_json_file(outputdir, out_file, enriched_record)
+    if journal.finish(enriched_record['aleph_id'], calls) == enrich_journal.STATUS_FAILED:
+        print(out_file, "written with failed calls, it is enriched again by the next run")
+
+
+# items of the stages are (out_file, data, calls), calls collects the remote calls of the record across stages
+
+def enrich_gnd_item(item):
+    out_file, data, calls = item
+    return (out_file, logging_calls(calls, enrich_gnd, data), calls)
+
+
+def enrich_europeana_item(item):
+    out_file, data, calls = item
+    return (out_file, logging_calls(calls, enrich_europeana, data), calls)
+
+
+def enrich_records_pipelined(inputfiles, outputdir, force, store, journal):
+    """GND resolution, Europeana search and writing run as stages joined by bounded queues"""
+    queue_size = pipeline_settings['queue_size']
+    gnd_queue = Queue.Queue(queue_size)
+    europeana_queue = Queue.Queue(queue_size)
+    write_queue = Queue.Queue(queue_size)
+
+    def write_item(item):
+        out_file, data, calls = item
+        write_enriched_record(store, journal, outputdir, out_file, data, calls)
+
+    gnd_stage = start_stage('GND', enrich_gnd_item, gnd_queue, europeana_queue, pipeline_settings['gnd_workers'])
+    europeana_stage = start_stage('Europeana', enrich_europeana_item, europeana_queue, write_queue,
+                                  pipeline_settings['europeana_workers'])
+    # a single writer, record stores are not thread safe
+    write_stage = start_stage('write', write_item, write_queue, None, 1)
+
+    for index, (filename, record) in enumerate(read_records(inputfiles)):
+        progress((index+1)/len(inputfiles))
+        out_file = enriched_file_name(filename)
+        if not force and is_enriched(store, journal, outputdir, filename, record):
+            print(out_file, "already enriched. Skipping...")
+            continue
+        data = json.loads(record)
+        journal.start(data['aleph_id'])
+        gnd_queue.put((out_file, data, []))
+    finish_stage(gnd_stage, gnd_queue)
+    finish_stage(europeana_stage, europeana_queue)
+    finish_stage(write_stage, write_queue)
+
+
+def enrich_records_sequential(inputfiles, outputdir, force, store, journal):
     for index, (filename, record) in enumerate(read_records(inputfiles)):
         progress((index+1)/len(inputfiles))
-        out_file = os.path.basename(filename).replace(".json",
-                                                      "_enriched.json")
-        out_path = outputdir + "/" + out_file
-        if(os.path.exists(out_path) and not force):
+        out_file = enriched_file_name(filename)
+        exists = is_enriched(store, journal, outputdir, filename, record)
+        if(exists and not force):
             print(out_file, "already enriched. Skipping...")
         else:
 #            print("record: ", record)
-            enriched_record = enrich(record)
+            journal.start(json.loads(record)['aleph_id'])
+            calls = []
+            enriched_record = logging_calls(calls, enrich, record)
             print("enriched_record: ", enriched_record)
-            write_json_file(outputdir, out_file, enriched_record)
+            write_enriched_record(store, journal, outputdir, out_file, enriched_record, calls)
+
+
+def enrich_records(inputfiles, outputdir, force=False, packed=False, prefetch=None, pipelined=None, retry_only=False):
+    if pipelined is None:
+        pipelined = pipeline_settings['enabled']
+    if prefetch is None:
+        # the pipeline stages make the remote calls themselves, so that slow calls do not hold back writing
+        prefetch = pipeline_settings['prefetch'] and not pipelined
+    store = None
+    if packed:
+        store = record_store.RecordStore(outputdir)
+    journal = enrich_journal.EnrichmentJournal(enrich_journal.journal_path(outputdir))
+    if retry_only:
+        # only records that were interrupted or written with failed calls
+        inputfiles = record_store.select_records(inputfiles, journal.record_ids())
+    print("Enriching", len(inputfiles), "records. Saving to", outputdir)
+    if prefetch:
+        # run the remote lookups of the pending records once per distinct key
+        plan = plan_enrichment(inputfiles,
+            skip=lambda filename, record: not force and is_enriched(store, journal, outputdir, filename, record))
+        execute_plan(plan)
+    if pipelined:
+        enrich_records_pipelined(inputfiles, outputdir, force, store, journal)
+    else:
+        enrich_records_sequential(inputfiles, outputdir, force, store, journal)
+    print 'Enrichment journal:', journal.stats()
+    journal.close()
+    if store is not None:
+        store.close()
+
+
+def remove_enriched_records(record_ids, outputdir, packed=False):
+    """Drop the enrichments of records that left the normalized corpus, e.g. data/normalized.removed.txt"""
+    removed = 0
+    if packed:
+        store = record_store.RecordStore(outputdir)
+        for record_id in record_ids:
+            if record_id in store:
+                store.delete(record_id)
+                removed += 1
+        store.close()
+    else:
+        for record_id in record_ids:
+            out_path = outputdir + "/" + enriched_file_name(record_id + ".json")
+            if os.path.exists(out_path):
+                os.remove(out_path)
+                removed += 1
+    print 'Removed', removed, 'enriched records whose normalized record disappeared'
+    return removed
 
 
 # Command line parsing
@@ -245,6 +740,27 @@ if __name__ == '__main__':
                     help="Europeana API key")
     parser.add_argument('-f', '--force', type=bool, default=False,
                     help="Overwrite already existing enrichment files")
+    parser.add_argument('-p', '--packed', action='store_true',
+                    help="Write records to a packed record store instead of one file per record")
+    parser.add_argument('--no_prefetch', action='store_true',
+                    help="Enrich record by record without planning the distinct remote lookups first, "
+                         "pipelined runs never plan ahead")
+    parser.add_argument('--pipelined', action='store_true',
+                    help="Run GND resolution, Europeana search and writing as concurrent stages")
+    parser.add_argument('--gnd_workers', type=int, nargs='?',
+                    default=ENRICH_GND_WORKERS,
+                    help="Number of GND resolution threads of the pipeline")
+    parser.add_argument('--europeana_workers', type=int, nargs='?',
+                    default=ENRICH_EUROPEANA_WORKERS,
+                    help="Number of Europeana search threads of the pipeline")
+    parser.add_argument('-r', '--retry_failed', action='store_true',
+                    help="Enrich again only records the journal lists as interrupted or failed")
+    parser.add_argument('-b', '--batch_queries', action='store_true',
+                    help="Combine the Europeana searches of several persons of a record into one query")
+    parser.add_argument('-c', '--changed_ids', type=str, nargs='?',
+                    help="Enrich again only the records listed in this file, e.g. data/normalized.changed.txt")
+    parser.add_argument('--removed_ids', type=str, nargs='?',
+                    help="Remove the enriched records listed in this file, e.g. data/normalized.removed.txt")
 
 
     if len(sys.argv) < 2:
@@ -252,5 +768,16 @@ if __name__ == '__main__':
         sys.exit(1)
 
     args = parser.parse_args()
-    EUROPEANA_API_KEY = args.europeana_api_key
-    enrich_records(args.inputfiles, args.outputdir, args.force)
+    if args.europeana_api_key:
+        EUROPEANA_API_KEY = args.europeana_api_key[0]
+    inputs = record_store.open_inputs(args.inputfiles)
+    if args.changed_ids:
+        # changed records replace their earlier enrichment
+        inputs = record_store.select_records(inputs, record_store.read_record_ids(args.changed_ids))
+        args.force = True
+    configure_pipeline(args.gnd_workers, args.europeana_workers, prefetch=not args.no_prefetch)
+    configure_batching(args.batch_queries)
+    enrich_records(inputs, args.outputdir, args.force, args.packed, pipelined=args.pipelined,
+                   retry_only=args.retry_failed)
+    if args.removed_ids:
+        remove_enriched_records(record_store.read_record_ids(args.removed_ids), args.outputdir, args.packed)
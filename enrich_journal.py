@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""
+Journal of enrichment runs.
+
+A record is marked pending when its enrichment starts and done or failed
+once it is written, together with the status of every remote call made for
+it. Pending and failed records are enriched again by the next run, their
+successful calls are then answered from the GND and Europeana stores, so
+only the failed and missing calls are sent again.
+
+Invocation:
+$ python enrich_journal.py data/enriched.journal.sqlite -f
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+
+STATUS_PENDING = 'pending'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+JOURNAL_EXT = '.journal.sqlite'
+
+
+def journal_path(outputdir):
+
+    return os.path.normpath(outputdir) + JOURNAL_EXT
+
+
+class EnrichmentJournal:
+
+    def __init__(self, dbfile):
+        self.dbfile = dbfile
+        self.lock = threading.Lock()
+        dirname = os.path.dirname(dbfile)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        self.db = sqlite3.connect(dbfile, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS records '
+                        '(record_id TEXT PRIMARY KEY, status TEXT, updated REAL)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS calls '
+                        '(record_id TEXT, call TEXT, status TEXT, updated REAL, PRIMARY KEY (record_id, call))')
+        self.db.execute('CREATE INDEX IF NOT EXISTS records_status ON records (status)')
+        self.db.commit()
+
+
+    def start(self, record_id):
+
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO records VALUES (?, ?, ?)', (record_id, STATUS_PENDING, time.time()))
+            self.db.execute('DELETE FROM calls WHERE record_id = ?', (record_id,))
+            self.db.commit()
+
+
+    def finish(self, record_id, calls):
+
+        """Record the outcome of the (call, ok) pairs of a written record"""
+        now = time.time()
+        status = STATUS_DONE
+        if [call for call, ok in calls if not ok]:
+            status = STATUS_FAILED
+        with self.lock:
+            self.db.executemany('INSERT OR REPLACE INTO calls VALUES (?, ?, ?, ?)',
+                                [(record_id, call, STATUS_DONE if ok else STATUS_FAILED, now) for call, ok in calls])
+            self.db.execute('INSERT OR REPLACE INTO records VALUES (?, ?, ?)', (record_id, status, now))
+            self.db.commit()
+        return status
+
+
+    def status(self, record_id):
+
+        with self.lock:
+            entry = self.db.execute('SELECT status FROM records WHERE record_id = ?', (record_id,)).fetchone()
+        if entry is None:
+            return None
+        return entry[0]
+
+
+    def needs_enrichment(self, record_id):
+
+        """Records interrupted or written with failed calls"""
+        return self.status(record_id) in [STATUS_PENDING, STATUS_FAILED]
+
+
+    def record_ids(self, statuses=(STATUS_PENDING, STATUS_FAILED)):
+
+        with self.lock:
+            return [record_id for (record_id,) in self.db.execute(
+                'SELECT record_id FROM records WHERE status IN (' + ', '.join('?' * len(statuses)) + ')',
+                tuple(statuses))]
+
+
+    def failed_calls(self):
+
+        with self.lock:
+            return self.db.execute('SELECT record_id, call FROM calls WHERE status = ? ORDER BY record_id',
+                                   (STATUS_FAILED,)).fetchall()
+
+
+    def stats(self):
+
+        with self.lock:
+            res = dict(self.db.execute('SELECT status, COUNT(*) FROM records GROUP BY status').fetchall())
+            res['failed calls'] = self.db.execute('SELECT COUNT(*) FROM calls WHERE status = ?',
+                                                  (STATUS_FAILED,)).fetchone()[0]
+        return res
+
+
+    def close(self):
+
+        with self.lock:
+            self.db.close()
+
+
+# Command line parsing
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+                    description="Inspect the journal of enrichment runs.")
+    parser.add_argument('journalfile', type=str,
+                    help="Journal file, e.g. data/enriched.journal.sqlite")
+    parser.add_argument('-f', '--failed', action='store_true',
+                    help="List failed calls")
+
+    if len(sys.argv) < 2:
+        parser.print_help()
+        sys.exit(1)
+
+    args = parser.parse_args()
+    journal = EnrichmentJournal(args.journalfile)
+    print 'Enrichment journal:', journal.stats()
+    if args.failed:
+        for record_id, call in journal.failed_calls():
+            print record_id, call
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+##
+##    In this module we test the Europeana enrichment of normalized records for scoregraph project.
+##
+
+import unittest
+import json
+import os
+import shutil
+import tempfile
+
+import enrich
+import gnd_helper
+import persistent_store
+import record_store
+
+
+TEST_RECORD = {
+    'aleph_id': u'AL00119186', 'title': u'Lieder',
+    'persons': [{'name': u'Mahler, Gustav',
+                 'sameas': [u'http://d-nb.info/gnd/118576291', u'https://viaf.org/viaf/61732497/']},
+                {'name': u'Wolf, Hugo', 'sameas': [u'http://d-nb.info/gnd/118634518']}]
+}
+
+
+class TestEuropeanaFilter(unittest.TestCase):
+
+    def test_uris_are_compared_in_canonical_form(self):
+        self.assertEqual(enrich.canonical_uri(u' HTTPS://VIAF.org/viaf/61732497/ '), u'http://viaf.org/viaf/61732497')
+        self.assertEqual(enrich.canonical_uri(u'Mahler, Gustav'), u'Mahler, Gustav')
+        self.assertEqual(enrich.canonical_uri(u'http://viaf.org/viaf/M\xe4hler'), 'http://viaf.org/viaf/M\xc3\xa4hler')
+        uris = [uri for record in [TEST_RECORD, dict(TEST_RECORD)] for uri in enrich.person_uri_index(record)]
+        shared = [uri for uri in uris if uri == 'http://d-nb.info/gnd/118576291']
+        self.assertTrue(shared[0] is shared[1])
+        self.assertEqual(enrich.person_uri_index(TEST_RECORD),
+                         set([u'http://d-nb.info/gnd/118576291', u'http://viaf.org/viaf/61732497',
+                              u'http://d-nb.info/gnd/118634518']))
+
+    def test_items_are_kept_once_per_matching_creator(self):
+        items = [{'id': u'/1', 'dcCreator': [u'Mahler, Gustav', u'http://viaf.org/viaf/61732497']},
+                 {'id': u'/2', 'dcCreator': [u'https://d-nb.info/gnd/118576291/', u'http://d-nb.info/gnd/118634518']},
+                 {'id': u'/3', 'dcCreator': [u'http://d-nb.info/gnd/118540238']},
+                 {'id': u'/4'}]
+        self.assertEqual([item['id'] for item in enrich.filter_europeana_items(TEST_RECORD, items)], [u'/1', u'/2'])
+
+    def test_related_items_are_merged_by_id(self):
+        related = [{'id': u'/1'}, {'id': None, 'title': u'first'}]
+        enrichments = [{'id': u'/1'}, {'id': None, 'title': u'second'}, {'id': u'/2'}, {'id': None, 'title': u'third'},
+                       {'id': u'/2'}]
+        merged = enrich.merge_related_items(related, enrichments)
+        self.assertEqual([(item['id'], item.get('title')) for item in merged],
+                         [(u'/1', None), (None, u'first'), (None, u'second'), (u'/2', None), (None, u'third')])
+
+
+class FakeEuropeanaResponse:
+
+    def __init__(self, params, result):
+        self.url = enrich.EUROPEANA_API_URI + params['query']
+        self.status_code = 200
+        self.result = result
+
+    def json(self):
+        return self.result
+
+
+class FakeEuropeanaClient:
+
+    def __init__(self, counts, items):
+        self.counts = counts
+        self.items = items
+        self.requests = []
+
+    def get(self, url, params=None, **kwargs):
+        self.requests.append((params['query'], params['rows']))
+        if params['rows'] == 0:
+            return FakeEuropeanaResponse(params, {'totalResults': self.counts.get(params['query'], 0)})
+        return FakeEuropeanaResponse(params, {'items': self.items.get(params['query'], [])[:params['rows']]})
+
+
+class EnrichmentFixture(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.http_client = enrich.http_client
+        self.api_key = enrich.EUROPEANA_API_KEY
+        enrich.EUROPEANA_API_KEY = 'key'
+        enrich.default_search_store = persistent_store.PersistentMap(os.path.join(self.tmpdir, 'search.sqlite'))
+        enrich.default_count_store = persistent_store.PersistentMap(os.path.join(self.tmpdir, 'count.sqlite'))
+        gnd_store = persistent_store.PersistentMap(os.path.join(self.tmpdir, 'gnd.sqlite'))
+        gnd_helper.default_resolver = gnd_helper.SameAsResolver(gnd_store, lambda gnd_uri: [])
+
+    def tearDown(self):
+        enrich.http_client = self.http_client
+        enrich.EUROPEANA_API_KEY = self.api_key
+        enrich.configure_batching(False)
+        enrich.default_search_store.close()
+        enrich.default_count_store.close()
+        enrich.default_search_store = None
+        enrich.default_count_store = None
+        gnd_helper.default_resolver.store.close()
+        gnd_helper.default_resolver = None
+        shutil.rmtree(self.tmpdir)
+
+    def write_records(self, records):
+        inputfiles = []
+        for data in records:
+            filename = os.path.join(self.tmpdir, data['aleph_id'] + '.json')
+            with open(filename, 'wb') as record_file:
+                json.dump(data, record_file)
+            inputfiles.append(filename)
+        return inputfiles
+
+    def read_enriched(self, outputdir, aleph_id):
+        with open(os.path.join(outputdir, aleph_id + '_enriched.json'), 'rb') as enriched_file:
+            return json.load(enriched_file)
+
+
+class TestEnrichRecords(EnrichmentFixture):
+
+    def test_pipelined_stages_make_the_remote_calls(self):
+        items = [{'id': u'/1', 'dcCreator': [u'http://d-nb.info/gnd/118576291']}]
+        client = FakeEuropeanaClient({}, {u'Mahler, Gustav Lieder': items})
+        enrich.http_client = client
+        planned = []
+        execute_plan = enrich.execute_plan
+        enrich.execute_plan = lambda plan, workers=None: planned.append(plan)
+        try:
+            inputfiles = self.write_records([dict(TEST_RECORD, persons=TEST_RECORD['persons'][:1])])
+            outputdir = os.path.join(self.tmpdir, 'enriched')
+            enrich.enrich_records(inputfiles, outputdir, pipelined=True)
+        finally:
+            enrich.execute_plan = execute_plan
+        self.assertEqual(planned, [])
+        self.assertEqual(client.requests, [(u'Mahler, Gustav Lieder', enrich.EUROPEANA_MAX_ROWS)])
+        self.assertEqual([item['id'] for item in self.read_enriched(outputdir, u'AL00119186')['related_europeana_items']],
+                         [u'/1'])
+
+
+class TestRemovedRecords(unittest.TestCase):
+
+    def setUp(self):
+        self.outputdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.outputdir)
+
+    def test_enrichments_of_removed_records_are_deleted(self):
+        for record_id in [u'AL00119180', u'AL00119181']:
+            with open(os.path.join(self.outputdir, enrich.enriched_file_name(record_id + '.json')), 'wb') as out_file:
+                out_file.write('{}')
+        self.assertEqual(enrich.remove_enriched_records([u'AL00119181', u'AL00119182'], self.outputdir), 1)
+        self.assertEqual(os.listdir(self.outputdir), ['AL00119180_enriched.json'])
+        packeddir = os.path.join(self.outputdir, 'packed')
+        store = record_store.RecordStore(packeddir)
+        store.put(u'AL00119181', {'aleph_id': u'AL00119181'})
+        store.close()
+        self.assertEqual(enrich.remove_enriched_records([u'AL00119181'], packeddir, True), 1)
+        self.assertEqual(len(record_store.RecordStore(packeddir)), 0)
+
+
+class TestBatchedSearches(unittest.TestCase):
+
+    def setUp(self):
+        self.storedir = tempfile.mkdtemp()
+        enrich.default_search_store = persistent_store.PersistentMap(os.path.join(self.storedir, 'search.sqlite'))
+        enrich.default_count_store = persistent_store.PersistentMap(os.path.join(self.storedir, 'count.sqlite'))
+        enrich.configure_batching(True)
+
+    def tearDown(self):
+        enrich.configure_batching(False, enrich.EUROPEANA_BATCH_MAX_PERSONS)
+        enrich.default_search_store.close()
+        enrich.default_count_store.close()
+        enrich.default_search_store = None
+        enrich.default_count_store = None
+        shutil.rmtree(self.storedir)
+
+    def count(self, name, total_results):
+        enrich.get_count_store().put(enrich.europeana_query(name, u'Lieder'), {'totalResults': total_results})
+
+    def test_persons_with_small_known_counts_share_a_query(self):
+        self.count(u'Mahler, Gustav', 12)
+        self.count(u'Wolf, Hugo', 3)
+        self.assertEqual([(query, rows, len(persons)) for query, rows, persons in enrich.europeana_searches(TEST_RECORD)],
+                         [(u'((Mahler, Gustav) OR (Wolf, Hugo)) Lieder', 15, 2)])
+
+    def test_persons_with_unknown_or_large_counts_are_searched_separately(self):
+        self.count(u'Mahler, Gustav', 1200)
+        separate = [(u'Mahler, Gustav Lieder', enrich.EUROPEANA_MAX_ROWS, 1),
+                    (u'Wolf, Hugo Lieder', enrich.EUROPEANA_MAX_ROWS, 1)]
+        self.assertEqual([(query, rows, len(persons)) for query, rows, persons in enrich.europeana_searches(TEST_RECORD)],
+                         separate)
+        enrich.configure_batching(False)
+        self.count(u'Mahler, Gustav', 12)
+        self.count(u'Wolf, Hugo', 3)
+        self.assertEqual([(query, rows, len(persons)) for query, rows, persons in enrich.europeana_searches(TEST_RECORD)],
+                         separate)
+
+    def test_items_of_a_batch_are_stored_per_person(self):
+        items = [{'id': u'/1', 'dcCreator': [u'http://viaf.org/viaf/61732497']},
+                 {'id': u'/2', 'dcCreator': [u'http://d-nb.info/gnd/118634518']},
+                 {'id': u'/3', 'dcCreator': [u'http://d-nb.info/gnd/118576291', u'http://d-nb.info/gnd/118634518']},
+                 {'id': u'/4', 'dcCreator': [u'http://d-nb.info/gnd/118540238']}]
+        persons = TEST_RECORD['persons']
+        self.assertEqual([[item['id'] for item in person_items]
+                          for person_items in enrich.split_items_by_person(items, persons)],
+                         [[u'/1', u'/3'], [u'/2', u'/3']])
+        enrich.store_person_items(persons, u'Lieder', items)
+        self.assertFalse(u'Wolf, Hugo Lieder' in enrich.get_search_store())
+        stored = enrich.stored_person_items(TEST_RECORD)
+        self.assertEqual([item['id'] for item in stored[enrich.person_items_key(persons[1], u'Lieder')]['items']],
+                         [u'/2', u'/3'])
+        # answered persons are not searched again, other records of the person are
+        self.count(u'Mahler, Gustav', 12)
+        self.count(u'Wolf, Hugo', 3)
+        self.assertEqual(enrich.europeana_searches(TEST_RECORD), [])
+        other_person = dict(persons[1], sameas=[u'http://d-nb.info/gnd/118634519'])
+        self.assertEqual([(query, rows) for query, rows, persons in
+                          enrich.europeana_searches(dict(TEST_RECORD, persons=[other_person]))],
+                         [(u'Wolf, Hugo Lieder', enrich.EUROPEANA_MAX_ROWS)])
+
+
+class TestBatchedEnrichment(EnrichmentFixture):
+
+    def test_planned_records_are_counted_and_searched_in_a_batch(self):
+        items = [{'id': u'/1', 'dcCreator': [u'http://d-nb.info/gnd/118576291']},
+                 {'id': u'/2', 'dcCreator': [u'http://d-nb.info/gnd/118634518']},
+                 {'id': u'/3', 'dcCreator': [u'http://d-nb.info/gnd/118540238']}]
+        client = FakeEuropeanaClient({u'Mahler, Gustav Lieder': 12, u'Wolf, Hugo Lieder': 3},
+                                     {u'((Mahler, Gustav) OR (Wolf, Hugo)) Lieder': items})
+        enrich.http_client = client
+        enrich.configure_batching(True)
+        inputfiles = self.write_records([TEST_RECORD])
+        outputdir = os.path.join(self.tmpdir, 'enriched')
+        enrich.enrich_records(inputfiles, outputdir, prefetch=True)
+        self.assertEqual(client.requests, [(u'Mahler, Gustav Lieder', 0), (u'Wolf, Hugo Lieder', 0),
+                                           (u'((Mahler, Gustav) OR (Wolf, Hugo)) Lieder', 15)])
+        self.assertEqual([item['id'] for item in self.read_enriched(outputdir, u'AL00119186')['related_europeana_items']],
+                         [u'/1', u'/2'])
+        # a second run is answered from the stores
+        enrich.enrich_records(inputfiles, outputdir, prefetch=True)
+        self.assertEqual(len(client.requests), 3)
+
+if __name__ == '__main__':
+    unittest.main()
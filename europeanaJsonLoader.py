@@ -2,13 +2,13 @@
 # This module performs loading of Europeana JSON files by URLs.
 ##
 
-import json
-import urllib
 import json
 import codecs
 import os
 import glob
 
+import http_client
+
 
 INPUT_FILE = 'agents_in_europeana.txt'
 COINS_INPUT_FILE = 'coins_in_europeana.txt'
@@ -125,7 +125,7 @@ def unitTest():
             filename = str(author_id) + JSON_EXT
 
             if not is_stored_as_json_file(OUTPUT_DIR + SLASH + filename):
-                content = urllib.urlopen(url_address).read()
+                content = http_client.read(url_address)
                 if not save_json(OUTPUT_DIR_2, filename, content):
                     save_text(OUTPUT_DIR_2, filename, content)
                 #response = json.loads(content)
@@ -166,7 +166,7 @@ def loadCoinsTest():
             filename = str(location_id) + JSON_EXT
 
             if not is_stored_as_json_file(OUTPUT_DIR_COINS + SLASH + filename):
-                content = urllib.urlopen(url_address).read()
+                content = http_client.read(url_address)
                 if not save_json_list(OUTPUT_DIR_COINS, filename, content):
                     save_text(OUTPUT_DIR_COINS, filename, content)
 
@@ -205,7 +205,7 @@ def loadUrl(url, result_filename):
     try:
         filename = result_filename + JSON_EXT
 
-        content = urllib.urlopen(url).read()
+        content = http_client.read(url)
         if not save_json_list_by_field(OUTPUT_DIR_URL, filename, content, 'search_results'):
             save_text(OUTPUT_DIR_URL, filename, content)
 
@@ -216,6 +216,7 @@ def loadUrl(url, result_filename):
     print('Loading of Europeana URL', url, 'completed.')
 
 
-#unitTest()
-#loadCoinsTest()
-loadUrlsTest(TEST_URL)
+if __name__ == '__main__':
+    #unitTest()
+    #loadCoinsTest()
+    loadUrlsTest(TEST_URL)
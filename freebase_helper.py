@@ -14,6 +14,7 @@ import urllib
 
 import common
 import glob
+import http_client
 
 import csv
 import codecs
@@ -180,7 +181,7 @@ def find_freebase_items(query):
             'key': api_key
     }
     url = service_url + '?' + urllib.urlencode(params)
-    response = json.loads(urllib.urlopen(url).read())
+    response = json.loads(http_client.read(url))
     return response
 
 
@@ -7,7 +7,7 @@ $ python wikidata_helper.py data/normalized/*.json -o summary_authors.csv
 """
 
 # HTTP connection
-import requests
+import http_client
 
 #!/usr/bin/python
 import ConfigParser
@@ -25,7 +25,7 @@ GOOGLE_MAPS_BASE_PATH = 'https://maps.google.at/maps/'
 
 # HTTP request for HTML content for particular URL
 def get_html(url):
-    r = requests.get(url)
+    r = http_client.get(url)
     print 'status code', r.status_code
     if r.status_code != 200:
         print("FAILURE: Request", r.url, "failed")
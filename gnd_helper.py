@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+"""
+Script for resolving GND authority URIs to their owl:sameAs links.
+
+Resolved links are kept in a persistent store, so every GND authority is
+fetched from d-nb.info once, no matter in how many records it appears.
+Concurrent requests for the same URI are coalesced into a single fetch. A
+prefetch pass collects the distinct GND URIs of all normalized records and
+resolves them ahead of enrichment.
+
+Invocation:
+$ python gnd_helper.py data/normalized/*.json -s data/gnd_sameas.sqlite
+"""
+
+import argparse
+import json
+import sys
+import threading
+
+import xml.etree.cElementTree as ET
+
+import batch_lookup
+import common
+import http_client
+import persistent_store
+import record_store
+
+
+GND_PREFIX = "http://d-nb.info/gnd"
+GND_URI_PATTERN = "{GND_URI}/about/rdf"
+GND_SAMEAS_STORE = 'data/gnd_sameas.sqlite'
+GND_SAMEAS_TTL = None                             # seconds, None keeps links forever
+SAMEAS_JSON = 'sameas'
+
+RDF_NS = '{http://www.w3.org/1999/02/22-rdf-syntax-ns#}'
+OWL_SAMEAS_TAG = '{http://www.w3.org/2002/07/owl#}sameAs'
+RDF_RESOURCE_ATTR = RDF_NS + 'resource'
+RDF_ABOUT_ATTR = RDF_NS + 'about'
+
+
+def scheme_free_uri(uri):
+
+    """URI without its scheme, d-nb.info answers http:// requests with https:// descriptions"""
+    return uri.split('://', 1)[-1] if uri else uri
+
+
+def extract_sameas_uris(source, gnd_uri=None):
+
+    """Stream owl:sameAs resources out of an RDF/XML document without building a tree.
+
+    Parsing stops once the top level description of gnd_uri is complete,
+    later descriptions of a GND document do not carry links of the authority.
+    """
+    same_as_uris = []
+    depth = 0
+    about = scheme_free_uri(gnd_uri)
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            depth += 1
+            continue
+        depth -= 1
+        if elem.tag == OWL_SAMEAS_TAG:
+            same_as_uris.append(elem.get(RDF_RESOURCE_ATTR))
+        elif depth == 1:
+            if about is not None and scheme_free_uri(elem.get(RDF_ABOUT_ATTR)) == about:
+                break
+            # descriptions are done with, drop their content
+            elem.clear()
+    return same_as_uris
+
+
+def fetch_sameas_uris(gnd_uri):
+
+    """owl:sameAs links of a GND authority, None if the request failed"""
+    url = GND_URI_PATTERN.replace("{GND_URI}", gnd_uri)
+    r = http_client.get(url, allow_redirects=True, stream=True)
+    try:
+        if(r.status_code != 200):
+            print("Request error:", r.url)
+            return None
+        r.raw.decode_content = True
+        return extract_sameas_uris(r.raw, gnd_uri)
+    except SyntaxError as e:
+        # ParseError, e.g. for a truncated response
+        print("Parse error:", r.url, e)
+        return None
+    finally:
+        r.close()
+
+
+class SameAsResolver:
+
+    def __init__(self, store, fetch=fetch_sameas_uris):
+        self.store = store
+        self.fetch = fetch
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        # URIs whose fetch failed are not requested again within a run
+        self.failed = set()
+        self.fetched = 0
+
+
+    def resolve(self, gnd_uri):
+
+        """sameAs links of a GND URI from the store, fetched once if missing, None if the fetch failed"""
+        with self.lock:
+            same_as_uris = self.store.get(gnd_uri)
+            if same_as_uris is not None or gnd_uri in self.failed:
+                return same_as_uris
+            event = self.in_flight.get(gnd_uri)
+            owner = event is None
+            if owner:
+                event = threading.Event()
+                self.in_flight[gnd_uri] = event
+        if not owner:
+            # another thread is fetching the same URI, wait for its result
+            event.wait()
+            return self.store.get(gnd_uri)
+        same_as_uris = None
+        try:
+            same_as_uris = self.fetch(gnd_uri)
+            # failed requests are not stored, so they are retried later
+            if same_as_uris is not None:
+                self.store.put(gnd_uri, same_as_uris)
+        finally:
+            with self.lock:
+                if same_as_uris is None:
+                    self.failed.add(gnd_uri)
+                self.fetched += 1
+                del self.in_flight[gnd_uri]
+            event.set()
+        return same_as_uris
+
+
+    def prefetch(self, gnd_uris, workers=None):
+
+        """Resolve all URIs missing in the store, returns the number of fetched URIs"""
+        missing = [gnd_uri for gnd_uri in batch_lookup.unique(gnd_uris) if gnd_uri not in self.store]
+        print 'Prefetching', len(missing), 'GND URIs'
+        for index, result in enumerate(batch_lookup.lookup_all(self.resolve, missing, workers)):
+            if (index + 1) % 100 == 0:
+                print 'Resolved', index + 1, 'of', len(missing), 'GND URIs'
+        return len(missing)
+
+
+# Shared resolver instance
+
+default_resolver = None
+resolver_lock = threading.Lock()
+resolver_settings = {'storefile': GND_SAMEAS_STORE, 'ttl': GND_SAMEAS_TTL}
+
+
+def configure(storefile=None, ttl=None):
+
+    global default_resolver
+    if storefile is not None:
+        resolver_settings['storefile'] = storefile
+    if ttl is not None:
+        resolver_settings['ttl'] = ttl
+    with resolver_lock:
+        default_resolver = None
+
+
+def get_resolver():
+
+    global default_resolver
+    if default_resolver is None:
+        with resolver_lock:
+            if default_resolver is None:
+                store = persistent_store.PersistentMap(resolver_settings['storefile'], resolver_settings['ttl'])
+                default_resolver = SameAsResolver(store)
+    return default_resolver
+
+
+def resolve_sameas_uris(gnd_uri):
+
+    return get_resolver().resolve(gnd_uri)
+
+
+# Prefetch
+
+def find_gnd_uris(data, gnd_uris):
+
+    """Collect GND URIs of all 'sameas' lists, at any depth of a record"""
+    if isinstance(data, dict):
+        for key, value in data.items():
+            if key == SAMEAS_JSON and isinstance(value, list):
+                gnd_uris.extend(uri for uri in value if uri and uri.startswith(GND_PREFIX))
+            else:
+                find_gnd_uris(value, gnd_uris)
+    elif isinstance(data, list):
+        for value in data:
+            find_gnd_uris(value, gnd_uris)
+    return gnd_uris
+
+
+def collect_gnd_uris(inputfiles, skip=None):
+
+    """Distinct GND URIs of normalized records in order of first appearance"""
+    gnd_uris = []
+    for filename, record in common.read_records(inputfiles):
+        if skip and skip(filename, record):
+            continue
+        find_gnd_uris(json.loads(record), gnd_uris)
+    return batch_lookup.unique(gnd_uris)
+
+
+def prefetch_records(inputfiles, workers=None, skip=None):
+
+    gnd_uris = collect_gnd_uris(inputfiles, skip)
+    print 'Found', len(gnd_uris), 'distinct GND URIs in', len(inputfiles), 'records'
+    return get_resolver().prefetch(gnd_uris, workers)
+
+
+# Command line parsing
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+                    description="Resolve GND URIs of normalized records to their sameAs links.")
+    parser.add_argument('inputfiles', type=str, nargs='+',
+                    help="Input files to be processed")
+    parser.add_argument('-s', '--storefile', type=str, nargs='?',
+                    default=GND_SAMEAS_STORE,
+                    help="Persistent store of resolved sameAs links")
+    parser.add_argument('-w', '--workers', type=int, nargs='?',
+                    default=batch_lookup.LOOKUP_WORKERS,
+                    help="Number of concurrent lookups")
+
+    if len(sys.argv) < 2:
+        parser.print_help()
+        sys.exit(1)
+
+    args = parser.parse_args()
+    configure(args.storefile)
+    prefetch_records(record_store.open_inputs(args.inputfiles), args.workers)
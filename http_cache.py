@@ -0,0 +1,241 @@
+"""
+Persistent cache for HTTP responses used by common.process_http_query.
+
+Responses are keyed by the SHA-1 digest of their normalized URL and query
+parameters. Bodies are stored in a two level directory tree below the cache
+directory, an SQLite index maps each key to its body size, storage time and
+last access time, so lookups never scan the file system.
+
+Invocation:
+$ python http_cache.py -c data/http_cache_dir
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import urllib
+import urlparse
+
+
+HTTP_CACHE_DIR = 'data/http_cache_dir'
+HTTP_CACHE_INDEX_FILE = 'index.sqlite'
+HTTP_CACHE_TTL = 30 * 24 * 60 * 60                 # seconds, None disables expiry
+HTTP_CACHE_MAX_SIZE = 2 * 1024 * 1024 * 1024       # bytes, None disables eviction
+
+# parameters that do not change a response, e.g. API keys
+IGNORED_PARAMS = ['wskey', 'key']
+
+
+def encode_param(value):
+
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+def normalize_url(url, params=None):
+
+    """Build a canonical representation of a request URL and its parameters"""
+    scheme, netloc, path, query, fragment = urlparse.urlsplit(url)
+    pairs = urlparse.parse_qsl(query, keep_blank_values=True)
+    if params:
+        items = params.items() if isinstance(params, dict) else params
+        for key, value in items:
+            if isinstance(value, (list, tuple)):
+                pairs.extend((key, val) for val in value)
+            else:
+                pairs.append((key, value))
+    pairs = sorted((encode_param(key), encode_param(value)) for key, value in pairs
+                   if key not in IGNORED_PARAMS)
+    return urlparse.urlunsplit((scheme.lower(), netloc.lower(), path or '/',
+                                urllib.urlencode(pairs), ''))
+
+
+def build_key(url, params=None):
+
+    return hashlib.sha1(normalize_url(url, params)).hexdigest()
+
+
+class CachedResponse:
+
+    """Minimal stand-in for requests.Response served from the cache"""
+
+    def __init__(self, url, content, status_code=200):
+        self.url = url
+        self.content = content
+        self.status_code = status_code
+        self.from_cache = True
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', 'replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class HttpCache:
+
+    def __init__(self, cachedir=HTTP_CACHE_DIR, ttl=HTTP_CACHE_TTL, max_size=HTTP_CACHE_MAX_SIZE):
+        self.cachedir = cachedir
+        self.ttl = ttl
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        if not os.path.exists(cachedir):
+            os.makedirs(cachedir)
+        self.db = sqlite3.connect(os.path.join(cachedir, HTTP_CACHE_INDEX_FILE), check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS entries '
+                        '(key TEXT PRIMARY KEY, url TEXT, size INTEGER, stored REAL, accessed REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+        self.db.commit()
+        self.size = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+
+    def body_path(self, key):
+
+        return os.path.join(self.cachedir, key[:2], key)
+
+
+    def get(self, url, params=None):
+
+        key = build_key(url, params)
+        now = time.time()
+        with self.lock:
+            entry = self.db.execute('SELECT stored FROM entries WHERE key = ?', (key,)).fetchone()
+            if entry is None:
+                return None
+            if self.ttl is not None and now - entry[0] > self.ttl:
+                self.remove(key)
+                return None
+            try:
+                with open(self.body_path(key), 'rb') as body_file:
+                    content = body_file.read()
+            except IOError:
+                self.remove(key)
+                return None
+            self.db.execute('UPDATE entries SET accessed = ? WHERE key = ?', (now, key))
+            self.db.commit()
+        return CachedResponse(url, content)
+
+
+    def put(self, url, params, content):
+
+        key = build_key(url, params)
+        path = self.body_path(key)
+        now = time.time()
+        with self.lock:
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as body_file:
+                body_file.write(content)
+            os.rename(tmp_path, path)
+            entry = self.db.execute('SELECT size FROM entries WHERE key = ?', (key,)).fetchone()
+            if entry is not None:
+                self.size -= entry[0]
+            self.db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)',
+                            (key, normalize_url(url, params), len(content), now, now))
+            self.size += len(content)
+            self.evict()
+            self.db.commit()
+
+
+    def remove(self, key):
+
+        entry = self.db.execute('SELECT size FROM entries WHERE key = ?', (key,)).fetchone()
+        if entry is not None:
+            self.size -= entry[0]
+            self.db.execute('DELETE FROM entries WHERE key = ?', (key,))
+            self.db.commit()
+        if os.path.exists(self.body_path(key)):
+            os.unlink(self.body_path(key))
+
+
+    # drop least recently used entries until the cache fits its size cap
+    def evict(self):
+
+        if self.max_size is None:
+            return
+        while self.size > self.max_size:
+            entry = self.db.execute('SELECT key FROM entries ORDER BY accessed LIMIT 1').fetchone()
+            if entry is None:
+                break
+            self.remove(entry[0])
+
+
+    def purge_expired(self):
+
+        if self.ttl is None:
+            return 0
+        with self.lock:
+            expired = self.db.execute('SELECT key FROM entries WHERE stored < ?',
+                                      (time.time() - self.ttl,)).fetchall()
+            for (key,) in expired:
+                self.remove(key)
+        return len(expired)
+
+
+    def stats(self):
+
+        with self.lock:
+            count = self.db.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+        return {'entries': count, 'size': self.size, 'max_size': self.max_size, 'ttl': self.ttl}
+
+
+# Shared cache instance
+
+default_cache = None
+cache_lock = threading.Lock()
+cache_settings = {'cachedir': HTTP_CACHE_DIR, 'ttl': HTTP_CACHE_TTL, 'max_size': HTTP_CACHE_MAX_SIZE,
+                  'enabled': True}
+
+
+def configure(cachedir=None, ttl=None, max_size=None, enabled=None):
+
+    """Change settings of the shared cache, takes effect on next use"""
+    global default_cache
+    if cachedir is not None:
+        cache_settings['cachedir'] = cachedir
+    if ttl is not None:
+        cache_settings['ttl'] = ttl
+    if max_size is not None:
+        cache_settings['max_size'] = max_size
+    if enabled is not None:
+        cache_settings['enabled'] = enabled
+    with cache_lock:
+        default_cache = None
+
+
+def get_default_cache():
+
+    global default_cache
+    if not cache_settings['enabled']:
+        return None
+    if default_cache is None:
+        with cache_lock:
+            if default_cache is None:
+                default_cache = HttpCache(cache_settings['cachedir'], cache_settings['ttl'], cache_settings['max_size'])
+    return default_cache
+
+
+# Command line parsing
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+                    description="Inspect and purge the HTTP response cache.")
+    parser.add_argument('-c', '--cachedir', type=str, nargs='?',
+                    default=HTTP_CACHE_DIR,
+                    help="Cache directory")
+    parser.add_argument('-p', '--purge', action='store_true',
+                    help="Remove expired entries")
+
+    args = parser.parse_args()
+    cache = HttpCache(args.cachedir)
+    if args.purge:
+        print 'Removed', cache.purge_expired(), 'expired entries.'
+    print 'HTTP cache:', cache.stats()
@@ -0,0 +1,82 @@
+"""
+Shared HTTP client for all remote helpers.
+
+A single requests.Session is created on first use. Its adapters keep one
+connection pool per host alive between calls and gzip compressed responses
+are negotiated for every request, so repeated queries to wikidata.org,
+viaf.org or musicbrainz.org reuse open TCP/TLS connections. Requests are
+scheduled by rate_limiter within the limits of their host.
+"""
+
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import rate_limiter
+
+
+HTTP_POOL_CONNECTIONS = 20      # number of hosts with a pool kept open
+HTTP_POOL_MAXSIZE = 10          # connections kept alive per host
+HTTP_TIMEOUT = 60               # seconds
+
+DEFAULT_HEADERS = {
+    'Accept-Encoding': 'gzip, deflate'
+    , 'Connection': 'keep-alive'
+}
+
+
+session = None
+session_lock = threading.Lock()
+client_settings = {'pool_connections': HTTP_POOL_CONNECTIONS, 'pool_maxsize': HTTP_POOL_MAXSIZE,
+                   'timeout': HTTP_TIMEOUT}
+
+
+def configure(pool_connections=None, pool_maxsize=None, timeout=None):
+
+    """Change pool sizes and timeout, takes effect on next use"""
+    global session
+    if pool_connections is not None:
+        client_settings['pool_connections'] = pool_connections
+    if pool_maxsize is not None:
+        client_settings['pool_maxsize'] = pool_maxsize
+    if timeout is not None:
+        client_settings['timeout'] = timeout
+    with session_lock:
+        if session is not None:
+            session.close()
+        session = None
+
+
+def create_session():
+
+    new_session = requests.Session()
+    new_session.headers.update(DEFAULT_HEADERS)
+    adapter = HTTPAdapter(pool_connections=client_settings['pool_connections'],
+                          pool_maxsize=client_settings['pool_maxsize'])
+    new_session.mount('http://', adapter)
+    new_session.mount('https://', adapter)
+    return new_session
+
+
+def get_session():
+
+    global session
+    if session is None:
+        with session_lock:
+            if session is None:
+                session = create_session()
+    return session
+
+
+def get(url, params=None, **kwargs):
+
+    kwargs.setdefault('timeout', client_settings['timeout'])
+    return rate_limiter.get_default_scheduler().call(
+        url, lambda: get_session().get(url, params=params, **kwargs))
+
+
+# replacement for urllib.urlopen(url).read()
+def read(url):
+
+    return get(url).content
@@ -343,11 +343,12 @@ def extract_gnd_from_line(line):
 
 def get_wikidata_author_id_by_gnd(gnd, line):
 
+    # responses stored by earlier releases are read first, repeated lookups are
+    # served by the HTTP cache in common.process_http_query
     row = line.split(";")
-    wikidata_author_id_response_json = common.is_stored_as_json_file(WIKIDATA_AUTHOR_DIR + common.SLASH
-                                                                     + row[ONB_COL] + common.UNDERSCORE + gnd + '*')
+    wikidata_author_id_response_json = common.find_stored_response(
+        WIKIDATA_AUTHOR_DIR, row[ONB_COL] + common.UNDERSCORE + gnd, True)
     if(wikidata_author_id_response_json == None):
-        print 'onb_wikidata not exists for ONB:', row[ONB_COL]
         wikidata_author_id_response = retrieve_wikidata_author_id(gnd)
         wikidata_author_id_response_json = wikidata_author_id_response.json()
     wikidata_author_id = extract_wikidata_author_id(wikidata_author_id_response_json)
@@ -395,10 +396,9 @@ def store_author_data(writer, gnd, gnd_cache, line):
         wikidata_author_id = get_wikidata_author_id_by_gnd(gnd, line)
         if(wikidata_author_id and wikidata_author_id not in gnd_cache):
             gnd_cache.append(wikidata_author_id)
-            wikidata_author_data_response_json = common.is_stored_as_json_file(
-                WIKIDATA_AUTHOR_DATA_DIR + common.SLASH + str(wikidata_author_id) + '*')
+            wikidata_author_data_response_json = common.find_stored_response(
+                WIKIDATA_AUTHOR_DATA_DIR, str(wikidata_author_id))
             if(wikidata_author_data_response_json == None):
-                print 'wikidata not exists for wikidata author ID:', wikidata_author_id
                 author_data_response = retrieve_wikidata_author_data(wikidata_author_id)
                 wikidata_author_data_response_json = json.loads(author_data_response.content)
             store_wikidata_author_data(wikidata_author_id, wikidata_author_data_response_json)
@@ -26,6 +26,7 @@ VIAF_MUSICBRAINZ_COMPOSITION_MAPPING_FILE = 'data/musicbrainz_viaf_composition_m
 # e.g. http://musicbrainz.org/ws/2/work/?query=Des Antonius von Padua Fischpredigt Voix, orchestre&fmt=json
 def retrieve_musicbrainz_compositions_by_title(composition_title, viaf_id):
 
+    work_response = None
     try:
         query_work = MUSICBRAINZ_API_URL + 'work/?query=' + composition_title + '&fmt=json'
         print 'query work:', query_work
@@ -52,6 +53,7 @@ def retrieve_musicbrainz_compositions_by_title(composition_title, viaf_id):
 # for Mahler, Gustav
 def retrieve_musicbrainz_works_and_recordings_by_id(id, author, output_works, output_recordings):
 
+    work_response = None
     try:
         query_work = MUSICBRAINZ_API_URL + 'artist/' + id + '?inc=aliases%20works%20recordings&fmt=json'
 #        query_work = MUSICBRAINZ_API_URL + 'artist/' + id + '?inc=aliases%20works%20recordings&client=apikey&fmt=json'
@@ -76,6 +78,7 @@ def retrieve_musicbrainz_works_and_recordings_by_id(id, author, output_works, ou
 # for Mahler, Gustav
 def calculate_musicbrainz_works_and_recordings_by_id(id, author, output_file):
 
+    work_response = None
     try:
 #        query_work = MUSICBRAINZ_API_URL + 'artist/' + id + '?inc=aliases%20works%20recordings&fmt=json'
         query_work = MUSICBRAINZ_API_URL + 'work?artist=' + id + '&inc=aliases&fmt=json'
@@ -201,8 +204,8 @@ def calculate_musicbrainz_works_and_recordings_count(inputfile, output_compositi
                     break
             if isStored == False and mapping_musicbrainz_id:
                 calculate_musicbrainz_works_and_recordings_by_id(mapping_musicbrainz_id.split(' ')[0], author_name, output_compositions)
-        except:
-            print ''
+        except Exception as e:
+            print 'Could not calculate Musicbrainz compositions count for row:', row, e
 
 
 def retrieve_musicbrainz_works_and_recordings(inputfile, output_works, output_recordings):
@@ -223,8 +226,8 @@ def retrieve_musicbrainz_works_and_recordings(inputfile, output_works, output_re
             author_name = row[common.AUTHOR_NAME_COL]
             print 'author name:', author_name, 'musicbrainz id:', musicbrainz_id
             retrieve_musicbrainz_works_and_recordings_by_id(musicbrainz_id, author_name, output_works, output_recordings)
-        except:
-            print ''
+        except Exception as e:
+            print 'Could not retrieve Musicbrainz works and recordings for row:', row, e
 
 
 
@@ -9,8 +9,6 @@ $ python neo4j_manager.py
 import common
 import argparse
 import csv
-from neo4jrestclient import client
-from neo4jrestclient.client import GraphDatabase
 # directory structure
 from os import walk
 
@@ -112,6 +110,7 @@ class Neo4jManager:
 
         q = 'MATCH (a:Author)-[r:has_composition]->(m:Composition) WHERE a.name="' \
             + author + '" RETURN a, type(r), m'
+        from neo4jrestclient import client
         results = self.gdb.query(q, returns=(client.Node, str, client.Node))
         if results:
             for r in results:
@@ -124,6 +123,7 @@ class Neo4jManager:
 
         q = "MATCH (a:`" + JSON_WIKIDATA_AUTHOR_DATA_LABEL + "`) WHERE a.name='" \
             + query + "' RETURN a"
+        from neo4jrestclient import client
         results = self.gdb.query(q, returns=(client.Node, str, client.Node))
         if results:
             for r in results:
@@ -145,10 +145,10 @@ class Neo4jManager:
 
         author_node = self.create_author(author_label, row_author)
         #reader = csv.DictReader(open(filename_compositions), delimiter=';', fieldnames=common.viaf_compositions_fieldnames, lineterminator='\n')
+        # compositions are already those of the author, see find_author_compositions
         for row_composition in compositions:
-            if row_composition[common.COMPOSITION_AUTHOR_ID_HEADER] == row_author[common.AUTHOR_VIAF_ID_HEADER]:
-                composition_node = self.create_composition(composition_label, row_composition[common.COMPOSITION_TITLE_HEADER])
-                self.create_relationship(author_node, composition_node, common.RELATION_AUTHOR_TO_COMPOSITION)
+            composition_node = self.create_composition(composition_label, row_composition[common.COMPOSITION_TITLE_HEADER])
+            self.create_relationship(author_node, composition_node, common.RELATION_AUTHOR_TO_COMPOSITION)
         composition_name = self.query_composition_by_author_name(author_node[NAME])
 #        print 'found composition', composition_name, 'for author', author_node[NAME]
 
@@ -167,6 +167,29 @@ def load_compositions_from_csv(filename_compositions):
     return compositions
 
 
+def index_compositions_by_author(compositions):
+
+    """Multimap of VIAF author ids to their compositions in file order"""
+    composition_index = {}
+    for composition in compositions:
+        composition_index.setdefault(composition[common.COMPOSITION_AUTHOR_ID_HEADER], []).append(composition)
+    return composition_index
+
+
+def load_composition_index_from_csv(filename_compositions):
+
+    return index_compositions_by_author(load_compositions_from_csv(filename_compositions))
+
+
+def find_author_compositions(composition_index, row_author):
+
+    """Compositions of all VIAF ids of an author row, several ids are separated by blanks"""
+    compositions = []
+    for viaf_id in (row_author[common.AUTHOR_VIAF_ID_HEADER] or '').split():
+        compositions.extend(composition_index.get(viaf_id, []))
+    return compositions
+
+
 def save_mapped_authors_from_csv(filename_authors, filename_compositions):
 
     neo_db = Neo4jManager()
@@ -174,14 +197,14 @@ def save_mapped_authors_from_csv(filename_authors, filename_compositions):
     author_label = neo_db.create_label(AUTHOR_LABEL)
     composition_label = neo_db.create_label(COMPOSITION_LABEL)
 
-    compositions = load_compositions_from_csv(filename_compositions)
+    composition_index = load_composition_index_from_csv(filename_compositions)
 
     reader = csv.DictReader(open(filename_authors), delimiter=';', fieldnames=common.wikidata_author_fieldnames, lineterminator='\n')
     firstTime = True
     for row in reader:
         if not firstTime:
             print 'row', row
-            filtered_compositions = [composition for composition in compositions if composition[common.COMPOSITION_AUTHOR_ID_HEADER] == row[common.AUTHOR_VIAF_ID_HEADER]]
+            filtered_compositions = find_author_compositions(composition_index, row)
             print 'len compositions', len(filtered_compositions)
             neo_db.save_author_with_compositions(row, filtered_compositions, author_label, composition_label)
         else:
@@ -190,14 +213,14 @@ def save_mapped_authors_from_csv(filename_authors, filename_compositions):
 
 def save_mapping_viaf_authors_to_composition_count_in_csv(filename_authors, filename_compositions, outputfile):
 
-    compositions = load_compositions_from_csv(filename_compositions)
+    composition_index = load_composition_index_from_csv(filename_compositions)
 
     reader = csv.DictReader(open(filename_authors), delimiter=';', fieldnames=common.wikidata_author_fieldnames, lineterminator='\n')
     firstTime = True
     for row in reader:
         if not firstTime:
             print 'row', row
-            filtered_compositions = [composition for composition in compositions if composition[common.COMPOSITION_AUTHOR_ID_HEADER] == row[common.AUTHOR_VIAF_ID_HEADER]]
+            filtered_compositions = find_author_compositions(composition_index, row)
             author = row[common.AUTHOR_NAME_HEADER]
             length = len(filtered_compositions)
             print 'author:', author, 'len compositions', length
@@ -245,6 +268,8 @@ def search_in_json_neo4j(query):
 
 def initialize():
 
+    # the client library and the API key are only needed once a database is used
+    from neo4jrestclient.client import GraphDatabase
     api_key = open(NEO4J_API_KEY_FILE_NAME).read()
     gdb = GraphDatabase(NEO4J_DATABASE_URL, username=USER_NAME, password=api_key)
     return gdb
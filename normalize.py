@@ -4,31 +4,78 @@ Script for extracting relevant data points from raw data.
 
 Invocation:
 $ python normalize.py data/raw/*.xml -o data/normalized
+$ python normalize.py -s data/dumps/onb_export.xml.gz -o data/normalized
+$ python normalize.py -i data/raw/*.xml -o data/normalized
 """
 
 import argparse
+import csv
+import gzip
+import hashlib
+import json
+import multiprocessing
 import sys
 import os
 
+import xml.etree.cElementTree as ET
+
 from bs4 import BeautifulSoup
 
-from common import write_json_file, progress, read_records
+from common import write_json_file, progress, read_records, read_file_data
+
+import record_store
 
 GND_PREFIX = "http://d-nb.info/gnd"
+RECORD_TAG = "record"
+DUMP_CHUNK_SIZE = 64 * 1024
+STREAM_PROGRESS_INTERVAL = 1000
+NORMALIZE_CHUNK_SIZE = 100
+NORMALIZE_ERRORS_FILE = "normalize_errors.csv"
+# increase whenever the extraction changes, so that all records are normalized again
+NORMALIZER_VERSION = 2
+MANIFEST_EXT = ".manifest.json"
+CHANGED_IDS_EXT = ".changed.txt"
+REMOVED_IDS_EXT = ".removed.txt"
+
+
+# Varfield index
+
+class VarfieldIndex:
+
+    """Varfields of a record grouped by id, built in a single pass over the record"""
+
+    def __init__(self, soup):
+        self.soup = soup
+        self.by_id = {}
+        self.numeric = []
+        for tag in soup.find_all("varfield"):
+            tag_id = tag.get('id')
+            self.by_id.setdefault(tag_id, []).append(tag)
+            if tag_id and tag_id.isnumeric():
+                self.numeric.append((int(tag_id), tag))
+
+    def find(self, tag_id):
+        tags = self.by_id.get(tag_id)
+        if not tags:
+            return None
+        return tags[0]
+
+    def find_all(self, tag_id):
+        return self.by_id.get(tag_id, [])
+
+    def in_range(self, start, end):
+        return [tag for tag_id, tag in self.numeric if tag_id >= start and tag_id < end]
 
 
 # Metadata extraction functions
 
-def find_tags_in_id_range(soup, start, end):
-    tags = [tag for tag in soup.find_all("varfield")
-            if tag['id'] and tag['id'].isnumeric() and
-            int(tag['id']) >= start and int(tag['id']) < end]
-    return tags
+def find_tags_in_id_range(fields, start, end):
+    return fields.in_range(start, end)
 
 
-def persons(soup):
+def persons(fields):
     persons = []
-    tags = find_tags_in_id_range(soup, 100, 200)
+    tags = find_tags_in_id_range(fields, 100, 200)
     for tag in tags:
         person = {}
         # name
@@ -64,9 +111,9 @@ def persons(soup):
     return persons
 
 
-def content(soup):
+def content(fields):
     contents = []
-    for tag in soup.find_all("varfield", id="655"):
+    for tag in fields.find_all("655"):
         uri = tag.find("subfield", label="u")
         note = tag.find("subfield", label="z")
         if note:
@@ -80,8 +127,8 @@ def content(soup):
     return contents
 
 
-def title(soup):
-    tag = soup.find("varfield", id="303")
+def title(fields):
+    tag = fields.find("303")
     if not tag:
         return None
     else:
@@ -92,9 +139,9 @@ def title(soup):
             return title.string
 
 
-def subtitles(soup):
+def subtitles(fields):
     subtitles = []
-    tags = find_tags_in_id_range(soup, 304, 400)
+    tags = find_tags_in_id_range(fields, 304, 400)
     for tag in tags:
         subfields = tag.find_all("subfield")
         for subfield in subfields:
@@ -103,16 +150,16 @@ def subtitles(soup):
     return subtitles
 
 
-def dates(soup):
+def dates(fields):
     dates = []
-    date_tags = soup.find_all("varfield", id="425")
+    date_tags = fields.find_all("425")
     for tag in date_tags:
         dates.append(tag.subfield.string)
     return dates
 
 
-def gnd_link(soup):
-    tag = soup.find("varfield", id="303")
+def gnd_link(fields):
+    tag = fields.find("303")
     if not tag:
         return None
     else:
@@ -123,9 +170,9 @@ def gnd_link(soup):
             return GND_PREFIX + "/" + gnd_link.string[8:]
 
 
-def notes(soup):
+def notes(fields):
     notes = []
-    tags = find_tags_in_id_range(soup, 400, 600)
+    tags = find_tags_in_id_range(fields, 400, 600)
     for tag in tags:
         if tag.id != "425":
             for subfield in tag.find_all("subfield", label="a"):
@@ -133,9 +180,9 @@ def notes(soup):
     return notes
 
 
-def terms(soup):
+def terms(fields):
     terms = []
-    tags = find_tags_in_id_range(soup, 900, 1000)
+    tags = find_tags_in_id_range(fields, 900, 1000)
     for tag in tags:
         term = {}
         labels = []
@@ -152,53 +199,65 @@ def terms(soup):
     return terms
 
 
-def doc_id(soup):
-    return soup.doc_number.string
+def doc_id(fields):
+    return fields.soup.doc_number.string
+
 
+def aleph_id(fields):
+    return fields.find("001").find("subfield", label="a").string
 
-def aleph_id(soup):
-    return soup.find("varfield", id="001").find("subfield", label="a").string
+
+# optional fields in the order they are extracted
+optional_fields = [
+    ('title', title)
+    , ('subtitles', subtitles)
+    , ('persons', persons)
+    , ('content', content)
+    , ('dates', dates)
+    , ('notes', notes)
+    , ('terms', terms)
+]
 
 
 # Main normalization routine
 
 def normalize(raw_record):
     soup = BeautifulSoup(raw_record, "html.parser")
+    fields = VarfieldIndex(soup)
     normalized_record = {}
 
     # mandatory fields
-    normalized_record['aleph_id'] = aleph_id(soup)
-    normalized_record['doc_id'] = doc_id(soup)
-
-    # optional fields
-    if title(soup):
-        normalized_record['title'] = title(soup)
-    if subtitles(soup):
-        normalized_record['subtitles'] = subtitles(soup)
-    if persons(soup):
-        normalized_record['persons'] = persons(soup)
-    if content(soup):
-        normalized_record['content'] = content(soup)
-    if dates(soup):
-        normalized_record['dates'] = dates(soup)
-    if notes(soup):
-        #normalized_notes = notes(soup)
-        #print 'normalized_notes: ', normalized_notes
-        #new_notes = [unicode(elem).encode('utf-8') for elem in normalized_notes]
-        #normalized_record['notes'] = new_notes
-        #print 'new_notes: ', new_notes
-#        normalized_record['notes'] = notes(soup)
-        normalized_record['notes'] = notes(soup)
-    if terms(soup):
-        normalized_record['terms'] = terms(soup)
-    if gnd_link(soup):
-        normalized_record['sameas'] = [gnd_link(soup)]
+    normalized_record['aleph_id'] = aleph_id(fields)
+    normalized_record['doc_id'] = doc_id(fields)
+
+    # optional fields, every extractor runs once
+    for key, extractor in optional_fields:
+        value = extractor(fields)
+        if value:
+            normalized_record[key] = value
+    link = gnd_link(fields)
+    if link:
+        normalized_record['sameas'] = [link]
 
     return normalized_record
 
 
-def normalize_records(inputfiles, outputdir):
+def store_normalized_record(store, outputdir, out_file, normalized_record):
+    if store is not None:
+        store.put(normalized_record['aleph_id'], normalized_record)
+    else:
+        write_json_file(outputdir, out_file, normalized_record)
+
+
+def normalize_records(inputfiles, outputdir, packed=False, workers=1):
+    """Normalize record files, returns the aleph_id of every normalized file"""
+    if workers > 1:
+        return normalize_records_parallel(inputfiles, outputdir, workers, packed)
     print("Normalizing", len(inputfiles), "records to", outputdir)
+    store = None
+    normalized_ids = {}
+    if packed:
+        store = record_store.RecordStore(outputdir)
     for index, (filename, record) in enumerate(read_records(inputfiles)):
         progress((index+1)/len(inputfiles))
         normalized_record = normalize(record)
@@ -207,8 +266,300 @@ def normalize_records(inputfiles, outputdir):
         #print 'new normalized record: ', new_normalized_record
 
         out_file = os.path.basename(filename).replace("xml", "json")
-        write_json_file(outputdir, out_file, normalized_record)
+        store_normalized_record(store, outputdir, out_file, normalized_record)
+        normalized_ids[filename] = normalized_record['aleph_id']
 #        write_json_file(outputdir, out_file, new_normalized_record)
+    if store is not None:
+        store.close()
+    return normalized_ids
+
+
+# Parallel normalization
+
+def plain_data(data):
+    """Replace parse tree strings by plain unicode, so records can be pickled"""
+    if isinstance(data, dict):
+        return dict((key, plain_data(value)) for key, value in data.items())
+    if isinstance(data, list):
+        return [plain_data(value) for value in data]
+    if isinstance(data, unicode):
+        return unicode(data)
+    return data
+
+
+def normalize_chunk(filenames):
+    """Normalize a chunk of raw files in a worker process"""
+    results = []
+    errors = []
+    for filename in filenames:
+        # unreadable files are reported like records that fail to normalize
+        try:
+            record = read_file_data(filename).decode('utf-8')
+            results.append((filename, plain_data(normalize(record))))
+        except Exception as e:
+            errors.append((filename, repr(e)))
+    return results, errors
+
+
+def normalize_records_parallel(inputfiles, outputdir, workers, packed=False, chunk_size=NORMALIZE_CHUNK_SIZE):
+    print("Normalizing", len(inputfiles), "records to", outputdir, "with", workers, "workers")
+    chunks = [inputfiles[start:start + chunk_size] for start in range(0, len(inputfiles), chunk_size)]
+    store = None
+    if packed:
+        store = record_store.RecordStore(outputdir)
+    error_report = []
+    normalized_ids = {}
+    done = 0
+    pool = multiprocessing.Pool(workers)
+    try:
+        # imap hands out results in chunk order, so output order is deterministic
+        for index, (results, errors) in enumerate(pool.imap(normalize_chunk, chunks)):
+            for filename, normalized_record in results:
+                out_file = os.path.basename(filename).replace("xml", "json")
+                store_normalized_record(store, outputdir, out_file, normalized_record)
+                normalized_ids[filename] = normalized_record['aleph_id']
+            for filename, error in errors:
+                print 'Normalization error in chunk', index, 'file', filename, error
+                error_report.append([index, filename, error])
+            done += len(chunks[index])
+            progress(float(done) / len(inputfiles))
+    finally:
+        pool.close()
+        pool.join()
+        if store is not None:
+            store.close()
+    reportfile = os.path.join(os.path.dirname(os.path.normpath(outputdir)) or '.', NORMALIZE_ERRORS_FILE)
+    if error_report:
+        with open(reportfile, 'wb') as csvfile:
+            writer = csv.writer(csvfile, delimiter=';', lineterminator='\n')
+            writer.writerow(['chunk', 'file', 'error'])
+            writer.writerows(error_report)
+        print len(error_report), 'records failed, see', reportfile
+    elif os.path.exists(reportfile):
+        # a report of an earlier run does not describe this one
+        os.remove(reportfile)
+    return normalized_ids
+
+
+# Incremental normalization
+
+def manifest_path(outputdir):
+    return os.path.normpath(outputdir) + MANIFEST_EXT
+
+
+def changed_ids_path(outputdir):
+    return os.path.normpath(outputdir) + CHANGED_IDS_EXT
+
+
+def removed_ids_path(outputdir):
+    return os.path.normpath(outputdir) + REMOVED_IDS_EXT
+
+
+def write_record_ids(path, record_ids):
+    with open(path, 'wb') as ids_file:
+        ids_file.write(''.join(record_id.encode('utf-8') + '\n' for record_id in record_ids))
+
+
+def content_hash(inputfile):
+    return hashlib.sha1(read_file_data(inputfile)).hexdigest()
+
+
+def load_manifest(outputdir):
+    """Manifest entries of the last run, entries of another normalizer version never match"""
+    path = manifest_path(outputdir)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'rb') as manifest_file:
+        manifest = json.load(manifest_file)
+    if manifest.get('version') != NORMALIZER_VERSION:
+        print 'Normalizer version changed, normalizing all records'
+        for entry in manifest['files'].values():
+            entry['hash'] = None
+    return manifest['files']
+
+
+def save_manifest(outputdir, entries):
+    with open(manifest_path(outputdir), 'wb') as manifest_file:
+        json.dump({'version': NORMALIZER_VERSION, 'files': entries}, manifest_file, sort_keys=True, indent=4)
+
+
+def has_output(store, outputdir, entry):
+    if store is not None:
+        return entry['id'] in store
+    return os.path.exists(os.path.join(outputdir, entry['output']))
+
+
+def remove_normalized_record(store, outputdir, entry):
+    if store is not None:
+        store.delete(entry['id'])
+        return
+    out_path = os.path.join(outputdir, entry['output'])
+    if os.path.exists(out_path):
+        os.remove(out_path)
+
+
+def normalize_incremental(inputfiles, outputdir, packed=False, workers=1):
+    """Normalize new and changed files only, listing their ids in the changed ids file
+
+    Ids whose records disappeared, because their source was removed or now
+    yields another aleph_id, are removed from the output and listed in the
+    removed ids file, so that later stages drop them as well.
+    """
+    manifest = load_manifest(outputdir)
+    store = None
+    if packed:
+        store = record_store.RecordStore(outputdir)
+    entries = {}
+    changed_files = []
+    hashes = {}
+    names = set()
+    for inputfile in inputfiles:
+        name = os.path.basename(inputfile)
+        names.add(name)
+        hashes[inputfile] = content_hash(inputfile)
+        entry = manifest.get(name)
+        # outputs removed by a cleanup are normalized again
+        if entry and entry['hash'] == hashes[inputfile] and has_output(store, outputdir, entry):
+            entries[name] = entry
+        else:
+            changed_files.append(inputfile)
+    removed = [entry for name, entry in manifest.items() if name not in names]
+    print 'Unchanged:', len(entries), 'changed:', len(changed_files), 'removed:', len(removed)
+
+    if store is not None:
+        store.close()
+
+    normalized_ids = {}
+    if changed_files:
+        normalized_ids = normalize_records(changed_files, outputdir, packed, workers)
+    # failed files stay out of the manifest, so they are retried with the next run
+    for inputfile, record_id in normalized_ids.items():
+        name = os.path.basename(inputfile)
+        if name in manifest and manifest[name]['id'] != record_id:
+            # the file now yields another record, the earlier one is gone
+            removed.append(manifest[name])
+        entries[name] = {
+            'hash': hashes[inputfile]
+            , 'id': record_id
+            , 'output': name.replace("xml", "json")
+        }
+
+    # outputs that were written again by this run, e.g. for a renamed source, are kept
+    current_ids = set(entry['id'] for entry in entries.values())
+    if packed:
+        removed = [entry for entry in removed if entry['id'] not in current_ids]
+    else:
+        current_outputs = set(entry['output'] for entry in entries.values())
+        removed = [entry for entry in removed if entry['output'] not in current_outputs]
+    if removed:
+        store = None
+        if packed:
+            store = record_store.RecordStore(outputdir)
+        for entry in removed:
+            print 'Removing', entry['id'], 'whose source disappeared'
+            remove_normalized_record(store, outputdir, entry)
+        if store is not None:
+            store.close()
+
+    save_manifest(outputdir, entries)
+    changed_ids = sorted(set(normalized_ids.values()))
+    write_record_ids(changed_ids_path(outputdir), changed_ids)
+    write_record_ids(removed_ids_path(outputdir),
+                     sorted(set(entry['id'] for entry in removed if entry['id'] not in current_ids)))
+    return changed_ids
+
+
+# Streaming ingestion of multi-record dumps
+
+def local_name(tag):
+    return tag.split('}')[-1]
+
+
+def open_dump(dumpfile):
+    if dumpfile.endswith('.gz'):
+        return gzip.open(dumpfile, 'rb')
+    return open(dumpfile, 'rb')
+
+
+class RecordTarget:
+    """Parser target that builds the <record> elements of a dump and nothing else.
+
+    Elements around the records are not built at all, so no wrapper element
+    collects the handed out records, however deep they are nested.
+    """
+
+    def __init__(self):
+        self.builder = None
+        self.depth = 0
+        self.records = []
+
+    def start(self, tag, attrib):
+        if self.builder is None:
+            if local_name(tag) != RECORD_TAG:
+                return
+            self.builder = ET.TreeBuilder()
+        self.depth += 1
+        # drop namespaces, the extractors match plain tag names
+        self.builder.start(local_name(tag), attrib)
+
+    def end(self, tag):
+        if self.builder is None:
+            return
+        self.builder.end(local_name(tag))
+        self.depth -= 1
+        if self.depth == 0:
+            self.records.append(self.builder.close())
+            self.builder = None
+
+    def data(self, data):
+        if self.builder is not None:
+            self.builder.data(data)
+
+    def close(self):
+        pass
+
+
+def iter_aleph_records(dumpfile):
+    """Stream the <record> elements of a multi-record Aleph dump as XML strings.
+
+    Every record element is serialized, handed out and freed again, so
+    memory use does not depend on the size of the dump.
+    """
+    target = RecordTarget()
+    parser = ET.XMLParser(target=target)
+    with open_dump(dumpfile) as dump:
+        while True:
+            chunk = dump.read(DUMP_CHUNK_SIZE)
+            if chunk:
+                parser.feed(chunk)
+            else:
+                parser.close()
+            for elem in target.records:
+                yield ET.tostring(elem, encoding='utf-8').decode('utf-8')
+            target.records = []
+            if not chunk:
+                break
+
+
+def normalize_dumps(dumpfiles, outputdir, packed=False):
+    print("Streaming", len(dumpfiles), "dumps to", outputdir)
+    store = None
+    if packed:
+        store = record_store.RecordStore(outputdir)
+    count = 0
+    for dumpfile in dumpfiles:
+        for record in iter_aleph_records(dumpfile):
+            normalized_record = normalize(record)
+            if store is not None:
+                store.put(normalized_record['aleph_id'], normalized_record)
+            else:
+                write_json_file(outputdir, normalized_record['aleph_id'] + ".json", normalized_record)
+            count += 1
+            if count % STREAM_PROGRESS_INTERVAL == 0:
+                print 'Normalized', count, 'records of', dumpfile
+    if store is not None:
+        store.close()
+    print 'Normalized', count, 'records.'
 
 
 # Command line parsing
@@ -222,10 +573,24 @@ if __name__ == '__main__':
     parser.add_argument('-o', '--outputdir', type=str, nargs='?',
                     default="data/normalized",
                     help="Output directory")
+    parser.add_argument('-p', '--packed', action='store_true',
+                    help="Write records to a packed record store instead of one file per record")
+    parser.add_argument('-s', '--stream', action='store_true',
+                    help="Input files are multi-record dumps, stream them record by record")
+    parser.add_argument('-w', '--workers', type=int, nargs='?',
+                    default=1,
+                    help="Number of worker processes")
+    parser.add_argument('-i', '--incremental', action='store_true',
+                    help="Normalize new and changed files only, tracked in a manifest next to the output directory")
 
     if len(sys.argv) < 2:
         parser.print_help()
         sys.exit(1)
 
     args = parser.parse_args()
-    normalize_records(args.inputfiles, args.outputdir)
+    if args.stream:
+        normalize_dumps(args.inputfiles, args.outputdir, args.packed)
+    elif args.incremental:
+        normalize_incremental(args.inputfiles, args.outputdir, args.packed, args.workers)
+    else:
+        normalize_records(args.inputfiles, args.outputdir, args.packed, args.workers)
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+##
+##    In this module we test the normalization of raw Aleph records for scoregraph project.
+##
+
+import unittest
+import csv
+import os
+import shutil
+import tempfile
+import normalize
+import record_store
+
+from bs4 import BeautifulSoup
+
+TEST_RECORD = u'''<?xml version="1.0" encoding="UTF-8"?>
+<present>
+<record>
+<record_header>
+<set_entry>000000001</set_entry>
+</record_header>
+<doc_number>000119186</doc_number>
+<metadata>
+<oai_marc>
+<fixfield id="LDR">-----nam--2200000---4500</fixfield>
+<varfield id="001" i1=" " i2=" ">
+<subfield label="a">AL00119186</subfield>
+</varfield>
+<varfield id="100" i1="-" i2="1">
+<subfield label="p">Mahler, Gustav</subfield>
+<subfield label="d">1860-1911</subfield>
+<subfield label="b">[Komponist]</subfield>
+<subfield label="9">(DE-588)118576291</subfield>
+</varfield>
+<varfield id="200" i1="-" i2="1">
+<subfield label="a">Universal-Edition</subfield>
+</varfield>
+<varfield id="303" i1="-" i2="1">
+<subfield label="t">Lieder eines fahrenden Gesellen</subfield>
+<subfield label="9">(DE-588)300040431</subfield>
+</varfield>
+<varfield id="331" i1="-" i2="1">
+<subfield label="a">Lieder eines fahrenden Gesellen</subfield>
+</varfield>
+<varfield id="335" i1="-" i2="1">
+<subfield label="a">für eine tiefere Stimme mit Orchester [Partitur]</subfield>
+</varfield>
+<varfield id="425" i1="a" i2="1">
+<subfield label="a">1897</subfield>
+</varfield>
+<varfield id="433" i1="-" i2="1">
+<subfield label="a">51 S.</subfield>
+</varfield>
+<varfield id="501" i1="-" i2="1">
+<subfield label="a">Text vom Komponisten</subfield>
+</varfield>
+<varfield id="655" i1="e" i2="1">
+<subfield label="u">http://data.onb.ac.at/rec/AL00119186</subfield>
+<subfield label="z">Digitalisat</subfield>
+</varfield>
+<varfield id="902" i1="-" i2="1">
+<subfield label="s">Gesang</subfield>
+<subfield label="9">(DE-588)4020136-1</subfield>
+</varfield>
+<varfield id="907" i1="-" i2="1">
+<subfield label="f">Partitur</subfield>
+</varfield>
+</oai_marc>
+</metadata>
+</record>
+</present>
+'''
+
+# output of the normalizer before the varfield index was introduced
+EXPECTED_RECORD = {
+    'aleph_id': u'AL00119186',
+    'doc_id': u'000119186',
+    'title': u'Lieder eines fahrenden Gesellen',
+    'subtitles': [u'Lieder eines fahrenden Gesellen', u'für eine tiefere Stimme mit Orchester Partitur'],
+    'content': [{'uri': u'http://data.onb.ac.at/rec/AL00119186', 'note': u'Digitalisat'}],
+    'dates': [u'1897'],
+    'notes': [u'1897', u'51 S.', u'Text vom Komponisten'],
+    'terms': [{'labels': [u'Gesang'], 'sameas': [u'http://d-nb.info/gnd/4020136-1']},
+              {'labels': [u'Partitur']}],
+    'sameas': [u'http://d-nb.info/gnd/300040431']
+}
+
+
+class TestNormalize(unittest.TestCase):
+
+    def test_normalize_record(self):
+        self.assertEqual(normalize.normalize(TEST_RECORD), EXPECTED_RECORD)
+
+    def test_varfield_index_keeps_document_order_in_ranges(self):
+        fields = normalize.VarfieldIndex(BeautifulSoup(TEST_RECORD, "html.parser"))
+        self.assertEqual([tag['id'] for tag in fields.in_range(400, 600)], ['425', '433', '501'])
+        self.assertEqual(fields.find('303').find('subfield', label='t').string, u'Lieder eines fahrenden Gesellen')
+        self.assertEqual(fields.find('999'), None)
+
+    def test_stream_multi_record_dump(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            record = TEST_RECORD[TEST_RECORD.index('<record>'):TEST_RECORD.index('</present>')]
+            dump = u'<present>' + record + record.replace(u'AL00119186', u'AL00119187') + u'</present>'
+            dumpfile = os.path.join(tmpdir, 'dump.xml')
+            with open(dumpfile, 'wb') as out_file:
+                out_file.write(dump.encode('utf-8'))
+            records = [normalize.normalize(raw) for raw in normalize.iter_aleph_records(dumpfile)]
+            self.assertEqual(records[0], EXPECTED_RECORD)
+            self.assertEqual([data['aleph_id'] for data in records], [u'AL00119186', u'AL00119187'])
+
+            # records below a wrapper element are found as well
+            with open(dumpfile, 'wb') as out_file:
+                out_file.write(dump.replace(u'<present>', u'<present><set>').replace(u'</present>', u'</set></present>').encode('utf-8'))
+            self.assertEqual([normalize.normalize(raw) for raw in normalize.iter_aleph_records(dumpfile)], records)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_parallel_normalization_matches_sequential_output(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            inputfiles = []
+            for number in range(5):
+                filename = os.path.join(tmpdir, 'AL0011918%d.xml' % number)
+                with open(filename, 'wb') as raw_file:
+                    raw_file.write(TEST_RECORD.replace(u'AL00119186', u'AL0011918%d' % number).encode('utf-8'))
+                inputfiles.append(filename)
+            normalize.normalize_records(inputfiles, os.path.join(tmpdir, 'sequential'))
+            normalize.normalize_records_parallel(inputfiles, os.path.join(tmpdir, 'parallel'), 2, chunk_size=2)
+            for number in range(5):
+                out_file = 'AL0011918%d.json' % number
+                with open(os.path.join(tmpdir, 'sequential', out_file), 'rb') as sequential:
+                    with open(os.path.join(tmpdir, 'parallel', out_file), 'rb') as parallel:
+                        self.assertEqual(sequential.read(), parallel.read())
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_parallel_error_report_is_quoted_and_removed_after_a_clean_run(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            goodfile = os.path.join(tmpdir, 'AL00119186.xml')
+            with open(goodfile, 'wb') as raw_file:
+                raw_file.write(TEST_RECORD.encode('utf-8'))
+            badfile = os.path.join(tmpdir, 'broken;record.xml')
+            with open(badfile, 'wb') as raw_file:
+                raw_file.write('<present><record>no;fields</record></present>')
+            outputdir = os.path.join(tmpdir, 'normalized')
+            reportfile = os.path.join(tmpdir, normalize.NORMALIZE_ERRORS_FILE)
+            missingfile = os.path.join(tmpdir, 'missing.xml')
+            normalize.normalize_records_parallel([goodfile, badfile, missingfile], outputdir, 2, chunk_size=1)
+            with open(reportfile, 'rb') as csvfile:
+                rows = list(csv.reader(csvfile, delimiter=';'))
+            self.assertEqual(rows[0], ['chunk', 'file', 'error'])
+            self.assertEqual([row[:2] for row in rows[1:]], [['1', badfile], ['2', missingfile]])
+            normalize.normalize_records_parallel([goodfile], outputdir, 2)
+            self.assertFalse(os.path.exists(reportfile))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_incremental_normalization_tracks_changed_and_removed_files(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            rawdir = os.path.join(tmpdir, 'raw')
+            outputdir = os.path.join(tmpdir, 'normalized')
+            os.makedirs(rawdir)
+            for number in range(3):
+                with open(os.path.join(rawdir, 'AL0011918%d.xml' % number), 'wb') as raw_file:
+                    raw_file.write(TEST_RECORD.replace(u'AL00119186', u'AL0011918%d' % number).encode('utf-8'))
+            inputfiles = sorted(os.path.join(rawdir, name) for name in os.listdir(rawdir))
+            self.assertEqual(len(normalize.normalize_incremental(inputfiles, outputdir)), 3)
+            self.assertEqual(normalize.normalize_incremental(inputfiles, outputdir), [])
+
+            with open(inputfiles[1], 'wb') as raw_file:
+                raw_file.write(TEST_RECORD.replace(u'AL00119186', u'AL00119181').replace(u'1897', u'1898').encode('utf-8'))
+            os.remove(inputfiles[2])
+            changed_ids = normalize.normalize_incremental(inputfiles[:2], outputdir)
+            self.assertEqual(changed_ids, [u'AL00119181'])
+            self.assertEqual(sorted(os.listdir(outputdir)), ['AL00119180.json', 'AL00119181.json'])
+            with open(normalize.changed_ids_path(outputdir), 'rb') as changed_file:
+                self.assertEqual(changed_file.read(), 'AL00119181\n')
+            with open(normalize.removed_ids_path(outputdir), 'rb') as removed_file:
+                self.assertEqual(removed_file.read(), 'AL00119182\n')
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_packed_incremental_normalization_keeps_renamed_and_drops_replaced_records(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            rawdir = os.path.join(tmpdir, 'raw')
+            outputdir = os.path.join(tmpdir, 'normalized')
+            os.makedirs(rawdir)
+            for number in range(2):
+                with open(os.path.join(rawdir, 'AL0011918%d.xml' % number), 'wb') as raw_file:
+                    raw_file.write(TEST_RECORD.replace(u'AL00119186', u'AL0011918%d' % number).encode('utf-8'))
+            inputfiles = sorted(os.path.join(rawdir, name) for name in os.listdir(rawdir))
+            normalize.normalize_incremental(inputfiles, outputdir, packed=True)
+
+            # the first source is renamed, the second one now yields another record
+            renamed = os.path.join(rawdir, 'renamed.xml')
+            os.rename(inputfiles[0], renamed)
+            with open(inputfiles[1], 'wb') as raw_file:
+                raw_file.write(TEST_RECORD.replace(u'AL00119186', u'AL00119189').encode('utf-8'))
+            normalize.normalize_incremental([renamed, inputfiles[1]], outputdir, packed=True)
+            store = record_store.RecordStore(outputdir)
+            self.assertEqual(sorted(store.ids()), [u'AL00119180', u'AL00119189'])
+            store.close()
+            with open(normalize.removed_ids_path(outputdir), 'rb') as removed_file:
+                self.assertEqual(removed_file.read(), 'AL00119181\n')
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    unittest.main()
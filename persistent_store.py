@@ -0,0 +1,121 @@
+"""
+Persistent key-value map for resolved remote lookups.
+
+Values are stored as JSON in a single SQLite table together with their
+storage time, so results of expensive lookups survive between runs. Entries
+older than the optional time to live are treated as missing. The map is
+safe to share between threads.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class PersistentMap:
+
+    def __init__(self, dbfile, ttl=None):
+        self.dbfile = dbfile
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        dirname = os.path.dirname(dbfile)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        self.db = sqlite3.connect(dbfile, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS entries '
+                        '(key TEXT PRIMARY KEY, value TEXT, stored REAL)')
+        self.db.commit()
+
+
+    def is_expired(self, stored):
+
+        return self.ttl is not None and time.time() - stored > self.ttl
+
+
+    def get(self, key, default=None):
+
+        with self.lock:
+            entry = self.db.execute('SELECT value, stored FROM entries WHERE key = ?', (key,)).fetchone()
+        if entry is None or self.is_expired(entry[1]):
+            return default
+        return json.loads(entry[0])
+
+
+    def get_many(self, keys):
+
+        """Stored values of the given keys, missing and expired keys are left out"""
+        res = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                res[key] = value
+        return res
+
+
+    def put(self, key, value):
+
+        self.put_many([(key, value)])
+
+
+    def put_many(self, items):
+
+        now = time.time()
+        with self.lock:
+            self.db.executemany('INSERT OR REPLACE INTO entries VALUES (?, ?, ?)',
+                                [(key, json.dumps(value), now) for key, value in items])
+            self.db.commit()
+
+
+    def update(self, items, deleted_keys=()):
+
+        """Store items and delete keys in a single transaction"""
+        now = time.time()
+        with self.lock:
+            try:
+                self.db.executemany('DELETE FROM entries WHERE key = ?', [(key,) for key in deleted_keys])
+                self.db.executemany('INSERT OR REPLACE INTO entries VALUES (?, ?, ?)',
+                                    [(key, json.dumps(value), now) for key, value in items])
+            except Exception:
+                self.db.rollback()
+                raise
+            self.db.commit()
+
+
+    def delete(self, key):
+
+        with self.lock:
+            self.db.execute('DELETE FROM entries WHERE key = ?', (key,))
+            self.db.commit()
+
+
+    def __contains__(self, key):
+
+        return self.get(key) is not None
+
+
+    def __len__(self):
+
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+
+    def keys(self):
+
+        with self.lock:
+            return [key for (key,) in self.db.execute('SELECT key FROM entries')]
+
+
+    def items(self):
+
+        """All stored (key, value) pairs, expired entries are left out"""
+        with self.lock:
+            entries = self.db.execute('SELECT key, value, stored FROM entries').fetchall()
+        return [(key, json.loads(value)) for key, value, stored in entries if not self.is_expired(stored)]
+
+
+    def close(self):
+
+        with self.lock:
+            self.db.close()
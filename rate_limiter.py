@@ -0,0 +1,215 @@
+"""
+Per-host rate limit scheduler for remote requests.
+
+Every host gets a token bucket sized to the limits the service publishes.
+Throttled responses (429, 503, ...) are retried after the delay given in
+the Retry-After header or, if missing, after a jittered exponential backoff,
+and the bucket rate of that host is lowered until requests succeed again.
+Request, retry and wait counters are kept per host.
+"""
+
+import email.utils
+import random
+import threading
+import time
+import urlparse
+
+import requests
+
+
+# requests per second and burst size per host, matched by domain suffix
+HOST_RATE_LIMITS = {
+    'musicbrainz.org': (1.0, 1)
+    , 'viaf.org': (4.0, 4)
+    , 'wikidata.org': (10.0, 10)
+    , 'wmflabs.org': (5.0, 5)
+    , 'europeana.eu': (10.0, 10)
+    , 'd-nb.info': (10.0, 10)
+    , 'dexterdemo.isti.cnr.it': (5.0, 5)
+    , 'googleapis.com': (10.0, 10)
+}
+DEFAULT_RATE_LIMIT = (10.0, 10)
+
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0          # seconds
+BACKOFF_MAX = 60.0          # seconds
+MIN_RATE_FACTOR = 1 / 16.0  # lowest rate relative to the configured one
+
+METRIC_NAMES = ['requests', 'throttled', 'retries', 'failures', 'wait_time']
+
+
+def backoff_delay(attempt):
+
+    """Exponential backoff with jitter for the given retry attempt"""
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def parse_retry_after(response):
+
+    """Return Retry-After header of a response in seconds or None"""
+    value = response.headers.get('Retry-After') if response.headers else None
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return float(value)
+    date = email.utils.parsedate_tz(value)
+    if date is None:
+        return None
+    return max(0.0, email.utils.mktime_tz(date) - time.time())
+
+
+class TokenBucket:
+
+    def __init__(self, rate, capacity):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.time()
+        self.blocked_until = 0
+        self.lock = threading.Lock()
+
+
+    def acquire(self):
+
+        """Wait for a token, return the time spent waiting"""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                else:
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+    def block(self, seconds):
+
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.time() + seconds)
+
+
+    def slow_down(self):
+
+        with self.lock:
+            self.rate = max(self.max_rate * MIN_RATE_FACTOR, self.rate / 2)
+
+
+    def speed_up(self):
+
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+
+class RateLimitScheduler:
+
+    def __init__(self, host_limits=None):
+        self.host_limits = host_limits if host_limits is not None else HOST_RATE_LIMITS
+        self.buckets = {}
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+
+    def host_key(self, url):
+
+        host = urlparse.urlsplit(url).netloc.lower().split(':')[0]
+        for domain in self.host_limits:
+            if host == domain or host.endswith('.' + domain):
+                return domain
+        return host
+
+
+    def get_bucket(self, key):
+
+        with self.lock:
+            if key not in self.buckets:
+                rate, capacity = self.host_limits.get(key, DEFAULT_RATE_LIMIT)
+                self.buckets[key] = TokenBucket(rate, capacity)
+                self.metrics[key] = dict((name, 0) for name in METRIC_NAMES)
+            return self.buckets[key]
+
+
+    def count(self, key, name, value=1):
+
+        with self.lock:
+            self.metrics[key][name] += value
+
+
+    def call(self, url, send):
+
+        """Run send() for the given URL within the limits of its host"""
+        key = self.host_key(url)
+        bucket = self.get_bucket(key)
+        attempt = 0
+        while True:
+            self.count(key, 'wait_time', bucket.acquire())
+            self.count(key, 'requests')
+            try:
+                response = send()
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= MAX_RETRIES:
+                    self.count(key, 'failures')
+                    raise
+                print 'Request error:', url, e
+                delay = backoff_delay(attempt)
+            else:
+                if response.status_code not in RETRY_STATUS_CODES:
+                    bucket.speed_up()
+                    return response
+                self.count(key, 'throttled')
+                bucket.slow_down()
+                if attempt >= MAX_RETRIES:
+                    self.count(key, 'failures')
+                    return response
+                delay = parse_retry_after(response)
+                if delay is None:
+                    delay = backoff_delay(attempt)
+                # release the connection of a streamed response
+                response.close()
+                print 'Throttled by', key, 'status code', response.status_code, 'retry in', round(delay, 2), 's'
+            bucket.block(delay)
+            self.count(key, 'retries')
+            attempt += 1
+
+
+    def get_metrics(self):
+
+        with self.lock:
+            res = {}
+            for key, values in self.metrics.items():
+                res[key] = dict(values)
+                res[key]['rate'] = self.buckets[key].rate
+            return res
+
+
+# Shared scheduler instance
+
+default_scheduler = None
+scheduler_lock = threading.Lock()
+
+
+def get_default_scheduler():
+
+    global default_scheduler
+    if default_scheduler is None:
+        with scheduler_lock:
+            if default_scheduler is None:
+                default_scheduler = RateLimitScheduler()
+    return default_scheduler
+
+
+def print_metrics():
+
+    for host, values in sorted(get_default_scheduler().get_metrics().items()):
+        print 'Host:', host, 'requests:', values['requests'], 'throttled:', values['throttled'] \
+            , 'retries:', values['retries'], 'failures:', values['failures'] \
+            , 'wait time:', round(values['wait_time'], 2), 'rate:', round(values['rate'], 2)
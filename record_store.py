@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+"""
+Append-only packed store for normalized and enriched records.
+
+Records are appended as JSON lines to numbered shard files, an index file
+maps every aleph_id to shard, offset and length of its latest version. The
+store supports random access by id, sequential streaming in insertion order
+and a read_records compatible iterator, so it can be passed wherever a list
+of input files is expected.
+
+Invocation:
+$ python record_store.py data/normalized/*.json -o data/normalized_packed
+"""
+
+import argparse
+import codecs
+import json
+import os
+import sys
+
+import common
+
+
+SHARD_PREFIX = 'shard-'
+SHARD_EXT = '.jsonl'
+INDEX_FILE = 'index.tsv'
+DELETED_SHARD = -1
+MAX_SHARD_SIZE = 256 * 1024 * 1024      # bytes
+JSON_EXT = '.json'
+
+
+def is_record_store(storedir):
+
+    return os.path.isfile(os.path.join(storedir, INDEX_FILE))
+
+
+def shard_name(number):
+
+    return SHARD_PREFIX + '%05d' % number + SHARD_EXT
+
+
+class RecordStore:
+
+    def __init__(self, storedir):
+        self.storedir = storedir
+        if not os.path.exists(storedir):
+            print("Creating directory", storedir)
+            os.makedirs(storedir)
+        self.index = {}
+        self.load_index()
+        self.shard = max([entry[0] for entry in self.index.values()] or [0])
+        self.shard_file = None
+        self.index_file = None
+
+
+    def load_index(self):
+
+        index_path = os.path.join(self.storedir, INDEX_FILE)
+        if not os.path.exists(index_path):
+            return
+        with codecs.open(index_path, 'r', 'utf-8') as index_file:
+            for line in index_file:
+                fields = line.rstrip('\n').split('\t')
+                # skip an incomplete last line left by an interrupted write
+                if len(fields) != 4 or not line.endswith('\n'):
+                    continue
+                record_id, shard, offset, length = fields
+                if int(shard) == DELETED_SHARD:
+                    self.index.pop(record_id, None)
+                    continue
+                self.index[record_id] = (int(shard), int(offset), int(length))
+
+
+    def shard_path(self, shard):
+
+        return os.path.join(self.storedir, shard_name(shard))
+
+
+    def open_for_append(self):
+
+        if self.shard_file is None:
+            self.shard_file = open(self.shard_path(self.shard), 'ab')
+            self.index_file = codecs.open(os.path.join(self.storedir, INDEX_FILE), 'a', 'utf-8')
+        self.shard_file.seek(0, os.SEEK_END)
+        if self.shard_file.tell() >= MAX_SHARD_SIZE:
+            self.shard_file.close()
+            self.shard += 1
+            self.shard_file = open(self.shard_path(self.shard), 'ab')
+
+
+    def put(self, record_id, record):
+
+        """Append a record, a later version of the same id supersedes the earlier one"""
+        data = json.dumps(record, sort_keys=True, ensure_ascii=False, encoding='utf-8')
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        self.open_for_append()
+        offset = self.shard_file.tell()
+        self.shard_file.write(data + '\n')
+        self.shard_file.flush()
+        self.index_file.write(u'\t'.join([record_id, unicode(self.shard), unicode(offset), unicode(len(data))]) + u'\n')
+        self.index_file.flush()
+        self.index[record_id] = (self.shard, offset, len(data))
+
+
+    def delete(self, record_id):
+
+        """Mark a record as deleted, its data stays in the shard"""
+        if record_id not in self.index:
+            return
+        self.open_for_append()
+        self.index_file.write(u'\t'.join([record_id, unicode(DELETED_SHARD), u'0', u'0']) + u'\n')
+        self.index_file.flush()
+        del self.index[record_id]
+
+
+    def get_raw(self, record_id):
+
+        shard, offset, length = self.index[record_id]
+        with open(self.shard_path(shard), 'rb') as shard_file:
+            shard_file.seek(offset)
+            return shard_file.read(length).decode('utf-8')
+
+
+    def get(self, record_id):
+
+        return json.loads(self.get_raw(record_id))
+
+
+    def __contains__(self, record_id):
+
+        return record_id in self.index
+
+
+    def __len__(self):
+
+        return len(self.index)
+
+
+    def ids(self):
+
+        return self.index.keys()
+
+
+    def locations(self):
+
+        """(record_id, (shard, offset, length)) of the latest record versions in shard order"""
+        return [(record_id, entry) for entry, record_id in
+                sorted((entry, record_id) for record_id, entry in self.index.items())]
+
+
+    def iter_raw(self):
+
+        """Stream (record_id, data) of the latest record versions shard by shard"""
+        locations = [(entry, record_id) for record_id, entry in self.locations()]
+        current_shard = None
+        shard_file = None
+        try:
+            for (shard, offset, length), record_id in locations:
+                if shard != current_shard:
+                    if shard_file:
+                        shard_file.close()
+                    shard_file = open(self.shard_path(shard), 'rb')
+                    current_shard = shard
+                shard_file.seek(offset)
+                yield record_id, shard_file.read(length).decode('utf-8')
+        finally:
+            if shard_file:
+                shard_file.close()
+
+
+    def iter_records(self):
+
+        for record_id, data in self.iter_raw():
+            yield record_id, json.loads(data)
+
+
+    # compatible with common.read_records, file names are {aleph_id}.json
+    def read_records(self):
+
+        for record_id, data in self.iter_raw():
+            yield (record_id + JSON_EXT, data)
+
+
+    def close(self):
+
+        if self.shard_file:
+            self.shard_file.close()
+            self.index_file.close()
+            self.shard_file = None
+            self.index_file = None
+
+
+def list_records(inputdir):
+
+    """Records of a directory, either its packed store or its record files"""
+    if is_record_store(inputdir):
+        return RecordStore(inputdir)
+    return [os.path.join(inputdir, filename) for filename in os.listdir(inputdir)]
+
+
+class RecordSelection:
+
+    """Subset of a record store by id, accepted by common.read_records"""
+
+    def __init__(self, store, record_ids):
+        self.store = store
+        self.record_ids = [record_id for record_id in record_ids if record_id in store]
+
+    def __len__(self):
+        return len(self.record_ids)
+
+    def read_records(self):
+        for record_id in self.record_ids:
+            yield (record_id + JSON_EXT, self.store.get_raw(record_id))
+
+    def locations(self):
+        return [(record_id, self.store.index[record_id]) for record_id in self.record_ids]
+
+    def get_raw(self, record_id):
+        return self.store.get_raw(record_id)
+
+
+def read_record_ids(idsfile):
+
+    with codecs.open(idsfile, 'r', 'utf-8') as ids_file:
+        return [line.strip() for line in ids_file if line.strip()]
+
+
+def select_records(inputs, record_ids):
+
+    """Restrict a store or list of record files to the given ids, e.g. the changed ids of a normalization run"""
+    if isinstance(inputs, RecordStore):
+        return RecordSelection(inputs, record_ids)
+    selected = set(record_ids)
+    return [filename for filename in inputs
+            if os.path.splitext(os.path.basename(filename))[0].replace('_enriched', '') in selected]
+
+
+def open_inputs(inputfiles):
+
+    """Command line inputs, a single record store directory is opened as store"""
+    if len(inputfiles) == 1 and is_record_store(inputfiles[0]):
+        return RecordStore(inputfiles[0])
+    return inputfiles
+
+
+def pack_records(inputfiles, outputdir):
+
+    """Import one-JSON-file-per-record directories into a packed store"""
+    store = RecordStore(outputdir)
+    for filename in inputfiles:
+        record = common.read_json_file(filename)
+        store.put(record['aleph_id'], record)
+    store.close()
+    print 'Packed', len(inputfiles), 'records in', outputdir
+
+
+# Command line parsing
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+                    description="Pack JSON record files into an append-only record store.")
+    parser.add_argument('inputfiles', type=str, nargs='+',
+                    help="Input files to be processed")
+    parser.add_argument('-o', '--outputdir', type=str, nargs='?',
+                    default="data/normalized_packed",
+                    help="Output directory")
+
+    if len(sys.argv) < 2:
+        parser.print_help()
+        sys.exit(1)
+
+    args = parser.parse_args()
+    pack_records(args.inputfiles, args.outputdir)
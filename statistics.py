@@ -72,7 +72,7 @@ def retrieve_comprehensive_composition_count(filename_authors, filename_viaf_com
         writer = csv.DictWriter(csvfile, delimiter=';', fieldnames=common.comprehensive_compositions_count_fieldnames, lineterminator='\n')
         writer.writeheader()
 
-        compositions = neo4j_manager.load_compositions_from_csv(filename_viaf_compositions)
+        composition_index = neo4j_manager.load_composition_index_from_csv(filename_viaf_compositions)
         sameas = retrieve_sameas_urls(filename_sameas)
         reader = csv.DictReader(open(filename_authors), delimiter=';', fieldnames=common.wikidata_author_fieldnames, lineterminator='\n')
         firstTime = True
@@ -81,7 +81,7 @@ def retrieve_comprehensive_composition_count(filename_authors, filename_viaf_com
             count += 1
             if not firstTime and count > 234:
                 print 'row', row
-                filtered_compositions = [composition for composition in compositions if composition[common.COMPOSITION_AUTHOR_ID_HEADER] == row[common.AUTHOR_VIAF_ID_HEADER]]
+                filtered_compositions = neo4j_manager.find_author_compositions(composition_index, row)
                 author = row[common.AUTHOR_NAME_HEADER]
                 gnd = row[common.GND_HEADER]
                 viaf_len = len(filtered_compositions)
@@ -2,23 +2,37 @@
 """
 Script for summarizing data for statistics generation.
 
+All requested summaries are written in a single pass, every record is read
+and parsed once and fed to each summary.
+
+The records summary can be maintained incrementally: summary rows are kept
+by aleph_id in an index next to the CSV together with the modification time
+and size (or, for packed stores, the content hash) of their source. Only
+new and changed records are summarized again, the CSV is regenerated from
+the index and corpus totals are kept as running aggregates.
+
 Invocation:
 $ python summarize.py data/enriched/*.json -o summary.csv
+$ python summarize.py data/normalized/*.json -o summary.csv -t summary_titles.csv -a summary_authors.csv
+$ python summarize.py data/enriched/*.json -o summary.csv -i
 """
 
 import argparse
 import csv
 import json
+import os
 import sys
 import codecs
 
 import common
 
-import goslate
-
 from common import read_records
 
+import batch_lookup
 import dbpedia_helper
+import persistent_store
+import record_store
+import translate_helper
 
 
 DOC_ID_JSON = 'doc_id'
@@ -27,7 +41,13 @@ SAMEAS_JSON = 'sameas'
 GND_JSON = 'gnd'
 NAME_JSON = 'name'
 
-gs = goslate.Goslate()
+TITLES_FIELDNAMES = ['gnd', 'author', 'subject', 'title']
+TRANSLATION_FIELD = 'translation'
+TITLES_BATCH_ROWS = 500                          # rows buffered per translation batch
+AUTHORS_BATCH_RECORDS = 500                      # records buffered per DBPedia prefetch
+SUMMARY_INDEX_EXT = '.index.sqlite'
+TOTALS_KEY = '#totals'
+RECORDS_TOTAL = 'records'
 
 
 def summarize(data):
@@ -112,8 +132,6 @@ def summarize_titles_data(data, fieldnames):
         str_list.append(byte_str)
     print 'titles out: ', titles_res
 
-    print 'en translation: ', gs.translate(titles_res, 'en')
-
     #entry = {
     #    'gnd': ' '.join(map(str,link_person_gnd)),
     #    'author': ' '.join(map(str,authors)),
@@ -132,7 +150,9 @@ def summarize_titles_data(data, fieldnames):
     return entry
 
 
-def summarize_authors_data(data, fieldnames):
+def summarize_authors_data(data, fieldnames, prefetched=None):
+
+    # prefetched are the lookups of dbpedia_helper.prefetch_dbpedia_ids, failed ones are not requested again
 
     entries = []
     onb_id = ''
@@ -151,10 +171,17 @@ def summarize_authors_data(data, fieldnames):
                  link_person_gnd = [link for link in links
                                          if GND_JSON in link]
 
-            dbpedia_items = dbpedia_helper.find_dbpedia_items(author)
+            if prefetched is not None:
+                entities_by_text, urls_by_id = prefetched
+                dbpedia_items = entities_by_text.get(dbpedia_helper.store_key(author)) or {}
+            else:
+                dbpedia_items = dbpedia_helper.find_dbpedia_items(author) or {}
             dbpedia_id_res = ''
             for key, value in dbpedia_items.iteritems():
-                dbpedia_id = dbpedia_helper.find_dbpedia_id(key)
+                if prefetched is not None:
+                    dbpedia_id = urls_by_id.get(dbpedia_helper.store_key(key))
+                else:
+                    dbpedia_id = dbpedia_helper.find_dbpedia_id(key)
                 dbpeida_id_str = common.toByteStr(dbpedia_id)
                 print 'DBPedia ID', dbpeida_id_str
                 dbpedia_id_res = dbpeida_id_str + ' ' + dbpedia_id_res
@@ -215,48 +242,17 @@ def summarize_sameas_data(data, fieldnames):
 
 def summarize_titles(inputfiles, outputfile):
 
-    print("Summarizing", len(inputfiles), "titles in", outputfile)
-    with codecs.open(outputfile, 'w') as csvfile:
-        fieldnames = ['gnd',
-                      'author',
-                      'subject',
-                      'title']
-
-        writer = csv.DictWriter(csvfile, delimiter=';', fieldnames=fieldnames, lineterminator='\n')
-        writer.writeheader()
-        for filename, record in read_records(inputfiles):
-            data = json.loads(record, encoding='utf-8')
-            entry = summarize_titles_data(data, fieldnames)
-            writer.writerow(entry)
+    summarize_corpus(inputfiles, [TitlesSummary(outputfile)])
 
 
 def summarize_authors(inputfiles, outputfile):
 
-    print("Summarizing", len(inputfiles), "authors in", outputfile)
-    with codecs.open(outputfile, 'w') as csvfile:
-        fieldnames = ['onb id',
-                      'author name',
-                      'gnd url',
-                      'dbpedia id']
-
-        writer = csv.DictWriter(csvfile, delimiter=';', fieldnames=fieldnames, lineterminator='\n')
-        writer.writeheader()
-        for filename, record in read_records(inputfiles):
-            data = json.loads(record, encoding='utf-8')
-            entries = summarize_authors_data(data, fieldnames)
-            writer.writerows(entries)
+    summarize_corpus(inputfiles, [AuthorsSummary(outputfile)])
 
 
 def summarize_sameas(inputfiles, outputfile):
 
-    print("Summarizing", len(inputfiles), "authors in", outputfile)
-    with codecs.open(outputfile, 'w') as csvfile:
-        writer = csv.DictWriter(csvfile, delimiter=';', fieldnames=common.sameas_fieldnames, lineterminator='\n')
-        writer.writeheader()
-        for filename, record in read_records(inputfiles):
-            data = json.loads(record, encoding='utf-8')
-            entries = summarize_sameas_data(data, common.sameas_fieldnames)
-            writer.writerows(entries)
+    summarize_corpus(inputfiles, [SameAsSummary(outputfile)])
 
 
 def correct_authors(outputfile):
@@ -286,7 +282,8 @@ def read_summary(inputfile):
         summary_reader = csv.reader(csvfile, delimiter=';', quotechar='|')
         summary = []
         for row in summary_reader:
-            row_str = unicode(', '.join(row[1:]), 'utf-8')
+            # the translation column of the titles summary is not part of the query
+            row_str = unicode(', '.join(row[1:len(TITLES_FIELDNAMES)]), 'utf-8')
             summary.append(row_str)
         return summary
 
@@ -301,24 +298,251 @@ def read_csv_summary(inputfile):
         return summary
 
 
+# Summaries written in a single pass over the records
+
+class Summary:
+
+    """CSV summary fed with one record after the other by summarize_corpus, subclasses set name and fieldnames"""
+    fieldnames = []
+    delimiter = ','
+    lineterminator = '\r\n'
+
+    def __init__(self, outputfile):
+        self.outputfile = outputfile
+        self.csvfile = None
+        self.writer = None
+
+
+    def open(self):
+
+        self.csvfile = open(self.outputfile, 'w')
+        self.writer = csv.DictWriter(self.csvfile, delimiter=self.delimiter, fieldnames=self.fieldnames,
+                                     lineterminator=self.lineterminator)
+        self.writer.writeheader()
+
+
+    def add(self, filename, data):
+
+        # every summary writes its own rows for a record
+        raise NotImplementedError
+
+
+    def close(self):
+
+        if self.csvfile is not None:
+            self.csvfile.close()
+            self.csvfile = None
+
+
+class RecordsSummary(Summary):
+
+    name = 'records'
+    fieldnames = ['id',
+                  'links_artwork',
+                  'persons',
+                  'links_person_gnd',
+                  'links_person_dbpedia',
+                  'links_person_viaf',
+                  'related_europeana_items']
+
+    def add(self, filename, data):
+
+        self.writer.writerow(summarize(data))
+
+
+class TitlesSummary(Summary):
+
+    """Titles with their translation, rows are buffered and translated in batches"""
+    name = 'titles'
+    fieldnames = TITLES_FIELDNAMES + [TRANSLATION_FIELD]
+    delimiter = ';'
+    lineterminator = '\n'
+
+    def __init__(self, outputfile, translate=True):
+        Summary.__init__(self, outputfile)
+        self.translate = translate
+        self.rows = []
+
+
+    def add(self, filename, data):
+
+        self.rows.append(summarize_titles_data(data, TITLES_FIELDNAMES))
+        if len(self.rows) >= TITLES_BATCH_ROWS:
+            self.flush()
+
+
+    def flush(self):
+
+        if self.translate:
+            translations = translate_helper.translate_texts([row['title'] for row in self.rows])
+            for row in self.rows:
+                row[TRANSLATION_FIELD] = common.toByteStr(
+                    translations.get(translate_helper.to_unicode(row['title'])))
+        self.writer.writerows(self.rows)
+        self.rows = []
+
+
+    def close(self):
+
+        if self.csvfile is not None:
+            self.flush()
+        Summary.close(self)
+
+
+class AuthorsSummary(Summary):
+
+    """Authors with their DBPedia ids, records are buffered and their authors spotted in batches"""
+    name = 'authors'
+    fieldnames = ['onb id',
+                  'author name',
+                  'gnd url',
+                  'dbpedia id']
+    delimiter = ';'
+    lineterminator = '\n'
+
+    def __init__(self, outputfile):
+        Summary.__init__(self, outputfile)
+        self.records = []
+
+
+    def add(self, filename, data):
+
+        self.records.append(data)
+        if len(self.records) >= AUTHORS_BATCH_RECORDS:
+            self.flush()
+
+
+    def flush(self):
+
+        # spot the distinct authors of the batch concurrently, rows are then built from the prefetched lookups
+        prefetched = dbpedia_helper.prefetch_dbpedia_ids([person[NAME_JSON] for data in self.records
+                                                          for person in data.get(PERSONS_JSON, [])])
+        for data in self.records:
+            self.writer.writerows(summarize_authors_data(data, self.fieldnames, prefetched))
+        self.records = []
+
+
+    def close(self):
+
+        if self.csvfile is not None:
+            self.flush()
+        Summary.close(self)
+
+
+class SameAsSummary(Summary):
+
+    name = 'sameas'
+    fieldnames = common.sameas_fieldnames
+    delimiter = ';'
+    lineterminator = '\n'
+
+    def add(self, filename, data):
+
+        self.writer.writerows(summarize_sameas_data(data, self.fieldnames))
+
+
+def summarize_corpus(inputfiles, summaries):
+
+    """Read and parse every record once and feed it to all summaries"""
+    for summary in summaries:
+        print("Summarizing", len(inputfiles), summary.name, "in", summary.outputfile)
+    for summary in summaries:
+        summary.open()
+    try:
+        for filename, record in read_records(inputfiles):
+            data = json.loads(record, encoding='utf-8')
+            for summary in summaries:
+                summary.add(filename, data)
+    finally:
+        for summary in summaries:
+            summary.close()
+
+
 # Main summarization routine
 
 def summarize_records(inputfiles, outputfile):
-    print("Summarizing", len(inputfiles), "records in", outputfile)
-    with open(outputfile, 'w') as csvfile:
-        fieldnames = ['id',
-                      'links_artwork',
-                      'persons',
-                      'links_person_gnd',
-                      'links_person_dbpedia',
-                      'links_person_viaf',
-                      'related_europeana_items']
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writeheader()
-        for filename, record in read_records(inputfiles):
-            data = json.loads(record)
-            entry = summarize(data)
-            writer.writerow(entry)
+
+    summarize_corpus(inputfiles, [RecordsSummary(outputfile)])
+
+
+# Incremental records summary
+
+def summary_index_path(outputfile):
+    return os.path.splitext(outputfile)[0] + SUMMARY_INDEX_EXT
+
+
+def record_sources(inputfiles):
+
+    """(filename, stamp) of all inputs, packed records are stamped by their location in the store"""
+    if hasattr(inputfiles, 'locations'):
+        # a rewritten record is appended, so its location changes with its content
+        for record_id, location in inputfiles.locations():
+            yield (record_id + record_store.JSON_EXT, list(location))
+        return
+    for filename in inputfiles:
+        stat = os.stat(filename)
+        yield (filename, [stat.st_mtime, stat.st_size])
+
+
+def read_source(inputfiles, filename):
+
+    if hasattr(inputfiles, 'get_raw'):
+        return inputfiles.get_raw(os.path.splitext(filename)[0])
+    return common.read_file_data(filename).decode('utf-8')
+
+
+def add_to_totals(totals, row, sign):
+
+    totals[RECORDS_TOTAL] = totals.get(RECORDS_TOTAL, 0) + sign
+    for field in RecordsSummary.fieldnames[1:]:
+        totals[field] = totals.get(field, 0) + sign * row[field]
+
+
+def summarize_records_incremental(inputfiles, outputfile):
+
+    """Summarize new and changed records only and regenerate the CSV, returns the corpus totals
+
+    inputfiles are all records of the summary, indexed records missing in
+    them are removed from the summary and the totals.
+    """
+    index = persistent_store.PersistentMap(summary_index_path(outputfile))
+    entries = dict(index.items())
+    totals = entries.pop(TOTALS_KEY, {})
+    source_ids = dict((entry['source'], aleph_id) for aleph_id, entry in entries.items())
+    order = []
+    updates = []
+    for filename, stamp in record_sources(inputfiles):
+        aleph_id = source_ids.get(filename)
+        if aleph_id is not None and entries[aleph_id]['stamp'] == stamp:
+            order.append(aleph_id)
+            continue
+        record = read_source(inputfiles, filename)
+        row = summarize(json.loads(record))
+        aleph_id = row['id']
+        if aleph_id in entries:
+            add_to_totals(totals, entries[aleph_id]['row'], -1)
+        add_to_totals(totals, row, 1)
+        entries[aleph_id] = {'source': filename, 'stamp': stamp, 'row': row}
+        updates.append((aleph_id, entries[aleph_id]))
+        order.append(aleph_id)
+
+    # records whose source vanished leave the summary and the totals
+    order = batch_lookup.unique(order)
+    removed = set(entries.keys()) - set(order)
+    for aleph_id in removed:
+        add_to_totals(totals, entries[aleph_id]['row'], -1)
+    # rows and totals of the index change together or not at all
+    index.update(updates + [(TOTALS_KEY, totals)], removed)
+    index.close()
+    print "Summarized", len(updates), "changed records,", len(removed), "removed, of", len(order), "records in", outputfile
+
+    summary = RecordsSummary(outputfile)
+    summary.open()
+    try:
+        summary.writer.writerows([entries[aleph_id]['row'] for aleph_id in order])
+    finally:
+        summary.close()
+    return totals
 
 
 # Command line parsing
@@ -332,6 +556,16 @@ if __name__ == '__main__':
     parser.add_argument('-o', '--outputfile', type=str, nargs='?',
                     default="data/summary.csv",
                     help="Output file")
+    parser.add_argument('-c', '--changed_ids', type=str, nargs='?',
+                    help="Summarize only the records listed in this file, e.g. data/normalized.changed.txt")
+    parser.add_argument('-i', '--incremental', action='store_true',
+                    help="Summarize only new and changed records of all inputs, the index is kept next to the output file")
+    parser.add_argument('-t', '--titles', type=str, nargs='?',
+                    help="Titles summary written in the same pass")
+    parser.add_argument('-a', '--authors', type=str, nargs='?',
+                    help="Authors summary written in the same pass")
+    parser.add_argument('-s', '--sameas', type=str, nargs='?',
+                    help="SameAs summary written in the same pass")
 
 
     if len(sys.argv) < 2:
@@ -339,4 +573,21 @@ if __name__ == '__main__':
         sys.exit(1)
 
     args = parser.parse_args()
-    summarize_records(args.inputfiles, args.outputfile)
+    if args.changed_ids and args.incremental:
+        # the incremental summary treats records left out of the inputs as removed
+        parser.error("--changed_ids can not be combined with --incremental, which finds changed records itself")
+    inputs = record_store.open_inputs(args.inputfiles)
+    if args.changed_ids:
+        inputs = record_store.select_records(inputs, record_store.read_record_ids(args.changed_ids))
+    if args.incremental:
+        totals = summarize_records_incremental(inputs, args.outputfile)
+        print 'Totals:', totals
+    else:
+        summaries = [RecordsSummary(args.outputfile)]
+        if args.titles:
+            summaries.append(TitlesSummary(args.titles))
+        if args.authors:
+            summaries.append(AuthorsSummary(args.authors))
+        if args.sameas:
+            summaries.append(SameAsSummary(args.sameas))
+        summarize_corpus(inputs, summaries)
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+##
+##    In this module we test the summaries of normalized and enriched records for scoregraph project.
+##
+
+import unittest
+import json
+import os
+import shutil
+import tempfile
+
+import corpus_statistics
+import dbpedia_helper
+import persistent_store
+import record_store
+import summarize
+import translate_helper
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+TEST_RECORDS = [
+    {'aleph_id': u'AL00119186', 'doc_id': u'000119186',
+     'sameas': [u'http://d-nb.info/gnd/300040431'],
+     'persons': [{'name': u'Mahler, Gustav',
+                  'sameas': [u'http://d-nb.info/gnd/118576291', u'http://viaf.org/viaf/61732497']}],
+     'related_europeana_items': [{'id': u'/92004/item'}]},
+    {'aleph_id': u'AL00119187', 'doc_id': u'000119187'}
+]
+
+
+class FakeDexterResponse:
+
+    def __init__(self, url, result):
+        self.url = url
+        self.status_code = 200
+        self.result = result
+
+    def json(self):
+        return self.result
+
+
+class FakeDexterClient:
+
+    def __init__(self, status_code=200):
+        self.requests = []
+        self.status_code = status_code
+
+    def get(self, url, params=None, **kwargs):
+        self.requests.append(url)
+        if self.status_code != 200:
+            response = FakeDexterResponse(url, None)
+            response.status_code = self.status_code
+            return response
+        if url == dbpedia_helper.DEXTER_API_URI:
+            return FakeDexterResponse(url, {'entities': {'49109': {'spot': params['text']}}})
+        return FakeDexterResponse(url, {'url': 'http://dbpedia.org/resource/Gustav_Mahler'})
+
+
+class TestSummarize(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.http_client = None
+
+    def tearDown(self):
+        if self.http_client is not None:
+            dbpedia_helper.http_client = self.http_client
+            for store in dbpedia_helper.default_stores.values():
+                store.close()
+            dbpedia_helper.default_stores.clear()
+        shutil.rmtree(self.tmpdir)
+
+    def write_records(self, records):
+        inputfiles = []
+        for data in records:
+            filename = os.path.join(self.tmpdir, data['aleph_id'] + '.json')
+            with open(filename, 'wb') as record_file:
+                json.dump(data, record_file)
+            inputfiles.append(filename)
+        return inputfiles
+
+    def use_dexter_client(self, client):
+        self.http_client = dbpedia_helper.http_client
+        dbpedia_helper.http_client = client
+        for name in ['spot', 'desc']:
+            dbpedia_helper.default_stores[name] = persistent_store.PersistentMap(
+                os.path.join(self.tmpdir, name + '.sqlite'))
+
+    def test_single_pass_matches_separate_summaries(self):
+        inputfiles = self.write_records(TEST_RECORDS)
+        summarize.summarize_records(inputfiles, os.path.join(self.tmpdir, 'records.csv'))
+        summarize.summarize_sameas(inputfiles, os.path.join(self.tmpdir, 'sameas.csv'))
+        summarize.summarize_corpus(inputfiles, [
+            summarize.RecordsSummary(os.path.join(self.tmpdir, 'records_pass.csv')),
+            summarize.SameAsSummary(os.path.join(self.tmpdir, 'sameas_pass.csv'))])
+
+        for name in ['records', 'sameas']:
+            with open(os.path.join(self.tmpdir, name + '.csv'), 'rb') as separate:
+                with open(os.path.join(self.tmpdir, name + '_pass.csv'), 'rb') as single_pass:
+                    self.assertEqual(separate.read(), single_pass.read())
+        with open(os.path.join(self.tmpdir, 'records_pass.csv'), 'rb') as records:
+            self.assertEqual(records.read().splitlines()[1:],
+                             ['AL00119186,1,1,1,0,1,1', 'AL00119187,0,0,0,0,0,0'])
+
+    def test_incremental_records_summary_matches_full_rebuild(self):
+        inputfiles = self.write_records(TEST_RECORDS)
+        outputfile = os.path.join(self.tmpdir, 'summary.csv')
+        totals = summarize.summarize_records_incremental(inputfiles, outputfile)
+        self.assertEqual((totals['records'], totals['persons'], totals['links_person_gnd']), (2, 1, 1))
+
+        changed = dict(TEST_RECORDS[1], persons=[{'name': u'Wolf, Hugo'}, {'name': u'Berg, Alban'}])
+        with open(inputfiles[1], 'wb') as record_file:
+            json.dump(changed, record_file)
+        os.utime(inputfiles[1], (0, 0))
+        totals = summarize.summarize_records_incremental(inputfiles[1:], outputfile)
+        self.assertEqual((totals['records'], totals['persons'], totals['links_person_gnd']), (1, 2, 0))
+
+        summarize.summarize_records(inputfiles[1:], os.path.join(self.tmpdir, 'full.csv'))
+        with open(outputfile, 'rb') as incremental:
+            with open(os.path.join(self.tmpdir, 'full.csv'), 'rb') as full:
+                self.assertEqual(incremental.read(), full.read())
+
+    def test_packed_records_are_read_only_when_their_location_changed(self):
+        store = record_store.RecordStore(os.path.join(self.tmpdir, 'packed'))
+        for data in TEST_RECORDS:
+            store.put(data['aleph_id'], data)
+        outputfile = os.path.join(self.tmpdir, 'summary.csv')
+        summarize.summarize_records_incremental(store, outputfile)
+        store.put(TEST_RECORDS[1]['aleph_id'], dict(TEST_RECORDS[1], persons=[{'name': u'Wolf, Hugo'}]))
+        read = []
+        get_raw = store.get_raw
+        store.get_raw = lambda record_id: read.append(record_id) or get_raw(record_id)
+        totals = summarize.summarize_records_incremental(store, outputfile)
+        store.close()
+        self.assertEqual(read, [TEST_RECORDS[1]['aleph_id']])
+        self.assertEqual((totals['records'], totals['persons']), (2, 2))
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_corpus_statistics_of_records_summary(self):
+        summaryfile = os.path.join(self.tmpdir, 'summary.csv')
+        with open(summaryfile, 'wb') as csvfile:
+            csvfile.write('id,links_artwork,persons,links_person_gnd,links_person_dbpedia,links_person_viaf,'
+                          'related_europeana_items\n'
+                          'AL1,1,2,2,0,1,20\nAL2,0,1,1,0,0,0\nAL3,0,0,0,0,0,3\nAL4,1,1,0,1,1,12\n')
+        report = corpus_statistics.compute_statistics(corpus_statistics.load_summary_columns(summaryfile))
+        self.assertEqual(report['records'], 4)
+        self.assertEqual(report['columns']['links_person_gnd']['coverage'], 0.5)
+        self.assertEqual(report['columns']['related_europeana_items']['histogram'],
+                         [1, 0, 0, 1, 0, 0, 0, 0, 0, 0, 2])
+        self.assertEqual(report['cross_tabs']['links_person_gnd x links_person_viaf'],
+                         {'both': 1, 'links_person_gnd only': 1, 'links_person_viaf only': 1, 'neither': 1})
+        cached = corpus_statistics.load_summary_columns(summaryfile)
+        self.assertEqual(cached['persons'].tolist(), [2, 1, 0, 1])
+        brokenfile = os.path.join(self.tmpdir, 'broken.csv')
+        with open(brokenfile, 'wb') as csvfile:
+            csvfile.write('id,links_artwork,persons\nAL1,1,2\nAL2,,1\nAL3,0,0\n')
+        self.assertRaises(ValueError, corpus_statistics.parse_summary_columns, brokenfile)
+
+    def test_titles_are_translated_once_through_the_memory(self):
+        calls = []
+        def translate(texts, target_language, source_language):
+            calls.append(list(texts))
+            return [text.upper() for text in texts]
+        try:
+            inputfiles = self.write_records([{'aleph_id': u'AL0011918%d' % number,
+                                              'notes': [u'Lieder', u'für Orchester']} for number in range(3)])
+            store = persistent_store.PersistentMap(os.path.join(self.tmpdir, 'translations.sqlite'))
+            translate_helper.default_memory = translate_helper.TranslationMemory(store, translate, batch_size=2)
+            outputfile = os.path.join(self.tmpdir, 'titles.csv')
+            summarize.summarize_titles(inputfiles, outputfile)
+            summarize.summarize_titles(inputfiles, outputfile)
+            self.assertEqual(calls, [[u'Lieder für Orchester ']])
+            with open(outputfile, 'rb') as titles:
+                rows = titles.read().splitlines()
+            self.assertEqual(rows[0], 'gnd;author;subject;title;translation')
+            self.assertEqual(rows[1], ';;;Lieder f\xc3\xbcr Orchester ;LIEDER F\xc3\x9cR ORCHESTER ')
+            self.assertEqual(summarize.read_summary(outputfile)[1], u', , Lieder f\xfcr Orchester ')
+        finally:
+            translate_helper.default_memory = None
+
+    def test_failed_translation_batches_are_retried(self):
+        def fail(texts, target_language, source_language):
+            raise IOError('service unavailable')
+        store = persistent_store.PersistentMap(os.path.join(self.tmpdir, 'translations.sqlite'))
+        self.assertEqual(translate_helper.TranslationMemory(store, fail).translate_all([u'Lieder']), {})
+        memory = translate_helper.TranslationMemory(store, lambda texts, target, source: [u'Songs'])
+        self.assertEqual(memory.translate_all(['Lieder', u'Lieder', ' ']), {u'Lieder': u'Songs'})
+        self.assertEqual(store.get(u'auto|en|Lieder'), u'Songs')
+        store.close()
+
+    def test_authors_are_spotted_once_per_distinct_name(self):
+        client = FakeDexterClient()
+        inputfiles = self.write_records([{'aleph_id': u'AL0011918%d' % number, 'doc_id': u'00011918%d' % number,
+                                          'persons': [{'name': u'Mahler, Gustav',
+                                                       'sameas': [u'http://d-nb.info/gnd/118576291']}]}
+                                         for number in range(3)])
+        self.use_dexter_client(client)
+        outputfile = os.path.join(self.tmpdir, 'authors.csv')
+        summarize.summarize_authors(inputfiles, outputfile)
+        summarize.summarize_authors(inputfiles, outputfile)
+        self.assertEqual(client.requests, [dbpedia_helper.DEXTER_API_URI, dbpedia_helper.DEXTER_API_DBPEDIA_ID_URI])
+        with open(outputfile, 'rb') as authors:
+            rows = authors.read().splitlines()
+        self.assertEqual(rows[1], '000119180;Mahler, Gustav;http://d-nb.info/gnd/118576291;'
+                                  'http://dbpedia.org/resource/Gustav_Mahler ')
+        self.assertEqual(len(rows), 4)
+
+    def test_failed_spots_are_requested_once_per_batch(self):
+        client = FakeDexterClient(503)
+        inputfiles = self.write_records([{'aleph_id': u'AL0011918%d' % number, 'doc_id': u'00011918%d' % number,
+                                          'persons': [{'name': u'Mahler, Gustav'}]} for number in range(3)])
+        self.use_dexter_client(client)
+        outputfile = os.path.join(self.tmpdir, 'authors.csv')
+        summarize.summarize_authors(inputfiles, outputfile)
+        self.assertEqual(client.requests, [dbpedia_helper.DEXTER_API_URI])
+        with open(outputfile, 'rb') as authors:
+            self.assertEqual(authors.read().splitlines()[1], '000119180;Mahler, Gustav;;')
+
+if __name__ == '__main__':
+    unittest.main()
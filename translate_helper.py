@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+"""
+Script for translating record texts with a persistent translation memory.
+
+Translations are kept per language pair in a persistent store, so every
+distinct text is sent to the translation service once. Missing texts are
+deduplicated and sent in batches, goslate packs the segments of a batch
+into as few requests as possible. Failed batches are not stored and are
+translated again by the next run.
+
+Invocation:
+$ python translate_helper.py data/summary_titles.csv -o data/summary_titles_translated.csv
+"""
+
+import argparse
+import csv
+import sys
+
+import batch_lookup
+import persistent_store
+
+
+TRANSLATION_STORE = 'data/translations.sqlite'
+TRANSLATION_TARGET_LANGUAGE = 'en'
+TRANSLATION_SOURCE_LANGUAGE = ''                  # empty lets the service detect the language
+TRANSLATION_BATCH_SIZE = 50                       # segments per translation call
+AUTO_LANGUAGE = 'auto'
+TITLE_COLUMN = 'title'                            # column translated by the command line
+TRANSLATION_COLUMN = 'translation'
+
+translator = None
+
+
+def get_translator():
+    # goslate is only needed for translations, load it on first use
+    global translator
+    if translator is None:
+        import goslate
+        translator = goslate.Goslate()
+    return translator
+
+
+def translate_batch(texts, target_language, source_language):
+
+    """Translations of texts in one goslate call, in input order"""
+    return list(get_translator().translate(texts, target_language, source_language))
+
+
+def to_unicode(text):
+
+    if isinstance(text, str):
+        return text.decode('utf-8')
+    return text
+
+
+class TranslationMemory:
+
+    def __init__(self, store, translate=translate_batch, batch_size=TRANSLATION_BATCH_SIZE):
+        self.store = store
+        self.translate = translate
+        self.batch_size = batch_size
+        self.translated = 0
+
+
+    def key(self, text, target_language, source_language):
+
+        return (source_language or AUTO_LANGUAGE) + '|' + target_language + '|' + text
+
+
+    def translate_all(self, texts, target_language=TRANSLATION_TARGET_LANGUAGE,
+                      source_language=TRANSLATION_SOURCE_LANGUAGE):
+
+        """Map of the distinct texts to their translations, texts whose batch failed are left out"""
+        distinct = batch_lookup.unique([to_unicode(text) for text in texts if text and text.strip()])
+        keys = dict((text, self.key(text, target_language, source_language)) for text in distinct)
+        stored = self.store.get_many(keys.values())
+        translations = dict((text, stored[keys[text]]) for text in distinct if keys[text] in stored)
+        missing = [text for text in distinct if text not in translations]
+        for start in range(0, len(missing), self.batch_size):
+            batch = missing[start:start + self.batch_size]
+            try:
+                results = self.translate(batch, target_language, source_language)
+            except Exception as e:
+                print 'Translation error for', len(batch), 'texts:', e
+                continue
+            self.store.put_many([(keys[text], result) for text, result in zip(batch, results)])
+            translations.update(zip(batch, results))
+            self.translated += len(batch)
+        return translations
+
+
+# Shared translation memory
+
+default_memory = None
+memory_settings = {'storefile': TRANSLATION_STORE}
+
+
+def configure(storefile=None):
+
+    global default_memory
+    if storefile is not None:
+        memory_settings['storefile'] = storefile
+    default_memory = None
+
+
+def get_memory():
+
+    global default_memory
+    if default_memory is None:
+        default_memory = TranslationMemory(persistent_store.PersistentMap(memory_settings['storefile']))
+    return default_memory
+
+
+def translate_texts(texts, target_language=TRANSLATION_TARGET_LANGUAGE, source_language=TRANSLATION_SOURCE_LANGUAGE):
+
+    return get_memory().translate_all(texts, target_language, source_language)
+
+
+# Command line parsing
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+                    description="Translate the title column of a semicolon separated summary.")
+    parser.add_argument('inputfile', type=str,
+                    help="Summary file, e.g. data/summary_titles.csv")
+    parser.add_argument('-o', '--outputfile', type=str, nargs='?',
+                    default="data/summary_translated.csv",
+                    help="Output file with a translation column")
+    parser.add_argument('-l', '--language', type=str, nargs='?',
+                    default=TRANSLATION_TARGET_LANGUAGE,
+                    help="Target language")
+    parser.add_argument('-s', '--storefile', type=str, nargs='?',
+                    default=TRANSLATION_STORE,
+                    help="Persistent translation memory")
+
+    if len(sys.argv) < 2:
+        parser.print_help()
+        sys.exit(1)
+
+    args = parser.parse_args()
+    configure(args.storefile)
+    with open(args.inputfile, 'rb') as csvfile:
+        rows = list(csv.reader(csvfile, delimiter=';'))
+    header = rows[0]
+    if TITLE_COLUMN not in header:
+        print 'No', TITLE_COLUMN, 'column in', args.inputfile
+        sys.exit(1)
+    title_column = header.index(TITLE_COLUMN)
+    # summaries translated before, e.g. by summarize_titles, get their translation column replaced
+    if TRANSLATION_COLUMN not in header:
+        header = header + [TRANSLATION_COLUMN]
+    translation_column = header.index(TRANSLATION_COLUMN)
+    translations = translate_texts([row[title_column] for row in rows[1:]], args.language)
+    with open(args.outputfile, 'wb') as csvfile:
+        writer = csv.writer(csvfile, delimiter=';', lineterminator='\n')
+        writer.writerow(header)
+        for row in rows[1:]:
+            row = row + [''] * (len(header) - len(row))
+            row[translation_column] = translations.get(to_unicode(row[title_column]), u'').encode('utf-8')
+            writer.writerow(row)
+    print 'Translated', get_memory().translated, 'texts,', len(translations), 'translations in total'
@@ -17,15 +17,14 @@ import json
 
 import common
 
+import batch_lookup
+
 import freebase_helper
 
 import summarize
 
-# helper for SPARQL queries
-from SPARQLWrapper import SPARQLWrapper, JSON
-
 # HTTP connection
-import requests
+import http_client
 
 
 ONB_COL = 0
@@ -124,7 +123,7 @@ def extract_wikidata_author_id(response):
 
 
 def build_wikidata_author_entry(
-        author_response_json, line, wikidata_author_id):
+        author_response_json, line, wikidata_author_id, occupation_responses=None):
 
     row = line.split(";")
     genres = extract_property_value(author_response_json, GENRE_PROP)
@@ -132,7 +131,7 @@ def build_wikidata_author_entry(
 #    if 'Stoll' in line:
 #        ii = 0
     for occupation in occupations.split(common.BLANK):
-        add_occupation(occupation, wikidata_author_id)
+        add_occupation(occupation, wikidata_author_id, occupation_responses)
     freebase = extract_property_value(author_response_json, FREEBASE_ID_PROP)
     for id in freebase.split(common.BLANK):
         freebase_helper.retrieve_compositions(id)
@@ -467,10 +466,18 @@ def retrieve_wikidata_occupation(wikidata_occupation_id):
     return occupation_response_json
 
 
-def add_occupation(occupation_id, wikidata_author_id):
+def fetch_occupation_data(occupation_id):
+
+    return common.validate_response_json(retrieve_wikidata_occupation(occupation_id))
+
 
-    occupation_data_response = retrieve_wikidata_occupation(occupation_id)
-    wikidata_occupation_data_response_json = common.validate_response_json(occupation_data_response)
+def add_occupation(occupation_id, wikidata_author_id, occupation_responses=None):
+
+    # occupations fetched ahead by fetch_author_data are not requested again
+    if occupation_responses is not None and occupation_id in occupation_responses:
+        wikidata_occupation_data_response_json = occupation_responses[occupation_id]
+    else:
+        wikidata_occupation_data_response_json = fetch_occupation_data(occupation_id)
     entry = build_wikidata_occupation_entry(wikidata_occupation_data_response_json, occupation_id, wikidata_author_id)
     with open(CATEGORIES_FILE, 'ab') as csvfile:
         writer = csv.DictWriter(csvfile, delimiter=';', fieldnames=wikidata_category_fieldnames, lineterminator='\n')
@@ -488,15 +495,29 @@ def extract_gnd_from_line(line):
     return None
 
 
-def get_wikidata_author_id_by_gnd(gnd, line):
+# responses stored by earlier releases are read first, repeated lookups are
+# served by the HTTP cache in common.process_http_query
+def load_wikidata_author_id_response(gnd, line):
 
     row = line.split(";")
-    wikidata_author_id_response_json = common.is_stored_as_json_file(
-        WIKIDATA_AUTHOR_DIR + common.SLASH + row[ONB_COL] + common.UNDERSCORE + gnd + '*')
+    response_json = common.find_stored_response(WIKIDATA_AUTHOR_DIR, row[ONB_COL] + common.UNDERSCORE + gnd, True)
+    if(response_json == None):
+        response_json = retrieve_wikidata_author_id(gnd).json()
+    return response_json
+
+
+def load_wikidata_author_data_response(author_id):
+
+    response_json = common.find_stored_response(common.WIKIDATA_AUTHOR_DATA_DIR, str(author_id))
+    if(response_json == None):
+        response_json = common.validate_response_json(retrieve_wikidata_author_data(author_id))
+    return response_json
+
+
+def get_wikidata_author_id_by_gnd(gnd, line, wikidata_author_id_response_json=None):
+
     if(wikidata_author_id_response_json == None):
-        print 'onb_wikidata not exists for ONB:', row[ONB_COL]
-        wikidata_author_id_response = retrieve_wikidata_author_id(gnd)
-        wikidata_author_id_response_json = wikidata_author_id_response.json()
+        wikidata_author_id_response_json = load_wikidata_author_id_response(gnd, line)
     wikidata_author_id = extract_wikidata_author_id(wikidata_author_id_response_json)
     print 'wikidata_author_id', wikidata_author_id
     store_wikidata_author_id(line, wikidata_author_id, gnd, wikidata_author_id_response_json)
@@ -584,39 +605,68 @@ def store_wikidata_band_data(band_id, response):
     common.write_json_file(WIKIDATA_BAND_DATA_DIR, str(band_id) + common.JSON_EXT, response)
 
 
-def store_author_data_by_gnd(inputfile, writer):
+# remote part of the author mapping for one GND ID, runs concurrently in batch_lookup
+def fetch_author_data(gnd, line):
+
+    wikidata_author_id_response_json = load_wikidata_author_id_response(gnd, line)
+    wikidata_author_id = extract_wikidata_author_id(wikidata_author_id_response_json)
+    wikidata_author_data_response_json = None
+    occupation_responses = {}
+    if wikidata_author_id:
+        wikidata_author_data_response_json = load_wikidata_author_data_response(wikidata_author_id)
+        # occupation responses are handed on to build_wikidata_author_entry
+        occupations = extract_property_value(wikidata_author_data_response_json, OCCUPATION_PROP)
+        for occupation in occupations.split(common.BLANK):
+            if occupation not in occupation_responses:
+                occupation_responses[occupation] = fetch_occupation_data(occupation)
+    return wikidata_author_id_response_json, wikidata_author_data_response_json, occupation_responses
+
+
+def store_author_data_by_gnd(inputfile, writer, workers=None):
 
     # GND cache contains aggregated GND IDs
     gnd_cache = []
 
     f = codecs.open(inputfile, 'r')
-    for idx, line in enumerate(f):
+    lines = [line for idx, line in enumerate(f) if idx > 0]
+    gnds = [extract_gnd_from_line(line) for line in lines]
+
+    # look up distinct GND IDs concurrently, results arrive in order of first appearance
+    distinct_gnds = batch_lookup.unique(gnds)
+    first_lines = {}
+    for line, gnd in zip(lines, gnds):
+        first_lines.setdefault(gnd, line)
+    results = batch_lookup.lookup_all(lambda gnd: fetch_author_data(gnd, first_lines[gnd]), distinct_gnds, workers)
+    fetched_count = 0
+    for line, gnd in zip(lines, gnds):
         print repr(line)
-        if idx > 0:
-            gnd = extract_gnd_from_line(line)
-            store_author_data(writer, gnd, gnd_cache, line)
+        # repeated GND IDs were fetched before and are served by the HTTP cache
+        fetched_data = None
+        if fetched_count < len(distinct_gnds) and gnd == distinct_gnds[fetched_count]:
+            fetched_data = next(results)
+            fetched_count += 1
+        store_author_data(writer, gnd, gnd_cache, line, fetched_data)
 
 
-def store_author_data(writer, gnd, gnd_cache, line):
+def store_author_data(writer, gnd, gnd_cache, line, fetched_data=None):
 
+    wikidata_author_id_response_json, wikidata_author_data_response_json, occupation_responses = \
+        fetched_data or (None, None, None)
     if gnd not in gnd_cache:
-        wikidata_author_id = get_wikidata_author_id_by_gnd(gnd, line)
+        wikidata_author_id = get_wikidata_author_id_by_gnd(gnd, line, wikidata_author_id_response_json)
         if(wikidata_author_id and wikidata_author_id not in gnd_cache):
             gnd_cache.append(wikidata_author_id)
-            wikidata_author_data_response_json = common.is_stored_as_json_file(
-                common.WIKIDATA_AUTHOR_DATA_DIR + common.SLASH + str(wikidata_author_id) + '*')
             if(wikidata_author_data_response_json == None):
-                print 'wikidata not exists for wikidata author ID:', wikidata_author_id
-                author_data_response = retrieve_wikidata_author_data(wikidata_author_id)
-                wikidata_author_data_response_json = common.validate_response_json(author_data_response) #author_data_response.json()
+                wikidata_author_data_response_json = load_wikidata_author_data_response(wikidata_author_id)
             store_wikidata_author_data(wikidata_author_id, wikidata_author_data_response_json)
-            entry = build_wikidata_author_entry(wikidata_author_data_response_json, line, wikidata_author_id)
+            entry = build_wikidata_author_entry(
+                wikidata_author_data_response_json, line, wikidata_author_id, occupation_responses)
             writer.writerow(entry)
 
 
 # Main mapping routine
 
-def map_records(inputfile, outputfile):
+def map_records(inputfile, outputfile, workers=None):
 
     print("Mapping", len(inputfile), "records in", outputfile)
     with codecs.open(CATEGORIES_FILE, 'w') as csvfile:
@@ -625,11 +675,13 @@ def map_records(inputfile, outputfile):
     with open(outputfile, 'w') as csvfile:
         writer = csv.DictWriter(csvfile, delimiter=';', fieldnames=common.wikidata_author_fieldnames, lineterminator='\n')
         writer.writeheader()
-        store_author_data_by_gnd(inputfile, writer)
+        store_author_data_by_gnd(inputfile, writer, workers)
 
 
 def retrieve_wikidata_entry_by_label_using_sparql(label):
 
+    # helper for SPARQL queries, loaded on first use
+    from SPARQLWrapper import SPARQLWrapper, JSON
     sparql = SPARQLWrapper("https://query.wikidata.org/bigdata/namespace/wdq/sparql")
     print 'Query label:', label
     query_string = \
@@ -657,7 +709,7 @@ def retrieve_wikidata_entry_by_label_using_sparql(label):
 
 # HTTP request for HTML content for particular URL
 def get_html(url):
-    r = requests.get(url)
+    r = http_client.get(url)
     print 'status code', r.status_code
     if r.status_code != 200:
         print("FAILURE: Request", r.url, "failed")
@@ -676,6 +728,9 @@ if __name__ == '__main__':
     parser.add_argument('-o', '--outputfile', type=str, nargs='?',
                     default="data/mapping.csv",
                     help="Output file")
+    parser.add_argument('-w', '--workers', type=int, nargs='?',
+                    default=batch_lookup.LOOKUP_WORKERS,
+                    help="Number of concurrent author lookups")
 
 
     if len(sys.argv) < 2:
@@ -683,4 +738,4 @@ if __name__ == '__main__':
         sys.exit(1)
 
     args = parser.parse_args()
-    map_records(args.inputfile, args.outputfile)
+    map_records(args.inputfile, args.outputfile, args.workers)
@@ -3,6 +3,9 @@
 ##
 
 import unittest
+import os
+import shutil
+import tempfile
 import wikidata_helper as wh
 import geo_location_helper as glh
 
@@ -31,6 +34,38 @@ class TestQueryMethods(unittest.TestCase):
 
 
     # Extract geo location information from IA event like
+class FakeResponse:
+
+    def __init__(self, content):
+        self.content = content
+
+
+class TestAuthorMapping(unittest.TestCase):
+
+    def test_occupations_are_requested_once_per_author(self):
+        requests = []
+        tmpdir = tempfile.mkdtemp()
+        saved = (wh.load_wikidata_author_id_response, wh.load_wikidata_author_data_response,
+                 wh.retrieve_wikidata_occupation, wh.CATEGORIES_FILE)
+        try:
+            wh.load_wikidata_author_id_response = lambda gnd, line: {wh.ITEMS_JSON: [7304]}
+            wh.load_wikidata_author_data_response = lambda author_id: {
+                wh.PROPS_JSON: {str(wh.OCCUPATION_PROP): [[7304, 'item', 36834], [7304, 'item', 486748]]}}
+            def retrieve_wikidata_occupation(occupation_id):
+                requests.append(occupation_id)
+                return FakeResponse('{}')
+            wh.retrieve_wikidata_occupation = retrieve_wikidata_occupation
+            wh.CATEGORIES_FILE = os.path.join(tmpdir, 'categories.csv')
+            author_id_json, author_data_json, occupation_responses = wh.fetch_author_data('118576291', 'line')
+            for occupation in wh.extract_property_value(author_data_json, wh.OCCUPATION_PROP).split(' '):
+                wh.add_occupation(occupation, 7304, occupation_responses)
+            self.assertEqual(requests, ['36834', '486748'])
+        finally:
+            (wh.load_wikidata_author_id_response, wh.load_wikidata_author_data_response,
+             wh.retrieve_wikidata_occupation, wh.CATEGORIES_FILE) = saved
+            shutil.rmtree(tmpdir)
+
+
 if __name__ == '__main__':
     unittest.main()
     